@@ -0,0 +1,74 @@
+"""
+Benchmark appending and scanning a year of 10 second samples in the history file
+
+Run from the source root: python benchmarks/bench_history_file.py [-c CURRENCIES] [-d DAYS]
+
+Emil Rekola <emil.rekola@hotmail.com>
+"""
+
+# STD imports
+import sys
+import random
+import argparse
+import tempfile
+from pathlib import Path
+from time import perf_counter, time
+
+# Make the package importable without installing it
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+# Local imports
+from cryptalert.data_fetcher.history_file import HistoryFile, RECORD
+from cryptalert.data_fetcher.rates import MarketSnapshot, MarketStatus, RateSnapshot
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-c", "--currencies", type=int, default=1, help="Number of currencies per fetch")
+    parser.add_argument("-d", "--days", type=float, default=365, help="Days of samples")
+    parser.add_argument("-i", "--interval", type=float, default=10, help="Seconds between samples")
+    args = parser.parse_args()
+
+    fetches = int(args.days * 86400 / args.interval)
+    currencies = [f"C{num}" for num in range(args.currencies)]
+    start_time = time() - fetches * args.interval
+
+    with tempfile.TemporaryDirectory() as directory:
+        history_file = HistoryFile(Path(directory) / "history.bin", batch_size=4096, max_size=1 << 40)
+
+        start = perf_counter()
+        for fetch in range(fetches):
+            price = 30000 + random.random()
+            snapshot = MarketSnapshot(
+                {currency: RateSnapshot(price, price, 0.0, price) for currency in currencies},
+                MarketStatus(0.0, True)
+            )
+            history_file.append(start_time + fetch * args.interval, snapshot)
+
+        history_file.flush()
+        append_time = perf_counter() - start
+
+        # Every fetch writes a record per currency and one for the market status
+        records = len(history_file)
+        size_mb = records * RECORD.size / (1 << 20)
+        print(f"Appended {records} records ({fetches} per currency and {fetches} market status records, "
+              f"{size_mb:.1f} MB) in {append_time:.2f} s ({records / append_time:,.0f} records/s)")
+
+        start = perf_counter()
+        scanned = sum(1 for _ in history_file.scan())
+        scan_time = perf_counter() - start
+        print(f"Scanned {scanned} records in {scan_time:.2f} s ({scanned / scan_time:,.0f} records/s)")
+
+        start = perf_counter()
+        lookups = 10000
+        for _ in range(lookups):
+            history_file.value_at(currencies[0], "buy", start_time + random.random() * fetches * args.interval)
+
+        lookup_time = perf_counter() - start
+        print(f"{lookups} point lookups in {lookup_time:.3f} s ({lookup_time / lookups * 1e6:.1f} us/lookup)")
+
+        history_file.close()
+
+
+if __name__ == '__main__':
+    main()
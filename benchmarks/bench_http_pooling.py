@@ -0,0 +1,134 @@
+"""
+Benchmark per-fetch latency against a local stub HTTP server without a session and with the pooled keep-alive session
+the data fetcher creates, using the configured pool size and timeouts. The stub serves plain HTTP so TLS handshakes,
+which pooling saves too, are not measured
+
+Run from the source root: python benchmarks/bench_http_pooling.py [-n FETCHES] [-- FETCHER OPTIONS]
+
+Emil Rekola <emil.rekola@hotmail.com>
+"""
+
+# STD imports
+import sys
+import json
+import argparse
+import statistics
+from pathlib import Path
+from threading import Event, Thread
+from time import perf_counter
+from typing import Callable, List, Tuple
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# 3rd-party imports
+import requests
+
+# Make the package importable without installing it
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+# Local imports
+from cryptalert.config import Config
+from cryptalert.data_fetcher.api_accessor import ApiAccessor
+from cryptalert.data_fetcher.timing import connect_time, reset_connect_time
+
+# Payload shaped like the coinmotion /v2/rates response
+PAYLOAD = json.dumps({
+    "success": True,
+    "payload": {
+        **{
+            f"{currency}Eur": {
+                "buy": "100.00",
+                "sell": "99.00",
+                "fchangep": "1.00",
+                "fhigh": "101.00",
+                "currencyCode": currency.upper()
+            }
+            for currency in ["btc", "eth", "ltc", "xrp", "xlm", "aave", "link", "usdc", "uni"]
+        },
+        "market": {"changeAmount": 1.0, "changeSign": True}
+    }
+}).encode()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Serve the same payload for every GET request, HTTP/1.1 is needed for keep-alive
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    # Headers and body are written separately, Nagle would delay the body on a kept-alive connection
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(PAYLOAD)))
+        self.end_headers()
+        self.wfile.write(PAYLOAD)
+
+    def log_message(self, *args):
+        pass
+
+
+def measure(fetch: Callable[[], requests.Response], count: int) -> Tuple[List[float], int]:
+    """
+    Time the given fetch function
+
+    :param fetch: Function making a single request
+    :param count: Number of requests to make
+    :return: Latencies of every request in milliseconds and the number of connections opened by the fetcher session
+    """
+
+    latencies = []
+    connects = 0
+
+    for _ in range(count):
+        reset_connect_time()
+        start = perf_counter()
+        fetch().json()
+        latencies.append((perf_counter() - start) * 1000)
+        connects += connect_time() > 0
+
+    return latencies, connects
+
+
+def report(name: str, latencies: List[float], connects: str = "-") -> None:
+    """
+    Print latency statistics
+    """
+
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"{name:<16} mean {statistics.mean(latencies):7.3f} ms  "
+          f"median {statistics.median(latencies):7.3f} ms  p95 {p95:7.3f} ms  connections opened {connects}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--fetches", type=int, default=500, help="Number of fetches per mode")
+    parser.add_argument("fetcher_options", nargs=argparse.REMAINDER,
+                        help="Options of the application after '--', e.g. -- --pool-size 4 --read-timeout 5")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    address = f"http://127.0.0.1:{server.server_port}/v2/rates"
+
+    # Session, pool and timeouts are built by the data fetcher from the configuration and the given options
+    options = [option for option in args.fetcher_options if option != "--"]
+    sys.argv = ["cryptalert", "--headless", "--sources", "coinmotion", "--api-address", address, *options]
+    accessor = ApiAccessor(Config().get_args(), Event())
+    session, timeout = accessor._session, accessor.timeout
+
+    print(f"Plain HTTP against a local stub, TLS is out of scope. Pool size {accessor.pool_size}, timeouts {timeout}")
+
+    report("requests.get", measure(lambda: requests.get(address, timeout=timeout), args.fetches)[0])
+    latencies, connects = measure(lambda: session.get(address, timeout=timeout), args.fetches)
+    report("fetcher session", latencies, str(connects))
+
+    session.close()
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""
+Benchmark the import time of every operation mode with 'python -X importtime' and check it against the startup budget
+of the mode. Exits with status 1 if a mode is over its budget or imports modules it should not need
+
+Run from the source root: python benchmarks/bench_import_time.py [-n RUNS] [-m MODE ...]
+
+Emil Rekola <emil.rekola@hotmail.com>
+"""
+
+# STD imports
+import sys
+import argparse
+import statistics
+import subprocess
+from pathlib import Path
+from collections import defaultdict
+from typing import Dict, List, NamedTuple, Tuple
+
+
+class Mode(NamedTuple):
+    """
+    Modules imported by the application in an operation mode, its import budget and modules it must not import
+    """
+
+    modules: Tuple[str, ...]
+    budget_ms: float
+    forbidden: Tuple[str, ...]
+
+
+# Budgets leave room for slower machines, the point is to catch frontends being imported by modes that don't use them
+MODES: Dict[str, Mode] = {
+    "headless": Mode(
+        ("cryptalert.app", "cryptalert.data_fetcher.api_accessor", "cryptalert.http_api.server"),
+        150.0,
+        ("discord", "aiohttp", "asyncio", "curses", "numpy", "importlib.metadata")
+    ),
+    "tui": Mode(
+        ("cryptalert.app", "cryptalert.data_fetcher.api_accessor", "cryptalert.text_ui.tui"),
+        150.0,
+        ("discord", "aiohttp", "asyncio", "numpy", "importlib.metadata")
+    ),
+    "bot": Mode(
+        ("cryptalert.app", "cryptalert.data_fetcher.api_accessor", "cryptalert.discord_bot.bot"),
+        450.0,
+        ("curses", "numpy", "importlib.metadata")
+    ),
+    "bot-async": Mode(
+        ("cryptalert.app", "cryptalert.data_fetcher.async_api_accessor", "cryptalert.discord_bot.bot"),
+        450.0,
+        ("curses", "numpy", "importlib.metadata")
+    ),
+    "tui-bot": Mode(
+        ("cryptalert.app", "cryptalert.data_fetcher.api_accessor", "cryptalert.text_ui.tui",
+         "cryptalert.discord_bot.bot"),
+        500.0,
+        ("numpy", "importlib.metadata")
+    ),
+}
+
+ROOT = Path(__file__).parent.parent
+MARKER = "-- mode imports start --"
+
+
+class ImportProfile(NamedTuple):
+    """
+    Parsed output of a single 'python -X importtime' run
+    """
+
+    total_us: int
+    modules: Tuple[str, ...]
+    heaviest: List[Tuple[str, int]]
+
+
+def profile(modules: Tuple[str, ...]) -> ImportProfile:
+    """
+    Import the given modules in a fresh interpreter and parse the import times
+
+    :param modules: Modules to import
+    :return: Total import time, every imported module and the heaviest modules imported by the package itself
+    """
+
+    # Imports done by the interpreter on startup are left out by writing a marker before the measured imports
+    code = f"import sys; sys.stderr.write({MARKER!r} + '\\n'); " + "; ".join(f"import {name}" for name in modules)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code], cwd=ROOT, capture_output=True, text=True, check=True
+    )
+
+    lines = result.stderr.split(MARKER, 1)[1].splitlines()
+    total = 0
+    imported = []
+    heaviest = []
+
+    # Lines are written after the imports they contain, children are collected per nesting level
+    children: Dict[int, List[Tuple[str, int]]] = defaultdict(list)
+
+    for line in lines:
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+
+        _, cumulative, name = line.split("|")
+        level = (len(name) - len(name.lstrip()) - 1) // 2
+        name = name.strip()
+        cumulative = int(cumulative)
+        nested = children.pop(level + 1, [])
+
+        if name.startswith("cryptalert"):
+            heaviest.extend(child for child in nested if not child[0].startswith("cryptalert"))
+
+        if level == 0:
+            total += cumulative
+
+        imported.append(name)
+        children[level].append((name, cumulative))
+
+    heaviest.sort(key=lambda item: item[1], reverse=True)
+
+    return ImportProfile(total, tuple(imported), heaviest[:5])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--runs", type=int, default=5, help="Runs per mode, median is compared to the budget")
+    parser.add_argument("-m", "--modes", nargs="+", choices=list(MODES), default=list(MODES), help="Modes to run")
+    args = parser.parse_args()
+
+    failed = False
+
+    for name in args.modes:
+        mode = MODES[name]
+        profiles = [profile(mode.modules) for _ in range(args.runs)]
+        median_ms = statistics.median(run.total_us for run in profiles) / 1000
+
+        forbidden = [
+            prefix for prefix in mode.forbidden
+            if any(module == prefix or module.startswith(f"{prefix}.") for module in profiles[0].modules)
+        ]
+
+        status = "OK"
+        if median_ms > mode.budget_ms or forbidden:
+            status = "FAIL"
+            failed = True
+
+        print(f"{name:10} {median_ms:8.1f} ms (budget {mode.budget_ms:.0f} ms) {status}")
+
+        for module, cumulative in profiles[0].heaviest:
+            print(f"{'':10} {cumulative / 1000:8.1f} ms  {module}")
+
+        if forbidden:
+            print(f"{'':10} imports modules the mode does not need: {', '.join(forbidden)}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
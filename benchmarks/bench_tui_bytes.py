@@ -0,0 +1,168 @@
+"""
+Benchmark the bytes the TUI writes to the terminal per minute. The TUI is run in a pseudo terminal against a stand-in
+data fetcher that publishes snapshots at the given interval, by default nothing is published so the data is idle
+
+Run from the source root: python benchmarks/bench_tui_bytes.py [-d SECONDS] [-p PUBLISH_INTERVAL] [--change]
+
+Emil Rekola <emil.rekola@hotmail.com>
+"""
+
+# STD imports
+import os
+import sys
+import pty
+import fcntl
+import random
+import select
+import struct
+import argparse
+import termios
+import subprocess
+from pathlib import Path
+from threading import Event, Thread
+from time import monotonic, time
+from types import MappingProxyType
+
+# Make the package importable without installing it
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+# Local imports
+from cryptalert.data_fetcher.history import HistoryStore
+from cryptalert.data_fetcher.indicators import IndicatorEngine
+from cryptalert.data_fetcher.metrics import FetchMetrics
+from cryptalert.data_fetcher.rates import MarketSnapshot, MarketStatus, RateSnapshot
+from cryptalert.data_fetcher.snapshot_bus import SnapshotBus
+
+# Time given to the TUI for the first full paint before measuring
+WARMUP = 2.0
+
+
+class StandInAccessor:
+    """
+    Class providing the parts of the data fetcher the TUI reads, snapshots are published by the benchmark
+    """
+
+    def __init__(self, currencies: int):
+        self.bus: SnapshotBus = SnapshotBus()
+        self.history: HistoryStore = HistoryStore(1000)
+        self.indicators: IndicatorEngine = IndicatorEngine([10, 60])
+        self.metrics: FetchMetrics = FetchMetrics()
+        self.currencies = [f"C{num:02d}" for num in range(currencies)]
+        self.consecutive_failures: int = 0
+        self.degraded: bool = False
+        self._prices = {currency: random.uniform(1, 50000) for currency in self.currencies}
+
+    @property
+    def api_data(self):
+        snapshot = self.bus.latest
+        return snapshot.data if snapshot is not None else None
+
+    def publish(self, change: bool) -> None:
+        """
+        Publish a snapshot, with 'change' the price of one currency moves
+        """
+
+        if change:
+            currency = random.choice(self.currencies)
+            self._prices[currency] *= random.uniform(0.99, 1.01)
+
+        rates = {
+            currency: RateSnapshot(price, price * 0.99, 1.5, price * 1.1) for currency, price in self._prices.items()
+        }
+        data = MarketSnapshot(MappingProxyType(rates), MarketStatus(2.5, True))
+
+        timestamp = time()
+        self.history.append(timestamp, data)
+        self.indicators.update(data)
+        self.bus.publish(timestamp, data)
+
+
+def child(args) -> None:
+    """
+    Run the TUI inside the pseudo terminal
+    """
+
+    # Imported here so that the parent process does not initialize curses
+    from cryptalert.text_ui.tui import TUI
+
+    accessor = StandInAccessor(args.currencies)
+    accessor.publish(True)
+    exit_flag = Event()
+
+    def publish():
+        while not exit_flag.wait(args.publish_interval):
+            accessor.publish(args.change)
+
+    if args.publish_interval > 0:
+        Thread(target=publish, daemon=True).start()
+
+    TUI(exit_flag, accessor).start()
+
+
+def read_for(master: int, seconds: float) -> int:
+    """
+    Read everything the TUI writes during the given time
+
+    :return: Number of bytes read
+    """
+
+    total = 0
+    deadline = monotonic() + seconds
+
+    while (remaining := deadline - monotonic()) > 0:
+        if select.select([master], [], [], remaining)[0]:
+            try:
+                total += len(os.read(master, 65536))
+
+            except OSError:
+                break
+
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-d", "--duration", type=float, default=20.0, help="Seconds to measure")
+    parser.add_argument("-p", "--publish-interval", type=float, default=0.0,
+                        help="Seconds between published snapshots, 0 publishes nothing after the first snapshot")
+    parser.add_argument("--change", action="store_true", help="Move the price of one currency in every snapshot")
+    parser.add_argument("-c", "--currencies", type=int, default=9, help="Number of currencies")
+    parser.add_argument("--rows", type=int, default=40, help="Height of the terminal")
+    parser.add_argument("--columns", type=int, default=120, help="Width of the terminal")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args)
+        return
+
+    master, slave = pty.openpty()
+    fcntl.ioctl(slave, termios.TIOCSWINSZ, struct.pack("HHHH", args.rows, args.columns, 0, 0))
+
+    process = subprocess.Popen(
+        [sys.executable, __file__, "--child", *sys.argv[1:]],
+        stdin=slave, stdout=slave, stderr=slave, start_new_session=True,
+        env={**os.environ, "TERM": "xterm-256color"}
+    )
+    os.close(slave)
+
+    # TUI runs in its own session, it gets no hangup if the benchmark is interrupted and must be stopped here
+    try:
+        initial = read_for(master, WARMUP)
+        measured = read_for(master, args.duration)
+
+        os.write(master, b"q")
+        process.wait(10)
+
+    finally:
+        if process.poll() is None:
+            process.kill()
+
+        os.close(master)
+
+    print(f"First paint: {initial} bytes")
+    print(f"Measured {args.duration:.0f} s: {measured} bytes, {measured * 60 / args.duration:.0f} bytes per minute")
+
+
+if __name__ == '__main__':
+    main()
@@ -5,17 +5,36 @@ Emil Rekola <emil.rekola@hotmail.com>
 """
 
 from pathlib import Path
-from importlib import metadata
 
-VERSION = None
 
-# Read version on startup
-_version_file = Path(__file__).parent.parent / "VERSION"
+def _read_version() -> str:
+    """
+    Read the version from the VERSION file or from the installation metadata if the package was installed
 
-# If package was not installed -> read file
-if _version_file.exists():
-    VERSION = _version_file.open("r").readline().strip()
+    :return: Version string
+    """
 
-# Package was installed -> read version from installation metadata
-else:
-    VERSION = metadata.version("Cryptalert")
+    version_file = Path(__file__).parent.parent / "VERSION"
+
+    # If package was not installed -> read file
+    if version_file.exists():
+        with version_file.open("r") as file:
+            return file.readline().strip()
+
+    # Package was installed -> read version from installation metadata, importing the metadata is slow so it is
+    # done only when the version is needed
+    from importlib import metadata
+
+    return metadata.version("Cryptalert")
+
+
+def __getattr__(name: str):
+    """
+    Read the version on first access instead of on startup
+    """
+
+    if name == "VERSION":
+        globals()["VERSION"] = version = _read_version()
+        return version
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
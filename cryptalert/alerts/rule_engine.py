@@ -0,0 +1,291 @@
+"""
+Rule engine for alerting users when rates cross thresholds or move too much in a short time
+
+Emil Rekola <emil.rekola@hotmail.com>
+"""
+
+# STD imports
+import math
+from bisect import bisect_right, insort
+from itertools import count
+from threading import Lock
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
+
+# Local imports
+from cryptalert.data_fetcher.history import HistoryStore
+from cryptalert.data_fetcher.rates import MarketSnapshot, RATE_FIELDS
+
+# Fields of a currency that rules can watch
+RULE_FIELDS: Tuple[str, ...] = RATE_FIELDS
+
+
+class ThresholdRule(NamedTuple):
+    """
+    Rule that triggers when the value of a field crosses the threshold, e.g. 'BTC buy < 30000'
+    """
+
+    rule_id: int
+    channel_id: int
+    currency: str
+    field: str
+    above: bool
+    threshold: float
+
+    def describe(self) -> str:
+        return f"#{self.rule_id}: {self.currency} {self.field} {'>' if self.above else '<'} {self.threshold}"
+
+
+class ChangeRule(NamedTuple):
+    """
+    Rule that triggers when the value of a field moves more than given percents within given minutes, for
+    'changePercent' the move is measured in percentage points
+    """
+
+    rule_id: int
+    channel_id: int
+    currency: str
+    field: str
+    percent: float
+    minutes: float
+
+    def describe(self) -> str:
+        return f"#{self.rule_id}: {self.currency} {self.field} moves {self.percent}% in {self.minutes} min"
+
+
+Rule = Union[ThresholdRule, ChangeRule]
+
+
+class Alert(NamedTuple):
+    """
+    Triggered rule with the values that triggered it
+    """
+
+    rule: Rule
+    value: float
+    previous: float
+
+    def message(self) -> str:
+        return f"Alert {self.rule.describe()} (was {self.previous}, now {self.value})"
+
+
+class _SortedRules:
+    """
+    Rules kept sorted by a key so that the rules within a key range can be found with a binary search
+    """
+
+    def __init__(self):
+        self.keys: List[Tuple[float, int]] = []
+        self.rules: Dict[int, Rule] = {}
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def add(self, key: float, rule: Rule) -> None:
+        insort(self.keys, (key, rule.rule_id))
+        self.rules[rule.rule_id] = rule
+
+    def remove(self, key: float, rule: Rule) -> None:
+        self.keys.pop(bisect_right(self.keys, (key, rule.rule_id)) - 1)
+        del self.rules[rule.rule_id]
+
+    def between(self, low: float, high: float) -> List[Rule]:
+        """
+        Get rules with a key in range (low, high]
+        """
+
+        start = bisect_right(self.keys, (low, math.inf))
+        end = bisect_right(self.keys, (high, math.inf))
+
+        return [self.rules[rule_id] for _, rule_id in self.keys[start:end]]
+
+
+class AlertEngine:
+    """
+    Class for storing alert rules in per currency indexes and evaluating them against fetched data, only the
+    rules whose thresholds were crossed are visited
+    """
+
+    def __init__(self, history: HistoryStore):
+        self._history: HistoryStore = history
+        self._rule_ids = count(1)
+        self._lock: Lock = Lock()
+        self._rules: Dict[int, Rule] = {}
+
+        # (currency, field) -> thresholds crossed upwards/downwards
+        self._above: Dict[Tuple[str, str], _SortedRules] = {}
+        self._below: Dict[Tuple[str, str], _SortedRules] = {}
+
+        # (currency, field, minutes) -> change rules sorted by percent
+        self._changes: Dict[Tuple[str, str, float], _SortedRules] = {}
+        self._change_fired: Dict[int, float] = {}
+
+        # Values from the previous evaluation, thresholds are crossed between these and the current values
+        self._prev_values: Dict[Tuple[str, str], float] = {}
+
+    def __len__(self) -> int:
+        return len(self._rules)
+
+    def add_threshold_rule(self, channel_id: int, currency: str, field: str, above: bool,
+                           threshold: float) -> ThresholdRule:
+        """
+        Add a rule that triggers when a threshold is crossed
+
+        :param channel_id: Channel to send the alert to
+        :param currency: Currency code e.g. 'BTC'
+        :param field: One of 'RULE_FIELDS'
+        :param above: True if the rule triggers on rising above the threshold, False for dropping below
+        :param threshold: Threshold value
+        :return: Added rule
+        """
+
+        with self._lock:
+            rule = ThresholdRule(next(self._rule_ids), channel_id, currency, field, above, threshold)
+            index = self._above if above else self._below
+            index.setdefault((currency, field), _SortedRules()).add(threshold, rule)
+            self._rules[rule.rule_id] = rule
+
+        return rule
+
+    def add_change_rule(self, channel_id: int, currency: str, field: str, percent: float,
+                        minutes: float) -> ChangeRule:
+        """
+        Add a rule that triggers when a value moves too much in a short time
+
+        :param channel_id: Channel to send the alert to
+        :param currency: Currency code e.g. 'BTC'
+        :param field: One of 'RULE_FIELDS'
+        :param percent: Move in percents (percentage points for 'changePercent') needed for triggering
+        :param minutes: Time window of the move
+        :return: Added rule
+        """
+
+        with self._lock:
+            rule = ChangeRule(next(self._rule_ids), channel_id, currency, field, percent, minutes)
+            self._changes.setdefault((currency, field, minutes), _SortedRules()).add(percent, rule)
+            self._rules[rule.rule_id] = rule
+
+        return rule
+
+    def remove_rule(self, rule_id: int, channel_id: int) -> Optional[Rule]:
+        """
+        Remove a rule of a channel, rules of other channels are never removed
+
+        :param rule_id: ID of the rule
+        :param channel_id: Channel the rule must send its alerts to
+        :return: Removed rule or None if the channel had no such rule
+        """
+
+        with self._lock:
+            rule = self._rules.get(rule_id)
+
+            if rule is None or rule.channel_id != channel_id:
+                return None
+
+            del self._rules[rule_id]
+
+            if isinstance(rule, ThresholdRule):
+                index = self._above if rule.above else self._below
+                index[(rule.currency, rule.field)].remove(rule.threshold, rule)
+
+            elif isinstance(rule, ChangeRule):
+                self._changes[(rule.currency, rule.field, rule.minutes)].remove(rule.percent, rule)
+                self._change_fired.pop(rule_id, None)
+
+        return rule
+
+    def rules_for_channel(self, channel_id: int) -> List[Rule]:
+        """
+        Get the rules that send alerts to a channel
+
+        :param channel_id: ID of the channel
+        :return: Rules ordered by ID
+        """
+
+        return [rule for rule in self._rules.values() if rule.channel_id == channel_id]
+
+    def evaluate(self, timestamp: float, snapshot: MarketSnapshot) -> List[Alert]:
+        """
+        Evaluate rules against freshly fetched data
+
+        :param timestamp: Unix time of the fetch
+        :param snapshot: Data parsed by 'ApiAccessor'
+        :return: Triggered alerts
+        """
+
+        alerts = []
+
+        with self._lock:
+            for key in self._above.keys() | self._below.keys():
+                alerts.extend(self._evaluate_thresholds(key, snapshot))
+
+            for key, rules in self._changes.items():
+                if rules:
+                    alerts.extend(self._evaluate_changes(key, rules, timestamp, snapshot))
+
+        return alerts
+
+    def _evaluate_thresholds(self, key: Tuple[str, str], snapshot: MarketSnapshot) -> List[Alert]:
+        """
+        Find the threshold rules of a currency field that were crossed since the previous evaluation
+        """
+
+        currency, field = key
+
+        if currency not in snapshot.rates:
+            return []
+
+        value = snapshot.rates[currency].get(field)
+        previous = self._prev_values.get(key)
+        self._prev_values[key] = value
+
+        if previous is None or math.isnan(value) or value == previous:
+            return []
+
+        alerts = []
+
+        # Rising crosses thresholds in (previous, value], dropping crosses thresholds in (value, previous]
+        if value > previous and key in self._above:
+            alerts = [Alert(rule, value, previous) for rule in self._above[key].between(previous, value)]
+
+        elif value < previous and key in self._below:
+            alerts = [Alert(rule, value, previous) for rule in self._below[key].between(value, previous)]
+
+        return alerts
+
+    def _evaluate_changes(self, key: Tuple[str, str, float], rules: _SortedRules, timestamp: float,
+                          snapshot: MarketSnapshot) -> List[Alert]:
+        """
+        Find the change rules of a currency field and time window whose limit the move exceeded
+        """
+
+        currency, field, minutes = key
+        history = self._history.get(currency)
+
+        if currency not in snapshot.rates or history is None:
+            return []
+
+        value = snapshot.rates[currency].get(field)
+        previous = history.value_at(field, timestamp - minutes * 60)
+
+        if previous is None or math.isnan(value) or math.isnan(previous):
+            return []
+
+        # Change percent is already relative, move of prices is measured relative to the earlier price
+        if field == "changePercent":
+            move = abs(value - previous)
+
+        elif previous != 0:
+            move = abs(value - previous) / abs(previous) * 100
+
+        else:
+            return []
+
+        alerts = []
+
+        # Every rule with a limit below the move is triggered, unless it already triggered within its time window
+        for rule in rules.between(-math.inf, move):
+            if timestamp - self._change_fired.get(rule.rule_id, -math.inf) >= minutes * 60:
+                self._change_fired[rule.rule_id] = timestamp
+                alerts.append(Alert(rule, value, previous))
+
+        return alerts
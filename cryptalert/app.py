@@ -6,10 +6,11 @@ Emil Rekola <emil.rekola@hotmail.com>
 
 
 # Local imports
-import asyncio
+import signal
 import logging
-from time import sleep
+from time import monotonic
 from threading import Thread, Event
+from concurrent.futures import TimeoutError as FutureTimeout
 
 # 3rd-party imports
 from configargparse import Namespace
@@ -17,9 +18,9 @@ from configargparse import Namespace
 # Local imports
 from cryptalert.exceptions import ApiAddressException, UnsupportedOperationModeException
 from cryptalert.config import Config
-from cryptalert.data_fetcher.api_accessor import ApiAccessor
-from cryptalert.discord_bot.bot import CryptalertBot
-from cryptalert.text_ui.tui import TUI
+
+# Data fetchers, the Discord bot and the TUI are imported only when the configured mode needs them, e.g. discord.py
+# and aiohttp are not loaded at all when only the TUI is enabled
 
 
 class Application:
@@ -32,10 +33,14 @@ class Application:
         self.args: Namespace = Config().get_args()
         self.exit_flag: Event = Event()
         self.start_bot: bool = False
-        self.api_accessor = ApiAccessor(self.args, self.exit_flag)
+        self.async_fetcher: bool = False
+        self.api_accessor = None
+        self.http_server = None
+        self._writer_thread = None
         self._logger = logging.getLogger("Cryptalert")
         self.loop = None
         self.bot = None
+        self._fetch_task = None
 
     def run(self):
         """
@@ -45,32 +50,55 @@ class Application:
         print("Starting Cryptalert...")
 
         self.check_config()
+        self.api_accessor = self._create_api_accessor()
+        self._start_http_server()
+        self._start_shared_writer()
 
-        # Create a thread for the data fetcher
-        self._logger.info("Starting ApiAccessor thread")
-        api_thread = Thread(target=self.api_accessor.start)
-        api_thread.start()
+        api_thread = None
 
-        self.api_accessor.data_ready.wait()
+        # The asynchronous data fetcher is started as a task on the bot's event loop later on
+        if not self.async_fetcher:
+
+            # Create a thread for the data fetcher
+            self._logger.info("Starting ApiAccessor thread")
+            api_thread = Thread(target=self.api_accessor.start, name="ApiAccessor", daemon=True)
+            api_thread.start()
+
+            self.api_accessor.data_ready.wait()
+
+            if not self.api_accessor.api_data:
+                self._logger.error("No data could be fetched, starting in degraded state")
 
         if self.start_bot and self.args.enable_tui:
             self._logger.info("Starting both Discord bot and TUI")
-            self.bot = CryptalertBot(self.args, self.api_accessor)
-            self.loop = asyncio.get_event_loop()
+            self._create_bot()
             self._start_tui_and_bot()
 
         elif self.start_bot:
-            self.bot = CryptalertBot(self.args, self.api_accessor)
+            self._create_bot()
             self._start_bot_only()
 
         elif self.args.enable_tui:
             self._start_tui()
 
-        if self.args.enable_tui:
-            print("Closing API data fetcher thread...")
+        else:
+            self._start_headless()
 
-        self._logger.info("Waiting for ApiAccessor thread to join")
-        api_thread.join()
+        if api_thread is not None:
+            if self.args.enable_tui:
+                print("Closing API data fetcher thread...")
+
+            # Stop flag wakes the fetcher, only a fetch that is in progress can delay the thread
+            self._logger.info("Waiting for ApiAccessor thread to join")
+            self._wait_stopped("ApiAccessor", self.api_accessor.stopped.wait, monotonic())
+
+        if self.http_server is not None:
+            self._wait_stopped("HTTP server", self.http_server.stop, monotonic())
+
+        if self._writer_thread is not None:
+            thread = self._writer_thread
+            self._wait_stopped("Shared memory writer", lambda timeout: thread.join(timeout) or not thread.is_alive(),
+                               monotonic())
 
         if self.args.enable_tui:
             print("Shutdown complete!")
@@ -82,46 +110,209 @@ class Application:
         Start the text UI
         """
 
+        from cryptalert.text_ui.tui import TUI
+
         self._logger.info("Starting TUI")
-        TUI(self.exit_flag, self.api_accessor).start()
+        TUI(self.exit_flag, self.api_accessor, self.args.sparkline_span * 60).start()
         self.exit_flag.wait()
 
+    def _start_headless(self) -> None:
+        """
+        Run only the data fetcher and the HTTP endpoint until interrupted
+        """
+
+        self._logger.info("Running headless")
+
+        # Service managers stop the application with SIGTERM, handle it like Ctrl+C
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.exit_flag.set())
+
+        try:
+            self.exit_flag.wait()
+
+        except KeyboardInterrupt:
+            self.exit_flag.set()
+
+    def _start_http_server(self) -> None:
+        """
+        Start the HTTP endpoint serving snapshots and metrics if a port was configured
+        """
+
+        if self.args.http_port is None:
+            return
+
+        from cryptalert.http_api.server import SnapshotHTTPServer
+
+        self.http_server = SnapshotHTTPServer(self.args.http_address, self.args.http_port, self.api_accessor)
+        self.http_server.start()
+
+    def _start_shared_writer(self) -> None:
+        """
+        Start sharing the snapshots with worker processes if a shared memory segment was configured
+        """
+
+        if self.args.shared_memory is None or self.args.worker:
+            return
+
+        from cryptalert.data_fetcher.shared_snapshot import SharedSnapshotWriter
+
+        writer = SharedSnapshotWriter(self.args.shared_memory)
+        self._writer_thread = Thread(target=writer.run, args=(self.api_accessor, self.exit_flag),
+                                     name="SharedMemory", daemon=True)
+        self._writer_thread.start()
+
+    def _start_async_fetcher(self) -> None:
+        """
+        Create the data fetching task on the Discord bot event loop if the asynchronous data fetcher is used
+        """
+
+        if self.async_fetcher:
+            self._logger.info("Creating data fetching task on the Discord bot event loop")
+            self._fetch_task = self.bot.loop.create_task(self.api_accessor.start())
+
     def _start_bot_only(self) -> None:
         """
         Start the Discord bot and set the shutdown flag on exit
         """
 
+        self._start_async_fetcher()
+
+        # Pending tasks, including the data fetching task, are cancelled by the bot when it closes
         self._logger.info("Starting Discord bot")
         self.bot.run(self.args.bot_token)
         self.exit_flag.set()
 
+    def _create_bot(self) -> None:
+        """
+        Import and create the Discord bot, discord.py is imported only if the bot is enabled
+        """
+
+        import asyncio
+        from cryptalert.discord_bot.bot import CryptalertBot
+
+        self.bot = CryptalertBot(self.args, self.api_accessor)
+        self.loop = asyncio.get_event_loop()
+
+    def _create_api_accessor(self):
+        """
+        Import and create the configured data fetcher
+
+        :return: 'SharedMemoryAccessor' in worker mode, 'AsyncApiAccessor' if the asynchronous data fetcher is used,
+            otherwise 'ApiAccessor'
+        """
+
+        if self.args.worker:
+            from cryptalert.data_fetcher.worker_accessor import SharedMemoryAccessor
+            return SharedMemoryAccessor(self.args, self.exit_flag)
+
+        if self.async_fetcher:
+            from cryptalert.data_fetcher.async_api_accessor import AsyncApiAccessor
+            return AsyncApiAccessor(self.args, self.exit_flag)
+
+        from cryptalert.data_fetcher.api_accessor import ApiAccessor
+        return ApiAccessor(self.args, self.exit_flag)
+
     def _start_tui_and_bot(self) -> None:
         """
         Start the Discord bot on a separate thread and shut it down on TUI exit
         """
 
+        self._start_async_fetcher()
         self.loop.create_task(self.bot.start(self.args.bot_token))
 
         self._logger.info("Starting Discord bot thread")
         bot_thread = Thread(target=self.loop.run_forever, name="Discord")
         bot_thread.start()
 
+        # TUI needs the first batch of data before it can be initialized
+        self.api_accessor.data_ready.wait()
+
         self._start_tui()
 
+        started = monotonic()
+
+        if self._fetch_task is not None:
+            self._logger.info("Cancelling data fetching task")
+            self.loop.call_soon_threadsafe(self._fetch_task.cancel)
+            self._wait_stopped("Data fetching task", self.api_accessor.stopped.wait, started)
+
         print("Closing Discord bot thread...")
-        self._logger.info("Creating 'close' task for Discord bot")
-        self.bot.loop.create_task(self.bot.close())
+        self._logger.info("Closing Discord bot")
+        self._wait_stopped("Discord bot", self._run_on_loop(self.bot.close()), started)
 
-        # Give discord some time to shutdown properly
-        self._logger.info("Giving time for the Discord bot to shutdown")
-        sleep(15)
+        # Tasks started by the bot and its cogs are cancelled so that the loop can be closed cleanly
+        self._wait_stopped("Discord tasks", self._run_on_loop(self._cancel_pending_tasks()), started)
 
         print("Closing event loop...")
         self._logger.info("Stopping and closing event loop")
         self.loop.call_soon_threadsafe(self.loop.stop)
-        bot_thread.join()
+        self._wait_stopped("Event loop", lambda timeout: bot_thread.join(timeout) or not bot_thread.is_alive(), started)
+
+        if not bot_thread.is_alive():
+            self.loop.close()
+
+    def _run_on_loop(self, coro):
+        """
+        Schedule a coroutine on the bot event loop running on another thread
+
+        :param coro: Coroutine to run
+        :return: Function that waits for the coroutine to finish with a timeout and returns True if it finished
+        """
+
+        import asyncio
+
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+        def wait(timeout: float) -> bool:
+            try:
+                future.result(timeout)
+
+            except FutureTimeout:
+                future.cancel()
+                return False
+
+            except Exception:
+                self._logger.exception("Error while shutting down")
+
+            return True
+
+        return wait
+
+    @staticmethod
+    async def _cancel_pending_tasks() -> None:
+        """
+        Cancel all other tasks of the running event loop and wait for them to finish
+        """
+
+        import asyncio
 
-        self.loop.close()
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+
+        for task in tasks:
+            task.cancel()
+
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _wait_stopped(self, component: str, wait, started: float) -> bool:
+        """
+        Wait for a component to stop within what is left of the shutdown timeout and report the result
+
+        :param component: Name of the component for logging
+        :param wait: Function taking a timeout and returning True if the component stopped
+        :param started: Monotonic time when the shutdown was started
+        :return: True if the component stopped in time
+        """
+
+        remaining = max(0.0, started + self.args.shutdown_timeout - monotonic())
+        stopped = wait(remaining)
+
+        if stopped:
+            self._logger.info("%s stopped in %.3f seconds", component, monotonic() - started)
+
+        else:
+            self._logger.error("%s did not stop within the shutdown timeout of %s seconds",
+                               component, self.args.shutdown_timeout)
+
+        return stopped
 
     def check_config(self):
         """
@@ -130,25 +321,67 @@ class Application:
 
         self._logger.info("Checking config")
 
-        if self.args.api_address is None:
+        if "coinmotion" in self.args.sources and self.args.api_address is None:
             self._logger.critical("API address is None")
             raise ApiAddressException("API address is None")
 
-        if not (self.args.enable_discord_bot or self.args.enable_tui):
+        if len(self.args.source_deadline) not in (1, len(self.args.sources)):
+            self._logger.critical("Source deadlines don't match the configured sources")
+            raise UnsupportedOperationModeException("Give either one source deadline or one for every source")
+
+        if not (self.args.enable_discord_bot or self.args.enable_tui or self.args.headless):
             self._logger.critical("Discord bot and TUI aren't enabled")
-            raise UnsupportedOperationModeException("Discord bot and TUI aren't enabled, atleast one must be enabled")
+            raise UnsupportedOperationModeException(
+                "Discord bot and TUI aren't enabled, atleast one must be enabled or headless mode must be used"
+            )
+
+        if self.args.headless and self.args.http_port is None:
+            self._logger.error("Running headless without the HTTP endpoint, fetched data is not served anywhere")
 
         if self.args.enable_discord_bot:
             if self.args.bot_token is not None:
                 self.start_bot = True
 
             else:
-                if not self.args.enable_tui:
+                if not (self.args.enable_tui or self.args.headless):
                     self._logger.critical("Discord bot token not given and TUI not enabled")
                     raise UnsupportedOperationModeException("Discord bot token not given and TUI not enabled")
 
                 self._logger.error("Discord bot token is None, bot will not be enabled")
 
+        if self.args.update_interval <= 0:
+            self._logger.critical("Update interval must be above zero")
+            raise UnsupportedOperationModeException("Update interval must be above zero")
+
+        if self.args.channel_send_rate <= 0 or self.args.global_send_rate <= 0:
+            self._logger.critical("Send rates must be above zero")
+            raise UnsupportedOperationModeException("Channel and global send rates must be above zero")
+
+        if self.args.shard_ids is not None:
+            if self.args.shard_count is None:
+                self._logger.critical("Shard IDs given without shard count")
+                raise UnsupportedOperationModeException("Shard IDs need the shard count")
+
+            if not all(0 <= shard_id < self.args.shard_count for shard_id in self.args.shard_ids):
+                self._logger.critical("Shard IDs %s outside shard count %d", self.args.shard_ids, self.args.shard_count)
+                raise UnsupportedOperationModeException("Shard IDs must be less than the shard count")
+
+        if self.args.worker and self.args.shared_memory is None:
+            self._logger.critical("Worker mode without a shared memory segment")
+            raise UnsupportedOperationModeException("Worker mode needs the shared memory segment of a fetcher process")
+
+        if self.args.async_fetcher and self.args.worker:
+            self._logger.error("Workers read the snapshots of the fetcher process, async fetcher is not used")
+
+        elif self.args.async_fetcher:
+
+            # Without the bot there is no event loop to share, fall back to the threaded data fetcher
+            if self.start_bot:
+                self.async_fetcher = True
+
+            else:
+                self._logger.error("Asynchronous data fetcher requires the Discord bot, using a fetcher thread instead")
+
 
 # Start application if file is run as main
 if __name__ == '__main__':
@@ -12,6 +12,12 @@ from typing import List
 # 3rd-party imports
 from configargparse import ArgParser, ArgumentDefaultsRawHelpFormatter, Namespace
 
+# Local imports
+from cryptalert.quiet_hours import parse_quiet_hours, parse_timezone
+
+# Currencies that can be watched, for the --currencies option and the watchlists of the Discord bot
+SUPPORTED_CURRENCIES: List[str] = ["btc", "eth", "ltc", "xrp", "xlm", "aave", "link", "usdc", "uni"]
+
 
 class Config:
     """
@@ -21,7 +27,7 @@ class Config:
     def __init__(self):
         self._config_file: Path = Path(__file__).parent.parent / "config.ini"
         self._verbosity: str = ""
-        self._supported_currencies: List = ["btc", "eth", "ltc", "xrp", "xlm", "aave", "link", "usdc", "uni"]
+        self._supported_currencies: List = SUPPORTED_CURRENCIES
         self._logger = logging.getLogger("Config")
 
         self._arg_parser = ArgParser(
@@ -73,12 +79,149 @@ class Config:
             default=5
         )
 
+        self._arg_parser.add_argument(
+            "--min-interval",
+            help="Shortest interval in seconds that the ping interval is adapted to when rates move fast",
+            type=float,
+            default=2.0
+        )
+
+        self._arg_parser.add_argument(
+            "--max-interval",
+            help="Longest interval in seconds that the ping interval is adapted to when rates stay flat",
+            type=float,
+            default=60.0
+        )
+
+        self._arg_parser.add_argument(
+            "--request-budget",
+            help="Maximum number of requests per hour to all rate sources combined, 0 for no limit",
+            type=int,
+            default=1440
+        )
+
+        self._arg_parser.add_argument(
+            "--history-size",
+            help="Number of fetched samples kept in memory per currency, e.g. 17280 is two days with 10s ping interval",
+            type=int,
+            default=17280
+        )
+
+        self._arg_parser.add_argument(
+            "--history-file",
+            help="File for storing the rate history between restarts, history is kept only in memory if not given",
+            type=Path
+        )
+
+        self._arg_parser.add_argument(
+            "--history-retention",
+            help="Hours of rate history kept in the history file",
+            type=float,
+            default=24 * 365
+        )
+
+        self._arg_parser.add_argument(
+            "--history-max-size",
+            help="Size in MB after which the history file is rotated",
+            type=int,
+            default=2048
+        )
+
+        self._arg_parser.add_argument(
+            "--indicator-windows",
+            help="Window sizes in samples for rolling indicators (moving averages, volatility, min/max)",
+            type=int,
+            nargs='+',
+            default=[6, 30, 360]
+        )
+
+        self._arg_parser.add_argument(
+            "--connect-timeout",
+            help="Seconds to wait for a connection to the API to be established",
+            type=float,
+            default=5.0
+        )
+
+        self._arg_parser.add_argument(
+            "--read-timeout",
+            help="Seconds to wait for the API to send data before giving up on the fetch",
+            type=float,
+            default=10.0
+        )
+
+        self._arg_parser.add_argument(
+            "--pool-size",
+            help="Maximum number of kept-alive connections to the API",
+            type=int,
+            default=2
+        )
+
+        self._arg_parser.add_argument(
+            "--retry-base-delay",
+            help="Seconds to wait before retrying a failed fetch, doubled after every consecutive failure",
+            type=float,
+            default=1.0
+        )
+
+        self._arg_parser.add_argument(
+            "--retry-max-delay",
+            help="Maximum seconds to wait before retrying a failed fetch",
+            type=float,
+            default=60.0
+        )
+
+        self._arg_parser.add_argument(
+            "--startup-deadline",
+            help="Seconds to wait for the first batch of data before starting without it, 0 waits indefinitely",
+            type=float,
+            default=60.0
+        )
+
+        self._arg_parser.add_argument(
+            "--async-fetcher",
+            help="Run the data fetcher as a task on the Discord bot event loop instead of a separate thread",
+            action="store_true"
+        )
+
+        self._arg_parser.add_argument(
+            "--shutdown-timeout",
+            help="Seconds to wait for every component to stop on exit before giving up on them",
+            type=float,
+            default=5.0
+        )
+
         self._arg_parser.add_argument(
             "-a", "--api-address",
             help="Address of the coinmotion API for fetching rates",
             type=str
         )
 
+        self._arg_parser.add_argument(
+            "--kraken-address",
+            help="Address of the Kraken ticker API for fetching rates",
+            type=str,
+            default="https://api.kraken.com/0/public/Ticker"
+        )
+
+        self._arg_parser.add_argument(
+            "--sources",
+            help="Rate sources to fetch concurrently, best buy and sell rates are used and the rest of the data is "
+                 "taken from the first source that has it",
+            type=str.lower,
+            choices=["coinmotion", "kraken"],
+            nargs='+',
+            default=["coinmotion"]
+        )
+
+        self._arg_parser.add_argument(
+            "--source-deadline",
+            help="Seconds a source has for responding before it is left out of the fetch, either one value for all "
+                 "sources or one value per source in the order of --sources",
+            type=float,
+            nargs='+',
+            default=[8.0]
+        )
+
         self._arg_parser.add_argument(
             "-d", "--enable-discord-bot",
             help="Enable discord bot for notifications",
@@ -105,6 +248,45 @@ class Config:
             action="store_true"
         )
 
+        self._arg_parser.add_argument(
+            "--sparkline-span",
+            help="Minutes of rate history shown by the sparklines of the text ui",
+            type=float,
+            default=60.0
+        )
+
+        self._arg_parser.add_argument(
+            "--headless",
+            help="Allow running without the Discord bot and the TUI, data is then served only by the HTTP endpoint",
+            action="store_true"
+        )
+
+        self._arg_parser.add_argument(
+            "--http-port",
+            help="Port for the local HTTP endpoint serving the latest rates (/snapshot) and metrics (/metrics for "
+                 "Prometheus, /metrics.json), the endpoint is disabled if not given",
+            type=int
+        )
+
+        self._arg_parser.add_argument(
+            "--http-address",
+            help="Address the HTTP endpoint listens on",
+            type=str,
+            default="127.0.0.1"
+        )
+
+        self._arg_parser.add_argument(
+            "--shared-memory",
+            help="Name of a shared memory segment the fetched snapshots are shared through with worker processes",
+            type=str
+        )
+
+        self._arg_parser.add_argument(
+            "--worker",
+            help="Read the snapshots from the shared memory segment of a fetcher process instead of fetching them",
+            action="store_true"
+        )
+
         self._arg_parser.add_argument(
             "--prefix",
             help="Command prefix e.g. '!someCommand'",
@@ -112,6 +294,62 @@ class Config:
             default="!"
         )
 
+        self._arg_parser.add_argument(
+            "--update-interval",
+            help="Minutes between the status updates posted to the info channel, updates are posted on the clock "
+                 "e.g. at :00, :10 and :20 with the default interval",
+            type=float,
+            default=10.0
+        )
+
+        self._arg_parser.add_argument(
+            "--quiet-hours",
+            help="Hours of the day when no status updates are posted e.g. '23-7', 'none' posts updates all day",
+            type=parse_quiet_hours,
+            default="23-7"
+        )
+
+        self._arg_parser.add_argument(
+            "--timezone",
+            help="Time zone of the update schedule and the quiet hours e.g. 'Europe/Helsinki', default: local time",
+            type=parse_timezone
+        )
+
+        self._arg_parser.add_argument(
+            "--channel-send-rate",
+            help="Messages per second the bot sends to a single channel, bursts of 5 messages are allowed",
+            type=float,
+            default=1.0
+        )
+
+        self._arg_parser.add_argument(
+            "--global-send-rate",
+            help="Messages per second the bot sends to all channels combined",
+            type=float,
+            default=40.0
+        )
+
+        self._arg_parser.add_argument(
+            "--send-attempts",
+            help="Times sending a message is tried before it is dropped",
+            type=int,
+            default=3
+        )
+
+        self._arg_parser.add_argument(
+            "--shard-count",
+            help="Number of shards the guilds of the bot are split to, default: the count recommended by Discord",
+            type=int
+        )
+
+        self._arg_parser.add_argument(
+            "--shard-ids",
+            help="Shards run by this process e.g. '0 1' when the shards are split between processes, "
+                 "requires --shard-count, default: all shards",
+            type=int,
+            nargs='+'
+        )
+
     def get_args(self) -> Namespace:
         """
         Return the previously parsed args
@@ -162,6 +400,7 @@ class Config:
             "Config",
             "TUI",
             "ApiAccessor",
+            "HTTP",
             "Cryptalert"
         ]
 
@@ -1,19 +1,31 @@
 """
-Handles fetching cryptocurrency data from the coinmotion API
+Handles fetching cryptocurrency data from the configured rate sources
 
 Emil Rekola <emil.rekola@hotmail.com>
 """
 
 # STD imports
-import json
 import logging
-from time import sleep
-from typing import List, Dict
+from time import monotonic, time
+from typing import Iterable, List, Dict, Optional, Tuple
 from threading import Event
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
 from datetime import datetime
 
 # 3rd-party imports
-from requests import get, ConnectionError
+from requests import Session, ConnectionError, RequestException, Timeout
+
+# Local imports
+from cryptalert.data_fetcher.backoff import Backoff
+from cryptalert.data_fetcher.history import HistoryStore
+from cryptalert.data_fetcher.history_file import HistoryFile
+from cryptalert.data_fetcher.indicators import IndicatorEngine
+from cryptalert.data_fetcher.metrics import FetchMetrics
+from cryptalert.data_fetcher.rates import MarketSnapshot
+from cryptalert.data_fetcher.scheduler import PollScheduler
+from cryptalert.data_fetcher.snapshot_bus import SnapshotBus
+from cryptalert.data_fetcher.sources import RateSource, create_sources, merge_snapshots
+from cryptalert.data_fetcher.timing import TimedHTTPAdapter, connect_time, reset_connect_time
 
 
 class ApiAccessor:
@@ -21,105 +33,437 @@ class ApiAccessor:
     Class for handling data fetching for the application
     """
 
+    # Consecutive failed fetches after which the fetched data is considered stale
+    degraded_threshold: int = 3
+
+    # Seconds between the summaries of the fetch metrics written to the log
+    metrics_log_interval: float = 600.0
+
+    # Batches of the history file are written by 'append', the asynchronous fetcher writes them off the event loop
+    flush_history_on_append: bool = True
+
     def __init__(self, args, stop_flag):
-        self.api_data: Dict = {}
+        self.bus: SnapshotBus = SnapshotBus()
+        self.history: HistoryStore = HistoryStore(args.history_size)
+        self.indicators: IndicatorEngine = IndicatorEngine(args.indicator_windows)
+        self.metrics: FetchMetrics = FetchMetrics()
         self.data_ready: Event = Event()
-        self.api_address: str = args.api_address
+        self.stopped: Event = Event()
+        self.sources: List[RateSource] = create_sources(args, self.metrics)
+        self.currencies: List[str] = [currency.upper() for currency in args.currencies]
+        self._fetched_currencies: List[str] = list(self.currencies)
         self.ping_interval: int = args.ping_interval
-        self.currency_keys: List = [f"{currency}eur" for currency in args.currencies]
+        self.scheduler: PollScheduler = PollScheduler(
+            args.ping_interval, args.min_interval, args.max_interval, args.request_budget
+        )
+        self.timeout: Tuple[float, float] = (args.connect_timeout, args.read_timeout)
+        self.pool_size: int = args.pool_size
+        self.startup_deadline: float = args.startup_deadline
         self._stop_flag: Event = stop_flag
         self.last_succcesful_fetch = None
+        self.consecutive_failures: int = 0
+        self.failed_fetches: int = 0
+        self.successful_fetches: int = 0
+        self._backoff: Backoff = Backoff(args.retry_base_delay, args.retry_max_delay)
+        self._metrics_logged: float = monotonic()
         self._logger = logging.getLogger("ApiAccessor")
+        self._session = self._create_session()
+
+        # Sources are fetched on worker threads, fetches still running after their deadline are tracked by name
+        self._executor: Optional[ThreadPoolExecutor] = self._create_executor()
+        self._pending: Dict[str, Future] = {}
+
+        # Names of the sources the latest snapshot was merged from
+        self._merged_from: Tuple[str, ...] = ()
+
+        # History from previous runs is loaded from the history file if one is used
+        self.history_file: Optional[HistoryFile] = None
+        if args.history_file is not None:
+            self.history_file = HistoryFile(args.history_file, max_size=args.history_max_size << 20)
+            self._load_history(args.history_retention * 3600)
+
+    def _load_history(self, retention: float) -> None:
+        """
+        Remove expired samples from the history file and fill the in-memory history and indicators from it
+
+        :param retention: Seconds of samples to keep in the history file
+        """
+
+        self.history_file.compact(retention)
+
+        # Samples that would not fit the in-memory history are not loaded
+        since = time() - self.history.capacity * self.ping_interval
+        loaded = self.history_file.load_into(self.history, since)
+        self.indicators.warm(self.history, self.history.currencies())
+
+        self._logger.info("Loaded %d samples from history file '%s'", loaded, self.history_file.path)
+
+    def watch_currencies(self, currencies: Iterable[str]) -> None:
+        """
+        Fetch the given currencies in addition to the configured ones, one request per source still covers all
+        of them. Can be called from any thread, the change takes effect on the next fetch
+
+        :param currencies: Currency codes e.g. 'BTC', replaces the previously given ones
+        """
+
+        fetched = self.currencies + sorted({currency.upper() for currency in currencies} - set(self.currencies))
+
+        if fetched == self._fetched_currencies:
+            return
+
+        self._logger.info("Fetching currencies: %s", ", ".join(fetched))
+        self._fetched_currencies = fetched
+
+        for source in self.sources:
+            source.set_currencies(fetched)
+
+    def rate_at(self, currency: str, field: str, timestamp: float) -> Optional[float]:
+        """
+        Get the value of a field of a currency at a given time from the in-memory history or the history file
+
+        :param currency: Currency code e.g. 'BTC'
+        :param field: One of 'buy', 'sell', 'changePercent' or 'high'
+        :param timestamp: Unix time
+        :return: Value or None if there is no history that old
+        """
+
+        history = self.history.get(currency)
+
+        if history is not None and (value := history.value_at(field, timestamp)) is not None:
+            return value
+
+        if self.history_file is not None:
+            return self.history_file.value_at(currency, field, timestamp)
+
+        return None
+
+    def _create_executor(self) -> Optional[ThreadPoolExecutor]:
+        """
+        Create the worker threads the sources are fetched on
+
+        :return: Thread pool with a thread for every source
+        """
+
+        return ThreadPoolExecutor(len(self.sources), thread_name_prefix="Fetch")
 
-    def fetch_data(self) -> None:
+    def _create_session(self) -> Session:
         """
-        Fetch data by making a GET request to the coinmotion API
+        Create a HTTP session that keeps connections to the API alive between fetches
+
+        :return: Session with a connection pool mounted for HTTP and HTTPS addresses, the pool records the time spent
+            opening connections
+        """
+
+        session = Session()
+        adapter = TimedHTTPAdapter(pool_connections=len(self.sources), pool_maxsize=self.pool_size)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+
+        return session
+
+    @property
+    def api_data(self) -> Optional[MarketSnapshot]:
+        """
+        Immutable data of the latest snapshot, None until the first succesful fetch. Consumers reading more
+        than one value should take the property once to get consistent values
+        """
+
+        snapshot = self.bus.latest
+        return snapshot.data if snapshot is not None else None
+
+    @property
+    def data_key(self) -> Tuple[int, int]:
+        """
+        Changes whenever the data derived from the fetches may have changed, the history and indicators are updated on
+        every succesful fetch even if no new snapshot is published
+        """
+
+        return self.bus.version, self.successful_fetches
+
+    @property
+    def degraded(self) -> bool:
+        """
+        True if there is no data or the latest fetches have failed
+        """
+
+        return not self.api_data or self.consecutive_failures >= self.degraded_threshold
+
+    def fetch_data(self) -> bool:
+        """
+        Fetch data from every rate source concurrently using the pooled session, sources that miss their
+        deadline are left out of the fetch
+
+        :return: True if data could be fetched from atleast one source
         """
 
         self._logger.debug("Fetching data")
 
+        started = monotonic()
+
+        # Single source is fetched on the calling thread
+        if len(self.sources) == 1:
+            results = [self._fetch_source(self.sources[0])]
+            requests = 1
+
+        else:
+            futures = [self._submit(source) for source in self.sources]
+            results = [self._source_result(source, future, started) for source, future in zip(self.sources, futures)]
+            requests = sum(future is not None for future in futures)
+
+        success = self._merge_results(results)
+        self._record_fetch(success, requests)
+        self.metrics.observe("total", monotonic() - started)
+
+        return success
+
+    def _submit(self, source: RateSource) -> Optional[Future]:
+        """
+        Start fetching a source on the worker threads unless the previous fetch of the source is still running
+
+        :param source: Source to fetch
+        :return: Future of the fetch or None if the source was skipped
+        """
+
+        pending = self._pending.get(source.name)
+
+        if pending is not None and not pending.done():
+            self._logger.error("Previous fetch from %s still running, skipping it", source.name)
+            return None
+
+        future = self._executor.submit(self._fetch_source, source)
+        self._pending[source.name] = future
+
+        return future
+
+    def _source_result(self, source: RateSource, future: Optional[Future], started: float) -> bool:
+        """
+        Wait for the fetch of a source until its deadline, the waits overlap so a fetch takes as long as the
+        slowest source that is within its deadline
+
+        :param source: Fetched source
+        :param future: Future returned by '_submit'
+        :param started: Monotonic time when the fetches were started
+        :return: True if the source responded with valid data within its deadline
+        """
+
+        if future is None:
+            return False
+
+        try:
+            return future.result(timeout=max(0.0, started + source.deadline - monotonic()))
+
+        except FutureTimeout:
+            self._logger.error("%s did not respond within its deadline of %s seconds", source.name, source.deadline)
+            self.metrics.error(source.name, "DeadlineExceeded")
+            return False
+
+    def _fetch_source(self, source: RateSource) -> bool:
+        """
+        Fetch data from a single source by making a GET request
+
+        :param source: Source to fetch
+        :return: True if the source responded with valid data
+        """
+
+        # Read timeout is capped by the deadline so that late responses do not keep the worker busy
+        timeout = (self.timeout[0], min(self.timeout[1], source.deadline))
+        reset_connect_time()
+        started = monotonic()
+
         # Try to fetch data
         try:
-            response = get(self.api_address)
-            res = response.json()
+            response = self._session.get(source.request_url(), timeout=timeout, headers=source.conditional_headers())
+
+        except Timeout as error:
+            self._logger.error("Timed out while trying to fetch data from %s", source.name)
+            self.metrics.error(source.name, type(error).__name__)
 
-        except json.JSONDecodeError:
-            self._logger.error("No suitable response from API address '%s'", self.api_address)
+        except ConnectionError as error:
+            self._logger.error("Connection error while trying to fetch data from %s", source.name)
+            self.metrics.error(source.name, type(error).__name__)
 
-        except ConnectionError:
-            self._logger.error("Connection error while trying to fetch data")
+        # E.g. too many redirects or a broken chunked response, a failing source must not stop the fetcher
+        except RequestException as error:
+            self._logger.error("Request to %s failed: %s", source.name, error)
+            self.metrics.error(source.name, type(error).__name__)
 
         else:
-            # Ignore empty data
-            if data := self._parse_json(res):
-                self.api_data = data
-                self.last_succcesful_fetch = datetime.now().time()
+            self._record_request_stages(source, started, response.elapsed.total_seconds())
+
+            return self._process_response(source, response.status_code, response.headers, response.content)
+
+        return False
 
-    def _parse_json(self, response: Dict) -> Dict:
+    def _process_response(self, source: RateSource, status: int, headers, body: bytes) -> bool:
         """
-        Parse the reponse that is a Dict and return filtered data
+        Let a source handle its response, an unexpected error while parsing counts as a failure of the source
 
-        :param response: Dict holding the response
-        :return: Parsed data from the response
+        :param source: Fetched source
+        :param status: HTTP status code of the response
+        :param headers: Case-insensitive mapping of the response headers
+        :param body: Raw response body
+        :return: True if the response held valid data
         """
 
-        if not response["success"]:
-            return {}
+        try:
+            return source.process_response(status, headers, body)
 
-        filtered_currencies = self._filter_keys(response["payload"].keys())
+        # A malformed response must not stop the fetcher
+        except Exception as error:
+            self._logger.exception("Failed to process the response of %s", source.name)
+            self.metrics.error(source.name, type(error).__name__)
 
-        parsed_data = {}
+        return False
 
-        try:
-            for currency in filtered_currencies:
-                currency_data = response["payload"][currency]
-
-                # Buy/Sell must be inverted to get the prespective of the user
-                parsed_data[currency_data["currencyCode"]] = {
-                    "sell": currency_data["buy"],
-                    "buy": currency_data["sell"],
-                    "changePercent": currency_data["fchangep"],
-                    "high": currency_data["fhigh"]
-                }
-
-            # Total market trend
-            parsed_data["market"] = {
-                "changePercent": response["payload"]["market"]["changeAmount"],
-                "sign": response["payload"]["market"]["changeSign"]
-            }
-
-        # If invalid Dict key is somehow used -> return empty Dict
-        except KeyError:
-            return {}
+    def _record_request_stages(self, source: RateSource, started: float, elapsed: float) -> None:
+        """
+        Record the timings of a request that got a response, the body has been read when this is called
+
+        :param source: Fetched source
+        :param started: Monotonic time when the request was started
+        :param elapsed: Seconds from sending the request until the headers of the response were parsed
+        """
+
+        latency = monotonic() - started
+
+        # Opening a connection includes the name resolution, it is measured only if no kept-alive connection was free
+        connect = connect_time()
+        if connect > 0:
+            self.metrics.stage("connect", connect)
+
+        self.metrics.stage("request", max(0.0, elapsed - connect))
+        self.metrics.stage("transfer", max(0.0, latency - elapsed))
+        self.metrics.observe(source.name, latency)
+
+    def _record_fetch(self, success: bool, requests: int) -> None:
+        """
+        Update failure counters and the retry delay based on the result of a fetch
+
+        :param success: True if the fetch was succesful
+        :param requests: Number of requests sent, sources skipped because of a running fetch are not counted
+        """
+
+        self.scheduler.record_poll(requests)
+
+        if success:
+            self.consecutive_failures = 0
+            self._backoff.reset()
 
         else:
-            return parsed_data
+            self.consecutive_failures += 1
+            self.failed_fetches += 1
+
+        if monotonic() - self._metrics_logged >= self.metrics_log_interval:
+            self._metrics_logged = monotonic()
+            self._logger.info("Fetch metrics:\n%s", self.metrics.describe())
+
+    def _merge_results(self, results: List[bool]) -> bool:
+        """
+        Publish the merged data of the sources that responded, a new snapshot is published only if data of
+        some source has changed or a different set of sources responded
+
+        :param results: Result of every source in the same order as 'sources'
+        :return: True if atleast one source responded with valid data
+        """
+
+        responded = [source for source, success in zip(self.sources, results) if success]
+
+        if not responded:
+            return False
 
-    def _filter_keys(self, keys) -> List:
+        names = tuple(source.name for source in responded)
+
+        if names != self._merged_from or any(source.changed for source in responded):
+            started = monotonic()
+            self.bus.publish(time(), merge_snapshots([(source.name, source.snapshot) for source in responded]))
+            self.metrics.stage("publish", monotonic() - started)
+            self._merged_from = names
+
+        self._mark_fetched()
+
+        return True
+
+    def _mark_fetched(self) -> None:
+        """
+        Record the time of a succesful fetch and add the current data to the history and indicators
         """
-        Filter the the dict keys based on what currencies the user configured to be watched
 
-        :param keys: List of the keys that are to filtered
-        :return: Filtered keys
+        timestamp = time()
+        api_data = self.api_data
+
+        self.last_succcesful_fetch = datetime.now().time()
+        self.history.append(timestamp, api_data)
+        self.indicators.update(api_data)
+        self.scheduler.observe(api_data)
+
+        # Counted after the updates so that nothing is rendered from half-updated data under the new 'data_key'
+        self.successful_fetches += 1
+
+        if self.history_file is not None:
+            self.history_file.append(timestamp, api_data, flush=self.flush_history_on_append)
+
+    def _close_history(self) -> None:
+        """
+        Write samples still waiting in the batch to the history file
         """
 
-        filtered_keys = []
+        if self.history_file is not None:
+            self.history_file.close()
 
-        # Filter out keys that represent currencies that were not configured to be watched
-        for key in keys:
-            if key.lower() in self.currency_keys:
-                filtered_keys.append(key)
+    def _sleep(self, delay: float = None) -> None:
+        """
+        Sleep for the adaptive interval before fetching data from the API again
 
-        return filtered_keys
+        :param delay: Seconds to sleep instead of the adaptive interval, e.g. a retry delay
+        """
 
-    def _sleep(self) -> None:
+        # Setting the stop flag wakes the fetcher immediately
+        self._stop_flag.wait(self.scheduler.next_delay(delay))
+
+    def _retry_delay(self, deadline: float = None) -> float:
         """
-        Sleep for configured amount of time before fetching data from the API again
+        Get the delay before retrying a failed fetch
+
+        :param deadline: Monotonic time that the delay must not exceed
+        :return: Delay in seconds
         """
 
-        # Try to skip the sleeping period if the flag was set during data fetch
-        if not self._stop_flag.is_set():
-            sleep(self.ping_interval)
+        delay = self._backoff.next_delay()
+
+        if deadline is not None:
+            delay = max(0.0, min(delay, deadline - monotonic()))
+
+        self._logger.info("Retrying fetch in %.1f seconds (%d failures in a row)", delay, self.consecutive_failures)
+
+        return delay
+
+    def _startup_deadline(self):
+        """
+        Get the monotonic time after which the application is started even without data
+
+        :return: Deadline or None if the application should wait for data indefinitely
+        """
+
+        if self.startup_deadline > 0:
+            return monotonic() + self.startup_deadline
+
+        return None
+
+    def _startup_deadline_passed(self, deadline: float) -> bool:
+        """
+        Check if the startup deadline has passed without data
+
+        :param deadline: Deadline returned by '_startup_deadline'
+        :return: True if waiting for the first batch of data should be stopped
+        """
+
+        if deadline is None or monotonic() < deadline:
+            return False
+
+        self._logger.error("No data within startup deadline of %s seconds, continuing in degraded state",
+                           self.startup_deadline)
+
+        return True
 
     def start(self) -> None:
         """
@@ -128,15 +472,31 @@ class ApiAccessor:
 
         self._logger.info("Starting data fetching loop")
 
-        # Set flag after first batch of data is ready, loop until data could be fetched succesfully
-        while not self.api_data:
-            self.fetch_data()
+        try:
+            deadline = self._startup_deadline()
+
+            # Set flag after first batch of data is ready, loop until data is fetched, deadline passes or stop is set
+            while (not self._stop_flag.is_set() and not self.fetch_data()
+                   and not self._startup_deadline_passed(deadline)):
+                self._sleep(self._retry_delay(deadline))
+
+            self.data_ready.set()
+
+            # Fetch data and sleep, failed fetches are retried with a growing delay
+            while not self._stop_flag.is_set():
+                if self.fetch_data():
+                    self._sleep()
+
+                else:
+                    self._sleep(self._retry_delay())
 
-        self.data_ready.set()
+        finally:
+            self._executor.shutdown(wait=False)
+            self._session.close()
+            self._close_history()
 
-        # Fetch data and sleep
-        while not self._stop_flag.is_set():
-            self.fetch_data()
-            self._sleep()
+            # Waiters must not block if the loop stopped before any data was fetched
+            self.data_ready.set()
+            self.stopped.set()
 
         self._logger.info("Data fetching loop stopped")
@@ -0,0 +1,224 @@
+"""
+Handles fetching cryptocurrency data from the configured rate sources as a task on an asyncio event loop
+
+Emil Rekola <emil.rekola@hotmail.com>
+"""
+
+# STD imports
+import asyncio
+from time import monotonic
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+from typing import Mapping, Optional, Tuple
+
+# 3rd-party imports
+import aiohttp
+
+# Local imports
+from cryptalert.data_fetcher.api_accessor import ApiAccessor
+from cryptalert.data_fetcher.sources import RateSource
+
+
+class AsyncApiAccessor(ApiAccessor):
+    """
+    Class for handling data fetching on the same event loop as the Discord bot, no separate thread is needed. Only
+    writing the history file is done on the default executor of the loop so that file I/O never blocks the bot
+    """
+
+    flush_history_on_append: bool = False
+
+    def _create_executor(self) -> Optional[ThreadPoolExecutor]:
+        """
+        Sources are fetched concurrently on the event loop, no worker threads are needed
+        """
+
+        return None
+
+    def _create_session(self) -> None:
+        """
+        The aiohttp session must be created inside the event loop, so it is created when the task starts
+        """
+
+        return None
+
+    def _create_client_session(self) -> aiohttp.ClientSession:
+        """
+        Create a HTTP session that keeps connections to the API alive between fetches
+
+        :return: Session with a connection pool, configured timeouts and tracing of the request stages
+        """
+
+        connector = aiohttp.TCPConnector(limit=self.pool_size)
+        timeout = aiohttp.ClientTimeout(sock_connect=self.timeout[0], sock_read=self.timeout[1])
+
+        return aiohttp.ClientSession(connector=connector, timeout=timeout, trace_configs=[self._create_trace_config()])
+
+    def _create_trace_config(self) -> aiohttp.TraceConfig:
+        """
+        Create tracing that records the time spent resolving names, opening connections and waiting for the response
+        headers. Callbacks of a request share a context that the start times are kept in
+
+        :return: Trace config for the client session
+        """
+
+        async def on_request_start(_session, context: SimpleNamespace, _params) -> None:
+            context.started = monotonic()
+            context.connect = 0.0
+
+        async def on_dns_resolvehost_start(_session, context: SimpleNamespace, _params) -> None:
+            context.dns_started = monotonic()
+
+        async def on_dns_resolvehost_end(_session, context: SimpleNamespace, _params) -> None:
+            context.dns = monotonic() - context.dns_started
+            self.metrics.stage("dns", context.dns)
+
+        async def on_connection_create_start(_session, context: SimpleNamespace, _params) -> None:
+            context.connect_started = monotonic()
+            context.dns = 0.0
+
+        async def on_connection_create_end(_session, context: SimpleNamespace, _params) -> None:
+            context.connect = monotonic() - context.connect_started
+            self.metrics.stage("connect", context.connect - context.dns)
+
+        async def on_request_end(_session, context: SimpleNamespace, _params) -> None:
+            self.metrics.stage("request", monotonic() - context.started - context.connect)
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_dns_resolvehost_start.append(on_dns_resolvehost_start)
+        trace_config.on_dns_resolvehost_end.append(on_dns_resolvehost_end)
+        trace_config.on_connection_create_start.append(on_connection_create_start)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_request_end.append(on_request_end)
+
+        return trace_config
+
+    async def fetch_data(self) -> bool:
+        """
+        Fetch data from every rate source concurrently with non-blocking GET requests, sources that miss their
+        deadline are left out of the fetch
+
+        :return: True if data could be fetched from atleast one source
+        """
+
+        self._logger.debug("Fetching data")
+
+        started = monotonic()
+        results = await asyncio.gather(*(self._fetch_source(source) for source in self.sources))
+
+        success = self._merge_results(list(results))
+        self._record_fetch(success, len(self.sources))
+        self.metrics.observe("total", monotonic() - started)
+
+        # Writes are awaited one at a time so records reach the file in the order they were fetched
+        if self.history_file is not None and self.history_file.flush_due:
+            await asyncio.get_running_loop().run_in_executor(None, self.history_file.flush)
+
+        return success
+
+    async def _fetch_source(self, source: RateSource) -> bool:
+        """
+        Fetch data from a single source, the request is cancelled if the source misses its deadline
+
+        :param source: Source to fetch
+        :return: True if the source responded with valid data within its deadline
+        """
+
+        started = monotonic()
+
+        # Try to fetch data
+        try:
+            status, headers, body = await asyncio.wait_for(self._request(source), source.deadline)
+
+        except asyncio.TimeoutError as error:
+            self._logger.error("Timed out while trying to fetch data from %s", source.name)
+
+            # Socket timeouts of aiohttp are subclasses, a plain TimeoutError comes from the deadline
+            self.metrics.error(source.name, "DeadlineExceeded" if type(error) is asyncio.TimeoutError
+                               else type(error).__name__)
+
+        except aiohttp.ClientError as error:
+            self._logger.error("Connection error while trying to fetch data from %s", source.name)
+            self.metrics.error(source.name, type(error).__name__)
+
+        else:
+            self.metrics.observe(source.name, monotonic() - started)
+
+            return self._process_response(source, status, headers, body)
+
+        return False
+
+    async def _request(self, source: RateSource) -> Tuple[int, Mapping, bytes]:
+        """
+        Make a GET request to a source
+
+        :param source: Source to fetch
+        :return: Status code, headers and body of the response
+        """
+
+        async with self._session.get(source.request_url(), headers=source.conditional_headers()) as response:
+            started = monotonic()
+            body = await response.read()
+            self.metrics.stage("transfer", monotonic() - started)
+
+            return response.status, response.headers, body
+
+    async def _sleep(self, delay: float = None) -> None:
+        """
+        Sleep for the adaptive interval before fetching data from the API again. The stop flag is a threading event
+        that can't be awaited, it is checked only before sleeping and stopping relies on cancelling the task, which
+        interrupts the sleep immediately
+
+        :param delay: Seconds to sleep instead of the adaptive interval, e.g. a retry delay
+        """
+
+        # Try to skip the sleeping period if the flag was set during data fetch
+        if not self._stop_flag.is_set():
+            await asyncio.sleep(self.scheduler.next_delay(delay))
+
+    async def start(self) -> None:
+        """
+        Loop indefinitely fetching data and sleeping until stop flag is set or the task is cancelled
+        """
+
+        self._logger.info("Starting asynchronous data fetching loop")
+
+        try:
+            async with self._create_client_session() as self._session:
+
+                deadline = self._startup_deadline()
+
+                # Set flag after first batch of data is ready, loop until data is fetched, deadline passes or stop
+                while (not self._stop_flag.is_set() and not await self.fetch_data()
+                       and not self._startup_deadline_passed(deadline)):
+                    await self._sleep(self._retry_delay(deadline))
+
+                self.data_ready.set()
+
+                # Fetch data and sleep, failed fetches are retried with a growing delay
+                while not self._stop_flag.is_set():
+                    if await self.fetch_data():
+                        await self._sleep()
+
+                    else:
+                        await self._sleep(self._retry_delay())
+
+        except asyncio.CancelledError:
+            self._logger.info("Data fetching task cancelled")
+            raise
+
+        finally:
+            self._session = None
+
+            # Remaining records are written off the event loop, the write finishes even if this task is cancelled
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self._close_history)
+
+            except (asyncio.CancelledError, RuntimeError):
+                self._logger.error("History file could not be closed off the event loop, closing it on the loop")
+                self._close_history()
+
+            self.data_ready.set()
+            self.stopped.set()
+
+        self._logger.info("Data fetching loop stopped")
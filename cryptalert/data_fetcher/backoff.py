@@ -0,0 +1,44 @@
+"""
+Retry delay calculation for failed data fetches
+
+Emil Rekola <emil.rekola@hotmail.com>
+"""
+
+# STD imports
+import random
+
+
+class Backoff:
+    """
+    Class for calculating exponentially growing retry delays with jitter
+    """
+
+    # Cap for the exponent, delay has reached the max delay well before this
+    _max_exponent: int = 32
+
+    def __init__(self, base_delay: float, max_delay: float, factor: float = 2.0):
+        self.base_delay: float = base_delay
+        self.max_delay: float = max_delay
+        self.factor: float = factor
+        self.attempt: int = 0
+
+    def next_delay(self) -> float:
+        """
+        Calculate the delay before the next retry, every call doubles the delay until max delay is reached
+
+        :return: Delay in seconds, randomized between half and full of the exponential delay
+        """
+
+        exponent = min(self.attempt, self._max_exponent)
+        delay = min(self.max_delay, self.base_delay * self.factor ** exponent)
+        self.attempt += 1
+
+        # Jitter spreads retries so that restarted instances don't hit the API in lockstep
+        return random.uniform(delay / 2, delay)
+
+    def reset(self) -> None:
+        """
+        Start again from the base delay, called after a succesful fetch
+        """
+
+        self.attempt = 0
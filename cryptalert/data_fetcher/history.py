@@ -0,0 +1,204 @@
+"""
+Fixed-capacity in-memory history of fetched rates
+
+Emil Rekola <emil.rekola@hotmail.com>
+"""
+
+# STD imports
+import math
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+# Local imports
+from cryptalert.data_fetcher.rates import MarketSnapshot
+
+# Stored fields of a single sample, each field is kept in its own array
+FIELDS: Tuple[str, ...] = ("timestamp", "buy", "sell", "changePercent", "high")
+
+
+class RateHistory:
+    """
+    Class for a ring buffer of rate samples of a single currency, appending is O(1) and oldest samples are
+    overwritten once the buffer is full
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity: int = capacity
+        self._columns: Dict[str, array] = {field: array("d", bytes(8 * capacity)) for field in FIELDS}
+        self._next: int = 0
+        self._size: int = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def append(self, timestamp: float, buy: float, sell: float, change_percent: float, high: float) -> None:
+        """
+        Add a sample to the history, overwrites the oldest sample if the history is full
+
+        :param timestamp: Unix time of the sample
+        :param buy: Buy price from the users perspective
+        :param sell: Sell price from the users perspective
+        :param change_percent: 24h change in percents
+        :param high: 24h high
+        """
+
+        index = self._next
+
+        for field, value in zip(FIELDS, (timestamp, buy, sell, change_percent, high)):
+            self._columns[field][index] = value
+
+        # Size and position are updated last so that readers never see a half written sample
+        self._next = (index + 1) % self.capacity
+        self._size = min(self._size + 1, self.capacity)
+
+    def window(self, field: str, count: Optional[int] = None) -> Tuple[memoryview, ...]:
+        """
+        Get the latest samples of a field without copying them
+
+        :param field: Name of the field, one of 'FIELDS'
+        :param count: Number of latest samples, all samples if None
+        :return: One or two memoryviews (two if the window wraps around the buffer) in chronological order
+        """
+
+        return self.windows((field,), count)[0]
+
+    def windows(self, fields: Tuple[str, ...], count: Optional[int] = None) -> Tuple[Tuple[memoryview, ...], ...]:
+        """
+        Get the latest samples of several fields without copying them, every field is sliced from the same position
+        so the samples stay aligned while new samples are appended
+
+        :param fields: Names of the fields, each one of 'FIELDS'
+        :param count: Number of latest samples, all samples if None
+        :return: Segments of 'window' for every field in the given order
+        """
+
+        # Size is read first, it is updated after the position so the window never covers an unwritten sample
+        size = self._size
+        position = self._next
+        count = size if count is None else min(count, size)
+        start = (position - count) % self.capacity
+        end = start + count
+        result = []
+
+        for field in fields:
+            view = memoryview(self._columns[field])
+            result.append((view[start:end],) if end <= self.capacity else (view[start:], view[:end - self.capacity]))
+
+        return tuple(result)
+
+    def latest(self, field: str) -> Optional[float]:
+        """
+        Get the latest value of a field
+
+        :param field: Name of the field
+        :return: Latest value or None if there are no samples
+        """
+
+        if not self._size:
+            return None
+
+        return self._columns[field][(self._next - 1) % self.capacity]
+
+    def value_at(self, field: str, timestamp: float) -> Optional[float]:
+        """
+        Get the value of a field from the latest sample taken at or before the given time
+
+        :param field: Name of the field
+        :param timestamp: Unix time
+        :return: Value or None if there are no samples that old
+        """
+
+        size = self._size
+        first = (self._next - size) % self.capacity
+        timestamps = self._columns["timestamp"]
+
+        # Binary search over the chronologically ordered samples
+        low, high = 0, size
+        while low < high:
+            middle = (low + high) // 2
+
+            if timestamps[(first + middle) % self.capacity] <= timestamp:
+                low = middle + 1
+
+            else:
+                high = middle
+
+        if low == 0:
+            return None
+
+        return self._columns[field][(first + low - 1) % self.capacity]
+
+
+class HistoryStore:
+    """
+    Class holding the rate history of every fetched currency and the total market
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity: int = capacity
+        self._histories: Dict[str, RateHistory] = {}
+
+    def __contains__(self, currency: str) -> bool:
+        return currency in self._histories
+
+    def get(self, currency: str) -> Optional[RateHistory]:
+        """
+        Get the history of a currency
+
+        :param currency: Currency code e.g. 'BTC' or 'market'
+        :return: History of the currency or None if it has not been fetched
+        """
+
+        return self._histories.get(currency)
+
+    def currencies(self) -> List[str]:
+        """
+        Get the currencies that have history
+
+        :return: Currency codes, including 'market'
+        """
+
+        return list(self._histories)
+
+    def append_sample(self, currency: str, timestamp: float, buy: float, sell: float, change_percent: float,
+                      high: float) -> None:
+        """
+        Add a single sample of a currency to the history
+
+        :param currency: Currency code e.g. 'BTC' or 'market'
+        :param timestamp: Unix time of the sample
+        :param buy: Buy price from the users perspective
+        :param sell: Sell price from the users perspective
+        :param change_percent: 24h change in percents
+        :param high: 24h high
+        """
+
+        if currency not in self._histories:
+            self._histories[currency] = RateHistory(self.capacity)
+
+        self._histories[currency].append(timestamp, buy, sell, change_percent, high)
+
+    def append(self, timestamp: float, snapshot: MarketSnapshot) -> None:
+        """
+        Add the currencies and market status of a fetch to the history
+
+        :param timestamp: Unix time of the fetch
+        :param snapshot: Data parsed by 'ApiAccessor'
+        """
+
+        for currency, values in samples_from_snapshot(snapshot):
+            self.append_sample(currency, timestamp, *values)
+
+
+def samples_from_snapshot(snapshot: MarketSnapshot) -> List[Tuple[str, Tuple[float, float, float, float]]]:
+    """
+    Convert a snapshot to samples, market has only the change percent which is stored signed
+
+    :param snapshot: Data parsed by 'ApiAccessor'
+    :return: List of (currency, (buy, sell, changePercent, high))
+    """
+
+    samples: List[Tuple[str, Tuple[float, float, float, float]]] = list(snapshot.rates.items())
+    samples.append(("market", (math.nan, math.nan, snapshot.market.signed_change, math.nan)))
+
+    return samples
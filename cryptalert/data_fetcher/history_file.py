@@ -0,0 +1,322 @@
+"""
+Append-only binary file of fetched rates that survives restarts, reads are done through a memory map
+
+Emil Rekola <emil.rekola@hotmail.com>
+"""
+
+# STD imports
+import os
+import math
+import mmap
+import struct
+import logging
+from pathlib import Path
+from threading import RLock
+from time import time, monotonic
+from typing import Iterator, List, Optional, Tuple
+
+# Local imports
+from cryptalert.data_fetcher.history import HistoryStore, samples_from_snapshot
+from cryptalert.data_fetcher.rates import MarketSnapshot
+
+# File header: magic, format version and record size
+HEADER = struct.Struct("<8sII")
+MAGIC = b"CRYPTHST"
+FORMAT_VERSION = 1
+
+# Record: timestamp, currency code, buy, sell, changePercent, high
+RECORD = struct.Struct("<d8s4d")
+
+# Sample read from the file: (timestamp, currency, buy, sell, changePercent, high)
+Sample = Tuple[float, str, float, float, float, float]
+
+# Records read at a time when scanning
+SCAN_CHUNK = 4096
+
+# Records read at first when walking backwards for the sample of a currency, more than the samples of a single fetch
+WALK_CHUNK = 64
+
+
+class HistoryFile:
+    """
+    Class for appending fixed-width rate records to a file in batches and reading them through a memory map
+    """
+
+    def __init__(self, path: Path, batch_size: int = 128, flush_interval: float = 60.0, max_size: int = 512 << 20,
+                 backups: int = 2):
+        self.path: Path = Path(path)
+        self.batch_size: int = batch_size
+        self.flush_interval: float = flush_interval
+        self.max_size: int = max_size
+        self.backups: int = backups
+        self._pending: bytearray = bytearray()
+        self._pending_count: int = 0
+        self._last_flush: float = monotonic()
+        self._lock: RLock = RLock()
+        self._map: Optional[mmap.mmap] = None
+        self._file = None
+        self._logger = logging.getLogger("ApiAccessor")
+
+        if not self.path.exists() or self.path.stat().st_size < HEADER.size:
+            self._write_header(self.path)
+
+        self._check_header()
+
+    @staticmethod
+    def _write_header(path: Path) -> None:
+        """
+        Create a new empty history file
+        """
+
+        with open(path, "wb") as file:
+            file.write(HEADER.pack(MAGIC, FORMAT_VERSION, RECORD.size))
+
+    def _check_header(self) -> None:
+        """
+        Make sure the file is a history file written in the current format
+        """
+
+        with open(self.path, "rb") as file:
+            magic, version, record_size = HEADER.unpack(file.read(HEADER.size))
+
+        if magic != MAGIC or version != FORMAT_VERSION or record_size != RECORD.size:
+            raise ValueError(f"'{self.path}' is not a supported history file")
+
+    def append(self, timestamp: float, snapshot: MarketSnapshot, flush: bool = True) -> None:
+        """
+        Queue the data of a fetch to be written, the queue is written once it is full or old enough
+
+        :param timestamp: Unix time of the fetch
+        :param snapshot: Data parsed by 'ApiAccessor'
+        :param flush: False if the caller writes the queue itself when 'flush_due' is True, e.g. on another thread
+        """
+
+        with self._lock:
+            for currency, values in samples_from_snapshot(snapshot):
+                self._pending += RECORD.pack(timestamp, currency.encode("ascii"), *values)
+                self._pending_count += 1
+
+            if flush and self.flush_due:
+                self.flush()
+
+    @property
+    def flush_due(self) -> bool:
+        """
+        True if the queued records should be written, the queue is full or old enough
+        """
+
+        return self._pending_count >= self.batch_size or (
+            self._pending_count > 0 and monotonic() - self._last_flush >= self.flush_interval
+        )
+
+    def flush(self) -> None:
+        """
+        Write queued records to the file, rotates the file if it has grown too big
+        """
+
+        with self._lock:
+            self._last_flush = monotonic()
+
+            if not self._pending:
+                return
+
+            with open(self.path, "ab") as file:
+                file.write(self._pending)
+
+            self._pending.clear()
+            self._pending_count = 0
+
+            if self.path.stat().st_size > self.max_size:
+                self.rotate()
+
+    def close(self) -> None:
+        """
+        Write queued records and release the memory map
+        """
+
+        with self._lock:
+            self.flush()
+            self._unmap()
+
+    def _unmap(self) -> None:
+        """
+        Release the memory map, must be done before the file is replaced
+        """
+
+        if self._map is not None:
+            self._map.close()
+            self._file.close()
+            self._map = None
+            self._file = None
+
+    def _records(self) -> memoryview:
+        """
+        Get the written records through a memory map, the map is recreated if the file has grown
+
+        :return: View of the records without the file header, must be released before the map can be closed
+        """
+
+        size = self.path.stat().st_size
+        size -= (size - HEADER.size) % RECORD.size
+
+        if self._map is None or len(self._map) != size:
+            self._unmap()
+
+            if size == HEADER.size:
+                return memoryview(b"")
+
+            self._file = open(self.path, "rb")
+            self._map = mmap.mmap(self._file.fileno(), size, access=mmap.ACCESS_READ)
+
+        return memoryview(self._map)[HEADER.size:]
+
+    def _first_index_after(self, records: memoryview, timestamp: float) -> int:
+        """
+        Binary search the index of the first record written after the given time
+
+        :param records: View returned by '_records'
+        :param timestamp: Unix time
+        :return: Record index, number of records if every record is older
+        """
+
+        low, high = 0, len(records) // RECORD.size
+
+        while low < high:
+            middle = (low + high) // 2
+
+            if struct.unpack_from("<d", records, middle * RECORD.size)[0] <= timestamp:
+                low = middle + 1
+
+            else:
+                high = middle
+
+        return low
+
+    def __len__(self) -> int:
+        with self._lock, self._records() as records:
+            return len(records) // RECORD.size
+
+    def scan(self, since: float = -math.inf, until: float = math.inf) -> Iterator[Sample]:
+        """
+        Iterate over the written samples within a time range
+
+        :param since: Unix time of the oldest sample to include
+        :param until: Unix time of the newest sample to include
+        :return: Iterator of (timestamp, currency, buy, sell, changePercent, high)
+        """
+
+        with self._lock, self._records() as records:
+            index = self._first_index_after(records, math.nextafter(since, -math.inf))
+            end = self._first_index_after(records, until)
+
+        # Copy a chunk at a time so that the map can be recreated while the caller is iterating
+        while index < end:
+            chunk_end = min(index + SCAN_CHUNK, end)
+
+            with self._lock, self._records() as records:
+                chunk = bytes(records[index * RECORD.size:chunk_end * RECORD.size])
+
+            for timestamp, currency, *values in RECORD.iter_unpack(chunk):
+                yield (timestamp, currency.rstrip(b"\0").decode("ascii"), *values)
+
+            index = chunk_end
+
+    def value_at(self, currency: str, field: str, timestamp: float) -> Optional[float]:
+        """
+        Get the value of a field from the latest sample of a currency written at or before the given time
+
+        :param currency: Currency code e.g. 'BTC'
+        :param field: One of 'buy', 'sell', 'changePercent' or 'high'
+        :param timestamp: Unix time
+        :return: Value or None if there are no such samples
+        """
+
+        field_index = ("buy", "sell", "changePercent", "high").index(field) + 2
+        code = currency.encode("ascii")
+
+        with self._lock, self._records() as records:
+            end = self._first_index_after(records, timestamp)
+            chunk_size = WALK_CHUNK
+
+            # Walk backwards from the position found by time until a sample of the currency is found, samples of a
+            # fetch are next to each other so the first chunk is usually enough. Chunks grow for currencies that are
+            # missing from the latest fetches
+            while end > 0:
+                start = max(end - chunk_size, 0)
+                chunk = bytes(records[start * RECORD.size:end * RECORD.size])
+
+                for record in reversed(list(RECORD.iter_unpack(chunk))):
+                    if record[1].rstrip(b"\0") == code:
+                        return record[field_index]
+
+                end = start
+                chunk_size = min(chunk_size * 2, SCAN_CHUNK)
+
+        return None
+
+    def load_into(self, history: HistoryStore, since: float = -math.inf) -> int:
+        """
+        Fill an in-memory history from the file, e.g. on startup
+
+        :param history: History to fill
+        :param since: Unix time of the oldest sample to load
+        :return: Number of loaded samples
+        """
+
+        loaded = 0
+
+        for timestamp, currency, *values in self.scan(since):
+            history.append_sample(currency, timestamp, *values)
+            loaded += 1
+
+        return loaded
+
+    def rotate(self) -> None:
+        """
+        Move the current file aside as a backup and start a new one, oldest backup is removed
+        """
+
+        with self._lock:
+            self._logger.info("Rotating history file '%s'", self.path)
+            self._unmap()
+
+            backups: List[Path] = [self.path.with_name(f"{self.path.name}.{num}") for num in range(1, self.backups + 1)]
+
+            for older, newer in zip(reversed(backups[1:]), reversed(backups[:-1])):
+                if newer.exists():
+                    os.replace(newer, older)
+
+            if backups:
+                os.replace(self.path, backups[0])
+
+            self._write_header(self.path)
+
+    def compact(self, retention: float) -> int:
+        """
+        Remove samples older than the retention period
+
+        :param retention: Seconds of samples to keep
+        :return: Number of removed samples
+        """
+
+        with self._lock:
+            self.flush()
+
+            with self._records() as records:
+                start = self._first_index_after(records, math.nextafter(time() - retention, -math.inf))
+
+                if start == 0:
+                    return 0
+
+                self._logger.info("Compacting history file '%s', removing %d samples", self.path, start)
+
+                temp_path = self.path.with_name(f"{self.path.name}.tmp")
+                self._write_header(temp_path)
+
+                with open(temp_path, "ab") as file:
+                    file.write(records[start * RECORD.size:])
+
+            self._unmap()
+            os.replace(temp_path, self.path)
+
+        return start
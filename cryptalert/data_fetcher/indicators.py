@@ -0,0 +1,324 @@
+"""
+Rolling indicators (moving averages, volatility, min/max) calculated from fetched rates
+
+Emil Rekola <emil.rekola@hotmail.com>
+"""
+
+# STD imports
+import math
+from collections import deque
+from threading import Lock
+from typing import Deque, Dict, List, NamedTuple, Optional, Tuple
+
+# Local imports
+from cryptalert.data_fetcher.history import HistoryStore
+from cryptalert.data_fetcher.rates import MarketSnapshot
+
+
+class Indicators(NamedTuple):
+    """
+    Indicator values of a single window
+    """
+
+    sma: float
+    ema: float
+    std: float
+    minimum: float
+    maximum: float
+
+
+class RollingWindow:
+    """
+    Class for statistics over the latest samples, every update is O(1) amortized
+    """
+
+    def __init__(self, size: int):
+        self.size: int = size
+        self.ema: Optional[float] = None
+        self._alpha: float = 2 / (size + 1)
+        self._values: Deque[float] = deque()
+        self._mean: float = 0.0
+        self._m2: float = 0.0
+        self._count: int = 0
+
+        # Monotonic queues of (sample number, value) for the window min and max
+        self._min: Deque[Tuple[int, float]] = deque()
+        self._max: Deque[Tuple[int, float]] = deque()
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def update(self, value: float) -> None:
+        """
+        Add a sample to the window, oldest sample is dropped once the window is full
+
+        :param value: New sample, NaN values are ignored
+        """
+
+        if math.isnan(value):
+            return
+
+        self._count += 1
+        self._values.append(value)
+
+        # Welford's algorithm for the mean and sum of squared differences, with removal of the oldest sample
+        delta = value - self._mean
+        self._mean += delta / len(self._values)
+        self._m2 += delta * (value - self._mean)
+
+        if len(self._values) > self.size:
+            oldest = self._values.popleft()
+            delta = oldest - self._mean
+            self._mean -= delta / len(self._values)
+            self._m2 -= delta * (oldest - self._mean)
+
+        # Recalculate once per full window to keep floating point errors from accumulating
+        if self._count % self.size == 0:
+            self._resync()
+
+        self.ema = value if self.ema is None else self.ema + self._alpha * (value - self.ema)
+
+        # Drop values that can no longer be the min/max before adding the new value
+        while self._min and self._min[-1][1] >= value:
+            self._min.pop()
+
+        while self._max and self._max[-1][1] <= value:
+            self._max.pop()
+
+        self._min.append((self._count, value))
+        self._max.append((self._count, value))
+
+        # Drop values that have slid out of the window
+        oldest_in_window = self._count - len(self._values) + 1
+
+        if self._min[0][0] < oldest_in_window:
+            self._min.popleft()
+
+        if self._max[0][0] < oldest_in_window:
+            self._max.popleft()
+
+    def restore(self, values: List[float], ema: float, count: int, minimums: List[Tuple[int, float]],
+                maximums: List[Tuple[int, float]]) -> None:
+        """
+        Replace the state of the window with one calculated in batch, the result equals adding the same samples one
+        by one
+
+        :param values: Samples in the window from the oldest to the newest, at most the window size
+        :param ema: EMA over every sample added
+        :param count: Number of samples added
+        :param minimums: Monotonic queue of (sample number, value) for the window min
+        :param maximums: Monotonic queue of (sample number, value) for the window max
+        """
+
+        self._values = deque(values)
+        self._count = count
+        self.ema = ema
+        self._min = deque(minimums)
+        self._max = deque(maximums)
+        self._resync()
+
+    def _resync(self) -> None:
+        """
+        Recalculate the mean and the sum of squared differences from the samples in the window
+        """
+
+        self._mean = math.fsum(self._values) / len(self._values)
+        self._m2 = math.fsum((value - self._mean) ** 2 for value in self._values)
+
+    def indicators(self) -> Optional[Indicators]:
+        """
+        Get the current indicator values
+
+        :return: Indicators or None if there are no samples
+        """
+
+        if not self._values:
+            return None
+
+        return Indicators(
+            sma=self._mean,
+            ema=self.ema,
+            std=math.sqrt(max(self._m2, 0.0) / len(self._values)),
+            minimum=self._min[0][1],
+            maximum=self._max[0][1]
+        )
+
+
+class IndicatorEngine:
+    """
+    Class for keeping rolling indicators of every fetched currency up to date. The windows are updated by the fetch
+    thread and read by the bot and the TUI, so every access holds the engine lock
+    """
+
+    def __init__(self, windows: List[int], field: str = "buy"):
+        self.windows: List[int] = sorted(set(windows))
+        self.field: str = field
+        self._rolling: Dict[str, Dict[int, RollingWindow]] = {}
+        self._lock: Lock = Lock()
+
+    def update(self, snapshot: MarketSnapshot) -> None:
+        """
+        Update indicators with the latest fetched data
+
+        :param snapshot: Data parsed by 'ApiAccessor'
+        """
+
+        with self._lock:
+            for currency, rate in snapshot.rates.items():
+                self._update_currency(currency, rate.get(self.field))
+
+    def _update_currency(self, currency: str, value: float) -> None:
+        """
+        Add a sample to every window of a currency
+
+        :param currency: Currency code
+        :param value: New sample
+        """
+
+        if currency not in self._rolling:
+            self._rolling[currency] = {window: RollingWindow(window) for window in self.windows}
+
+        for rolling in self._rolling[currency].values():
+            rolling.update(value)
+
+    def warm(self, history: HistoryStore, currencies: List[str]) -> None:
+        """
+        Fill the windows from previously stored history, e.g. after a restart. Windows of the given currencies are
+        replaced by ones holding their latest samples up to the longest window. All currencies and windows are
+        calculated at once with NumPy when it is installed, otherwise the samples are added one by one
+
+        :param history: Rate history to read the samples from
+        :param currencies: Currency codes to read from the history
+        """
+
+        np = _numpy()
+
+        with self._lock:
+            if np is not None:
+                self._warm_batch(np, history, currencies)
+            else:
+                self._warm_samples(history, currencies)
+
+    def _warm_samples(self, history: HistoryStore, currencies: List[str]) -> None:
+        """
+        Fill the windows of every currency from the history by adding the samples one by one
+
+        :param history: Rate history to read the samples from
+        :param currencies: Currency codes to read from the history
+        """
+
+        longest = self.windows[-1]
+
+        for currency in currencies:
+            rate_history = history.get(currency)
+
+            if rate_history is None:
+                continue
+
+            self._rolling.pop(currency, None)
+
+            for segment in rate_history.window(self.field, longest):
+                for value in segment:
+                    self._update_currency(currency, value)
+
+    def _warm_batch(self, np, history: HistoryStore, currencies: List[str]) -> None:
+        """
+        Calculate the windows of every currency from the history with NumPy, currencies with the same number of
+        samples are calculated together as one matrix
+
+        :param np: NumPy module
+        :param history: Rate history to read the samples from
+        :param currencies: Currency codes to read from the history
+        """
+
+        groups: Dict[int, Tuple[List[str], List]] = {}
+
+        for currency in currencies:
+            rate_history = history.get(currency)
+
+            if rate_history is None or len(rate_history) == 0:
+                continue
+
+            # Copied out of the ring buffer, NaN samples are skipped as in 'RollingWindow.update'
+            segments = rate_history.window(self.field, self.windows[-1])
+            values = np.concatenate([np.frombuffer(segment, dtype=np.float64) for segment in segments])
+            values = values[~np.isnan(values)]
+
+            self._rolling.pop(currency, None)
+
+            if len(values):
+                names, rows = groups.setdefault(len(values), ([], []))
+                names.append(currency)
+                rows.append(values)
+
+        for count, (names, rows) in groups.items():
+            matrix = np.vstack(rows)
+
+            for currency in names:
+                self._rolling[currency] = {window: RollingWindow(window) for window in self.windows}
+
+            for window in self.windows:
+                tails = matrix[:, -min(window, count):]
+                first = count - tails.shape[1] + 1
+
+                # EMA seeded with the oldest sample as a weighted sum, newest sample has the largest weight
+                alpha = 2 / (window + 1)
+                weights = alpha * (1 - alpha) ** np.arange(count - 1, -1, -1, dtype=np.float64)
+                weights[0] = (1 - alpha) ** (count - 1)
+                emas = matrix @ weights
+
+                for row, currency in enumerate(names):
+                    self._rolling[currency][window].restore(
+                        tails[row].tolist(), float(emas[row]), count,
+                        _monotonic_queue(np, tails[row], first, np.minimum),
+                        _monotonic_queue(np, tails[row], first, np.maximum)
+                    )
+
+    def get(self, currency: str) -> Dict[int, Indicators]:
+        """
+        Get the current indicators of a currency
+
+        :param currency: Currency code
+        :return: Dict with window size as key and indicators as value, empty if there is no data
+        """
+
+        with self._lock:
+            return {
+                window: indicators
+                for window, rolling in self._rolling.get(currency, {}).items()
+                if (indicators := rolling.indicators()) is not None
+            }
+
+
+def _numpy():
+    """
+    Import NumPy on first use, importing it is slow and it is only needed for batch calculations
+
+    :return: NumPy module or None if it is not installed
+    """
+
+    try:
+        import numpy
+
+    except ImportError:
+        return None
+
+    return numpy
+
+
+def _monotonic_queue(np, values, first: int, extreme) -> List[Tuple[int, float]]:
+    """
+    Build the monotonic queue 'RollingWindow.update' keeps for the window min or max, a sample stays in the queue
+    while it is strictly lower (or higher) than every later sample
+
+    :param np: NumPy module
+    :param values: Samples in the window from the oldest to the newest
+    :param first: Sample number of the oldest sample
+    :param extreme: 'np.minimum' for the min queue, 'np.maximum' for the max queue
+    :return: Queue of (sample number, value) from the oldest to the newest
+    """
+
+    later = extreme.accumulate(values[::-1])[::-1]
+    kept = np.append((extreme(values[:-1], later[1:]) == values[:-1]) & (values[:-1] != later[1:]), True)
+
+    return [(first + int(index), float(values[index])) for index in np.flatnonzero(kept)]
@@ -0,0 +1,326 @@
+"""
+Latency histograms, per-stage timings and success/error counters of the data fetcher
+
+Emil Rekola <emil.rekola@hotmail.com>
+"""
+
+# STD imports
+from threading import Lock
+from time import monotonic
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+# Upper bounds in seconds of the Prometheus histogram buckets
+LATENCY_BUCKETS: Tuple[float, ...] = (0.001, 0.005, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Stages of a fetch in the order they happen, not every fetcher reports every stage
+STAGES: Tuple[str, ...] = ("dns", "connect", "request", "transfer", "decode", "parse", "publish")
+
+
+class HdrHistogram:
+    """
+    Class for a log-linear histogram of latencies in microseconds in the style of HdrHistogram, every power of two is
+    split into linear sub-buckets so recording is O(1) and quantiles have a bounded relative error
+    """
+
+    # 2 ** sub_bits sub-buckets per power of two gives a relative error of at most 1 / 2 ** sub_bits
+    sub_bits: int = 4
+
+    # Values are clamped to 2 ** max_bits microseconds, over 30 minutes
+    max_bits: int = 31
+
+    def __init__(self):
+        # Values over the range of the histogram are clamped to the bucket of the largest value, which is the last one
+        self.counts: List[int] = [0] * (self._index(1 << self.max_bits) + 1)
+        self.total: float = 0.0
+        self.count: int = 0
+        self.max: float = 0.0
+
+    def _index(self, micros: int) -> int:
+        sub_buckets = 1 << self.sub_bits
+
+        if micros < sub_buckets:
+            return micros
+
+        shift = min(micros.bit_length(), self.max_bits) - self.sub_bits - 1
+        return sub_buckets * (shift + 1) + min(micros >> shift, 2 * sub_buckets - 1) - sub_buckets
+
+    def _upper_bound(self, index: int) -> float:
+        """
+        Highest value in seconds that is counted into the bucket of the given index
+        """
+
+        sub_buckets = 1 << self.sub_bits
+
+        if index < sub_buckets:
+            return index / 1e6
+
+        shift, sub_bucket = divmod(index - sub_buckets, sub_buckets)
+        return (((sub_buckets + sub_bucket + 1) << shift) - 1) / 1e6
+
+    def observe(self, seconds: float) -> None:
+        """
+        Add a latency to the histogram
+
+        :param seconds: Latency in seconds
+        """
+
+        self.counts[self._index(max(0, int(seconds * 1e6)))] += 1
+        self.total += seconds
+        self.count += 1
+        self.max = max(self.max, seconds)
+
+    def quantile(self, quantile: float) -> float:
+        """
+        Get the latency that the given share of the observations are at most
+
+        :param quantile: Share between 0 and 1, e.g. 0.99
+        :return: Latency in seconds, 0 if there are no observations
+        """
+
+        if self.count == 0:
+            return 0.0
+
+        target = max(1, round(quantile * self.count))
+        running = 0
+
+        for index, count in enumerate(self.counts):
+            running += count
+
+            # Values over the range of the histogram are all counted to the last bucket
+            if running >= target:
+                return min(self._upper_bound(index), self.max) if index < len(self.counts) - 1 else self.max
+
+        return self.max
+
+    def cumulative(self, bounds: Tuple[float, ...] = LATENCY_BUCKETS) -> List[Tuple[float, int]]:
+        """
+        Get the cumulative counts for the given bucket bounds, e.g. for Prometheus
+
+        :param bounds: Upper bounds in seconds in increasing order
+        :return: List of (upper bound, count of latencies at most the bound), last bound is infinity
+        """
+
+        result = []
+        running = 0
+        index = 0
+
+        for bound in bounds:
+            while index < len(self.counts) and self._upper_bound(index) <= bound:
+                running += self.counts[index]
+                index += 1
+
+            result.append((bound, running))
+
+        result.append((float("inf"), self.count))
+
+        return result
+
+    def copy(self) -> "HdrHistogram":
+        histogram = HdrHistogram()
+        histogram.counts = list(self.counts)
+        histogram.total, histogram.count, histogram.max = self.total, self.count, self.max
+
+        return histogram
+
+    def merge(self, other: "HdrHistogram") -> None:
+        """
+        Add the values of another histogram to this one
+
+        :param other: Histogram with the same bucket layout
+        """
+
+        self.counts = [count + other_count for count, other_count in zip(self.counts, other.counts)]
+        self.total += other.total
+        self.count += other.count
+        self.max = max(self.max, other.max)
+
+
+class StageSummary(NamedTuple):
+    """
+    Latency quantiles of a stage or a source in seconds
+    """
+
+    count: int
+    p50: float
+    p90: float
+    p99: float
+    max: float
+
+    def describe(self) -> str:
+        return f"p50 {self.p50 * 1000:.1f} ms  p99 {self.p99 * 1000:.1f} ms  max {self.max * 1000:.1f} ms"
+
+
+class FetchMetrics:
+    """
+    Class for collecting latencies, stage timings and results of fetches, updated from the fetcher threads and read
+    by the Discord bot, the TUI, the HTTP endpoint and logs
+    """
+
+    def __init__(self):
+        self.latency: Dict[str, HdrHistogram] = {}
+        self.stages: Dict[str, HdrHistogram] = {}
+        self.successes: Dict[str, int] = {}
+        self.errors: Dict[Tuple[str, str], int] = {}
+        self.last_success: Optional[float] = None
+        self._lock: Lock = Lock()
+
+    def observe(self, source: str, seconds: float) -> None:
+        """
+        Record the latency of a request to a source or of a whole fetch
+
+        :param source: Name of the source, 'total' for a whole fetch over all sources
+        :param seconds: Latency in seconds
+        """
+
+        with self._lock:
+            if source not in self.latency:
+                self.latency[source] = HdrHistogram()
+
+            self.latency[source].observe(seconds)
+
+    def stage(self, stage: str, seconds: float) -> None:
+        """
+        Record the time spent in a stage of a fetch
+
+        :param stage: One of 'STAGES'
+        :param seconds: Duration in seconds
+        """
+
+        with self._lock:
+            if stage not in self.stages:
+                self.stages[stage] = HdrHistogram()
+
+            self.stages[stage].observe(seconds)
+
+    def success(self, source: str) -> None:
+        """
+        Count a request to a source that returned valid data
+
+        :param source: Name of the source
+        """
+
+        with self._lock:
+            self.successes[source] = self.successes.get(source, 0) + 1
+            self.last_success = monotonic()
+
+    def error(self, source: str, kind: str) -> None:
+        """
+        Count a failed request to a source
+
+        :param source: Name of the source
+        :param kind: Name of the exception type or the reason e.g. 'ReadTimeout' or 'InvalidData'
+        """
+
+        with self._lock:
+            self.errors[(source, kind)] = self.errors.get((source, kind), 0) + 1
+
+    def histograms(self) -> Dict[str, HdrHistogram]:
+        """
+        Get copies of the latency histograms that are safe to read while fetches continue
+
+        :return: Dict with source name as key and histogram as value
+        """
+
+        with self._lock:
+            return {source: histogram.copy() for source, histogram in self.latency.items()}
+
+    def stage_histograms(self) -> Dict[str, HdrHistogram]:
+        """
+        Get copies of the stage histograms in the order of 'STAGES'
+
+        :return: Dict with stage name as key and histogram as value
+        """
+
+        with self._lock:
+            return {stage: self.stages[stage].copy() for stage in STAGES if stage in self.stages}
+
+    def error_counts(self) -> Dict[Tuple[str, str], int]:
+        """
+        Get a copy of the error counters
+
+        :return: Dict with (source name, error kind) as key and count as value
+        """
+
+        with self._lock:
+            return dict(self.errors)
+
+    def success_counts(self) -> Dict[str, int]:
+        """
+        Get a copy of the success counters
+
+        :return: Dict with source name as key and count as value
+        """
+
+        with self._lock:
+            return dict(self.successes)
+
+    @staticmethod
+    def _summary(histogram: HdrHistogram) -> StageSummary:
+        return StageSummary(histogram.count, histogram.quantile(0.5), histogram.quantile(0.9),
+                            histogram.quantile(0.99), histogram.max)
+
+    def stage_summary(self) -> Dict[str, StageSummary]:
+        """
+        Get latency quantiles of every stage that has been recorded
+
+        :return: Dict with stage name as key in the order of 'STAGES'
+        """
+
+        return {stage: self._summary(histogram) for stage, histogram in self.stage_histograms().items()}
+
+    def source_summary(self) -> Dict[str, StageSummary]:
+        """
+        Get latency quantiles of every source and of whole fetches ('total')
+
+        :return: Dict with source name as key
+        """
+
+        return {source: self._summary(histogram) for source, histogram in self.histograms().items()}
+
+    def describe(self) -> str:
+        """
+        Create a short multi-line report of the fetch latencies and results, e.g. for the 'lastFetch' command and logs
+
+        :return: Report, empty if nothing has been recorded
+        """
+
+        lines = []
+
+        total = self.source_summary().get("total")
+        if total is not None:
+            lines.append(f"Fetch: {total.describe()} ({total.count} fetches)")
+
+        stages = self.stage_summary()
+        if stages:
+            lines.append("Stages p50/p99: " + "  ".join(
+                f"{stage} {summary.p50 * 1000:.1f}/{summary.p99 * 1000:.1f} ms" for stage, summary in stages.items()
+            ))
+
+        successes = self.success_counts()
+        errors = self.error_counts()
+        for source in sorted(set(successes) | {source for source, _ in errors}):
+            failed = ", ".join(f"{kind} {count}" for (name, kind), count in sorted(errors.items()) if name == source)
+            lines.append(f"{source}: {successes.get(source, 0)} ok" + (f", failed: {failed}" if failed else ""))
+
+        if self.last_success is not None:
+            lines.append(f"Last succesful request {monotonic() - self.last_success:.1f} s ago")
+
+        return "\n".join(lines)
+
+    def status_line(self) -> str:
+        """
+        Create a one line summary for the TUI
+
+        :return: Summary of fetch latency and the slowest stages, empty if nothing has been recorded
+        """
+
+        total = self.source_summary().get("total")
+
+        if total is None:
+            return ""
+
+        slowest = sorted(self.stage_summary().items(), key=lambda item: item[1].p50, reverse=True)[:3]
+        stages = "  ".join(f"{stage} {summary.p50 * 1000:.1f} ms" for stage, summary in slowest)
+        errors = sum(self.error_counts().values())
+
+        return f"Fetch p50 {total.p50 * 1000:.1f} ms  p99 {total.p99 * 1000:.1f} ms | {stages} | errors {errors}"
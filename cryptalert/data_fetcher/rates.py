@@ -0,0 +1,93 @@
+"""
+Immutable types for fetched rates, built once per fetch and shared read-only by the TUI and the Discord bot
+
+Emil Rekola <emil.rekola@hotmail.com>
+"""
+
+# STD imports
+import math
+from types import MappingProxyType
+from typing import Dict, Mapping, NamedTuple, Tuple
+
+# Fields of a currency in the same order as in 'RateSnapshot', names match the ones used in the API
+RATE_FIELDS: Tuple[str, ...] = ("buy", "sell", "changePercent", "high")
+_FIELD_INDEX: Dict[str, int] = {field: index for index, field in enumerate(RATE_FIELDS)}
+
+
+def to_float(value) -> float:
+    """
+    Convert a numeric or formatted value from the API to a float, e.g. '1 234,56 €' -> 1234.56
+
+    :param value: Number or formatted string
+    :return: Converted value or NaN if conversion was not possible
+    """
+
+    if isinstance(value, (int, float)):
+        return float(value)
+
+    try:
+        cleaned = "".join(char for char in str(value) if char.isdigit() or char in "-.,")
+        return float(cleaned.replace(",", "."))
+
+    except ValueError:
+        return math.nan
+
+
+class RateSnapshot(NamedTuple):
+    """
+    Rates of a single currency, buy and sell are from the perspective of the user
+    """
+
+    buy: float
+    sell: float
+    change_percent: float
+    high: float
+
+    def get(self, field: str) -> float:
+        """
+        Get a value by its field name
+
+        :param field: One of 'RATE_FIELDS'
+        :return: Value of the field
+        """
+
+        return self[_FIELD_INDEX[field]]
+
+
+class MarketStatus(NamedTuple):
+    """
+    Total market trend, change percent is given without sign
+    """
+
+    change_percent: float
+    rising: bool
+
+    @property
+    def signed_change(self) -> float:
+        """
+        Change percent with the sign of the trend
+        """
+
+        return self.change_percent if self.rising else -self.change_percent
+
+
+class Quote(NamedTuple):
+    """
+    Best rates of a currency over all rate sources and the sources offering them
+    """
+
+    buy: float
+    buy_source: str
+    sell: float
+    sell_source: str
+
+
+class MarketSnapshot(NamedTuple):
+    """
+    Rates of all watched currencies and the market status from a single fetch, rates hold the best buy and sell
+    rates when data is merged from several sources
+    """
+
+    rates: Mapping[str, RateSnapshot]
+    market: MarketStatus
+    quotes: Mapping[str, Quote] = MappingProxyType({})
@@ -0,0 +1,174 @@
+"""
+Adaptive polling interval based on how much the fetched rates move between fetches
+
+Emil Rekola <emil.rekola@hotmail.com>
+"""
+
+# STD imports
+import math
+import logging
+from collections import deque
+from time import monotonic
+from typing import Deque, NamedTuple, Optional
+
+# Local imports
+from cryptalert.data_fetcher.rates import MarketSnapshot
+
+
+class PollMetrics(NamedTuple):
+    """
+    Statistics of the polling rate
+    """
+
+    interval: float
+    polls_per_hour: float
+    shortened: int
+    lengthened: int
+    throttled: int
+
+
+class PollScheduler:
+    """
+    Class for choosing the delay between fetches, the interval shortens when the change percents move faster than
+    usually and lengthens when they stay flat. Requests are limited by an hourly budget
+    """
+
+    # Interval is multiplied or divided by this when it is lengthened or shortened
+    step: float = 1.5
+
+    # Movement compared to the long-term average that shortens or lengthens the interval
+    fast_ratio: float = 2.0
+    slow_ratio: float = 0.5
+
+    # Smoothing factor of the long-term average movement
+    baseline_alpha: float = 0.02
+
+    def __init__(self, base_interval: float, min_interval: float, max_interval: float, budget: int):
+        self.min_interval: float = min(min_interval, max_interval)
+        self.max_interval: float = max(min_interval, max_interval)
+        self.base_interval: float = self._clamp(base_interval)
+        self.interval: float = self.base_interval
+        self.budget: int = budget
+        self.shortened: int = 0
+        self.lengthened: int = 0
+        self.throttled: int = 0
+
+        # Token bucket for the hourly budget, five minutes of requests can be made in a burst
+        self._capacity: float = max(1.0, budget / 12)
+        self._tokens: float = self._capacity
+        self._refilled: float = monotonic()
+
+        self._baseline: Optional[float] = None
+        self._previous: Optional[MarketSnapshot] = None
+        self._previous_time: float = 0.0
+        self._polls: Deque[float] = deque()
+        self._logger = logging.getLogger("ApiAccessor")
+
+    def _clamp(self, interval: float) -> float:
+        return min(self.max_interval, max(self.min_interval, interval))
+
+    def record_poll(self, requests: int = 1) -> None:
+        """
+        Record a poll of the rate sources, failed requests count towards the budget too
+
+        :param requests: Requests made by the poll, one per source
+        """
+
+        now = monotonic()
+        self._polls.append(now)
+
+        while self._polls[0] < now - 3600:
+            self._polls.popleft()
+
+        if self.budget > 0:
+            self._refill(now)
+            self._tokens -= requests
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self._capacity, self._tokens + (now - self._refilled) * self.budget / 3600)
+        self._refilled = now
+
+    def observe(self, snapshot: MarketSnapshot) -> None:
+        """
+        Adjust the interval based on how much the change percents moved since the previous succesful fetch
+
+        :param snapshot: Latest data
+        """
+
+        now = monotonic()
+        previous, elapsed = self._previous, now - self._previous_time
+        self._previous, self._previous_time = snapshot, now
+
+        if previous is None or elapsed <= 0:
+            return
+
+        # Largest move of the change percents in points per second
+        moves = [abs(rate.change_percent - previous.rates[currency].change_percent)
+                 for currency, rate in snapshot.rates.items() if currency in previous.rates]
+        moves.append(abs(snapshot.market.signed_change - previous.market.signed_change))
+        movement = max((move for move in moves if not math.isnan(move)), default=0.0) / elapsed
+
+        baseline = self._baseline
+
+        if movement == 0.0 or (baseline and movement < baseline * self.slow_ratio):
+            self._set_interval(self.interval * self.step)
+
+        elif baseline and movement > baseline * self.fast_ratio:
+            self._set_interval(self.interval / self.step)
+
+        # Drift back towards the configured interval when the movement is usual
+        else:
+            self._set_interval(self.interval + (self.base_interval - self.interval) / 4)
+
+        self._baseline = movement if baseline is None else baseline + self.baseline_alpha * (movement - baseline)
+
+    def _set_interval(self, interval: float) -> None:
+        interval = self._clamp(interval)
+
+        if interval < self.interval:
+            self.shortened += 1
+
+        elif interval > self.interval:
+            self.lengthened += 1
+
+        self.interval = interval
+
+    def next_delay(self, delay: Optional[float] = None) -> float:
+        """
+        Get the delay before the next request, the budget is applied to the given delay too
+
+        :param delay: Delay to use instead of the adaptive interval e.g. a retry delay
+        :return: Delay in seconds
+        """
+
+        delay = self.interval if delay is None else delay
+
+        if self.budget <= 0:
+            return delay
+
+        # Wait until the bucket has a token for the next request
+        self._refill(monotonic())
+        budget_wait = (1 - self._tokens) * 3600 / self.budget
+
+        if budget_wait > delay:
+            self.throttled += 1
+            self._logger.info("Request budget of %d per hour reached, delaying next fetch", self.budget)
+            return budget_wait
+
+        return delay
+
+    def metrics(self) -> PollMetrics:
+        """
+        Get statistics of the polling rate
+
+        :return: Current interval, polls during the last hour scaled to an hourly rate and adjustment counters
+        """
+
+        polls = len(self._polls)
+        polls_per_hour = 0.0
+
+        if polls > 1:
+            span = max(monotonic() - self._polls[0], 1.0)
+            polls_per_hour = polls * 3600 / span if span < 3600 else float(polls)
+
+        return PollMetrics(self.interval, polls_per_hour, self.shortened, self.lengthened, self.throttled)
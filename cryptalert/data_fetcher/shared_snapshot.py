@@ -0,0 +1,339 @@
+"""
+Sharing snapshots between processes through a shared memory segment, one fetcher process writes and any number of
+worker processes read without serialisation
+
+Emil Rekola <emil.rekola@hotmail.com>
+"""
+
+# STD imports
+import os
+import struct
+import logging
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from threading import Event
+from time import sleep
+from types import MappingProxyType
+from typing import NamedTuple, Optional, Tuple
+
+# Local imports
+from cryptalert.data_fetcher.rates import MarketSnapshot, MarketStatus, Quote, RateSnapshot
+from cryptalert.exceptions import UnsupportedOperationModeException
+
+# Identifies the layout, zeroed when the fetcher closes the segment so that workers attach to the next one
+MAGIC: bytes = b"CRYPTAL2"
+
+# Process ID of the fetcher writing the segment, tells if a segment left behind is still in use
+_PID = struct.Struct("<Q")
+
+# Sequence number of the seqlock, odd while the writer is writing
+_SEQ = struct.Struct("<Q")
+
+# Version, timestamp, successful fetches, failed fetches, consecutive failures, currency count, market change and
+# market trend
+_HEADER = struct.Struct("<QdQQIId?")
+
+# Currency code, buy, sell, change percent, high, whether there is a quote, best buy and its source and best sell and
+# its source
+_RECORD = struct.Struct("<8s4d?d16sd16s")
+
+_PID_OFFSET = len(MAGIC)
+_SEQ_OFFSET = _PID_OFFSET + _PID.size
+_HEADER_OFFSET = _SEQ_OFFSET + _SEQ.size
+_RECORDS_OFFSET = _HEADER_OFFSET + _HEADER.size
+
+# Currencies that fit the segment, more than the supported currencies and the watchlists need
+MAX_CURRENCIES: int = 256
+
+
+class SharedHeader(NamedTuple):
+    """
+    State of the fetcher process written with every snapshot, version is 0 until the first snapshot
+    """
+
+    version: int
+    timestamp: float
+    successful_fetches: int
+    failed_fetches: int
+    consecutive_failures: int
+
+
+def segment_size(capacity: int) -> int:
+    """
+    Size of a segment holding the given number of currencies
+
+    :param capacity: Maximum number of currencies
+    :return: Size in bytes
+    """
+
+    return _RECORDS_OFFSET + capacity * _RECORD.size
+
+
+def _attach(name: str) -> SharedMemory:
+    """
+    Attach to an existing segment without removing it when this process exits
+
+    :param name: Name of the segment
+    :return: Attached segment
+    """
+
+    try:
+        return SharedMemory(name, track=False)
+
+    # Before Python 3.13 attaching registers the segment to be removed when this process exits
+    except TypeError:
+        shm = SharedMemory(name)
+
+        if os.name != "nt":
+            resource_tracker.unregister(shm._name, "shared_memory")
+
+        return shm
+
+
+def _process_alive(pid: int) -> bool:
+    """
+    Check if a process is running
+
+    :param pid: Process ID
+    :return: False only if there is certainly no such process
+    """
+
+    # Segments are removed with their last handle on Windows, an existing segment is always in use
+    if pid == 0 or os.name == "nt":
+        return True
+
+    try:
+        os.kill(pid, 0)
+
+    except ProcessLookupError:
+        return False
+
+    # Process of another user
+    except PermissionError:
+        return True
+
+    return True
+
+
+class SharedSnapshotWriter:
+    """
+    Class for writing snapshots to a shared memory segment protected by a seqlock. The sequence number is odd while a
+    snapshot is written, readers retry if it was odd or changed while they read
+    """
+
+    def __init__(self, name: str, capacity: int = MAX_CURRENCIES):
+        self.name: str = name
+        self.capacity: int = capacity
+        self._seq: int = 0
+        self._logger = logging.getLogger("ApiAccessor")
+
+        try:
+            self._shm = SharedMemory(name, create=True, size=segment_size(capacity))
+
+        except FileExistsError:
+            self._remove_stale(name)
+            self._shm = SharedMemory(name, create=True, size=segment_size(capacity))
+
+        buffer = self._shm.buf
+        _PID.pack_into(buffer, _PID_OFFSET, os.getpid())
+        _SEQ.pack_into(buffer, _SEQ_OFFSET, self._seq)
+        _HEADER.pack_into(buffer, _HEADER_OFFSET, 0, 0.0, 0, 0, 0, 0, 0.0, False)
+        buffer[:len(MAGIC)] = MAGIC
+
+        self._logger.info("Sharing snapshots through shared memory segment '%s' (%d bytes)", name, self._shm.size)
+
+    def _remove_stale(self, name: str) -> None:
+        """
+        Remove a segment left behind by a fetcher that did not exit cleanly, a segment that is still written by a
+        running fetcher or that was not created by a fetcher is left alone
+
+        :param name: Name of the segment
+        """
+
+        # Attached with tracking so that unlinking it also unregisters it
+        existing = SharedMemory(name)
+        magic = bytes(existing.buf[:len(MAGIC)])
+        pid = _PID.unpack_from(existing.buf, _PID_OFFSET)[0] if existing.size >= _SEQ_OFFSET else 0
+
+        # Magic is zeroed when the fetcher closes the segment
+        if magic not in (MAGIC, bytes(len(MAGIC))) or _process_alive(pid):
+            existing.close()
+
+            if os.name != "nt":
+                resource_tracker.unregister(existing._name, "shared_memory")
+
+            self._logger.critical("Shared memory segment '%s' is in use by another process", name)
+            raise UnsupportedOperationModeException(
+                f"Shared memory segment '{name}' is in use by another process, give the fetcher a different name"
+            )
+
+        self._logger.warning("Removing shared memory segment '%s' left behind by process %d", name, pid)
+        existing.close()
+        existing.unlink()
+
+    def write(self, header: SharedHeader, data: Optional[MarketSnapshot]) -> None:
+        """
+        Write the state of the fetcher and the latest data to the segment
+
+        :param header: State of the fetcher
+        :param data: Latest data, None before the first succesful fetch
+        """
+
+        rates = list(data.rates.items()) if data is not None else []
+
+        if len(rates) > self.capacity:
+            self._logger.warning("Only %d of %d currencies fit the shared memory segment", self.capacity, len(rates))
+            rates = rates[:self.capacity]
+
+        buffer = self._shm.buf
+        self._seq += 1
+        _SEQ.pack_into(buffer, _SEQ_OFFSET, self._seq)
+
+        market = data.market if data is not None else MarketStatus(0.0, False)
+        _HEADER.pack_into(buffer, _HEADER_OFFSET, *header, len(rates), market.change_percent, market.rising)
+
+        offset = _RECORDS_OFFSET
+        for currency, rate in rates:
+            quote = data.quotes.get(currency)
+
+            if quote is None:
+                quote_fields = (False, 0.0, b"", 0.0, b"")
+
+            else:
+                quote_fields = (True, quote.buy, quote.buy_source.encode(), quote.sell, quote.sell_source.encode())
+
+            _RECORD.pack_into(buffer, offset, currency.encode(), *rate, *quote_fields)
+            offset += _RECORD.size
+
+        self._seq += 1
+        _SEQ.pack_into(buffer, _SEQ_OFFSET, self._seq)
+
+    def run(self, api_accessor, stop_flag: Event, interval: float = 1.0) -> None:
+        """
+        Write every new snapshot as soon as it is published and the fetch counters at the given interval until the
+        stop flag is set, the segment is removed when stopped
+
+        :param api_accessor: Data fetcher, threaded or asynchronous
+        :param stop_flag: Set when the application is closing
+        :param interval: Seconds between the checks of the fetch counters
+        """
+
+        written = None
+
+        try:
+            while not stop_flag.is_set():
+                snapshot = api_accessor.bus.latest
+                header = SharedHeader(
+                    snapshot.version if snapshot is not None else 0,
+                    snapshot.timestamp if snapshot is not None else 0.0,
+                    api_accessor.successful_fetches,
+                    api_accessor.failed_fetches,
+                    api_accessor.consecutive_failures
+                )
+
+                if header != written:
+                    self.write(header, snapshot.data if snapshot is not None else None)
+                    written = header
+
+                api_accessor.bus.wait_for_newer(header.version, interval)
+
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        """
+        Detach the workers and remove the segment
+        """
+
+        self._shm.buf[:len(MAGIC)] = bytes(len(MAGIC))
+        self._shm.close()
+        self._shm.unlink()
+
+
+class SharedSnapshotReader:
+    """
+    Class for reading snapshots from the shared memory segment of a fetcher process. Records are unpacked straight
+    from the shared memory, data is built only when the version has changed
+    """
+
+    # Attempts to get a consistent read before giving up until the next poll
+    max_attempts: int = 100
+
+    def __init__(self, name: str):
+        self.name: str = name
+        self._shm: SharedMemory = _attach(name)
+        self.capacity: int = (self._shm.size - _RECORDS_OFFSET) // _RECORD.size
+
+    @property
+    def attached(self) -> bool:
+        """
+        False once the fetcher has closed the segment
+        """
+
+        return bytes(self._shm.buf[:len(MAGIC)]) == MAGIC
+
+    def read(self, known_version: int) -> Optional[Tuple[SharedHeader, Optional[MarketSnapshot]]]:
+        """
+        Read the state of the fetcher and the data if its version differs from the known version
+
+        :param known_version: Version of the data the caller already has
+        :return: State and data, data is None if the version has not changed. None if the writer kept writing for
+            every attempt or the segment was closed
+        """
+
+        buffer = self._shm.buf
+
+        for _ in range(self.max_attempts):
+            if not self.attached:
+                return None
+
+            seq = _SEQ.unpack_from(buffer, _SEQ_OFFSET)[0]
+
+            # Writer is in the middle of a write
+            if seq & 1:
+                sleep(0)
+                continue
+
+            *fields, count, market_change, market_rising = _HEADER.unpack_from(buffer, _HEADER_OFFSET)
+            header = SharedHeader(*fields)
+            data = None
+
+            if header.version != known_version and header.version > 0:
+                data = self._unpack(buffer, min(count, self.capacity), MarketStatus(market_change, market_rising))
+
+            if _SEQ.unpack_from(buffer, _SEQ_OFFSET)[0] == seq:
+                return header, data
+
+        return None
+
+    @staticmethod
+    def _unpack(buffer: memoryview, count: int, market: MarketStatus) -> MarketSnapshot:
+        """
+        Build data from the records of the segment, values might be torn if the writer started writing meanwhile so
+        the caller must check the sequence number afterwards
+
+        :param buffer: Buffer of the segment
+        :param count: Number of records
+        :param market: Market status from the header
+        :return: Data of the snapshot
+        """
+
+        rates = {}
+        quotes = {}
+
+        records = buffer[_RECORDS_OFFSET:_RECORDS_OFFSET + count * _RECORD.size]
+        for code, buy, sell, change, high, has_quote, best_buy, buy_source, best_sell, sell_source in \
+                _RECORD.iter_unpack(records):
+            currency = code.rstrip(b"\0").decode(errors="replace")
+            rates[currency] = RateSnapshot(buy, sell, change, high)
+
+            if has_quote:
+                quotes[currency] = Quote(best_buy, buy_source.rstrip(b"\0").decode(errors="replace"),
+                                         best_sell, sell_source.rstrip(b"\0").decode(errors="replace"))
+
+        records.release()
+
+        return MarketSnapshot(MappingProxyType(rates), market, MappingProxyType(quotes))
+
+    def close(self) -> None:
+        self._shm.close()
@@ -0,0 +1,130 @@
+"""
+Publishing fetched data to the TUI and the Discord bot as immutable versioned snapshots
+
+Emil Rekola <emil.rekola@hotmail.com>
+"""
+
+# STD imports
+import logging
+from threading import Condition
+from typing import Callable, List, NamedTuple, Optional, TYPE_CHECKING
+
+# Local imports
+from cryptalert.data_fetcher.rates import MarketSnapshot
+
+# Only the Discord bot needs asyncio, it is not imported when running without the bot
+if TYPE_CHECKING:
+    import asyncio
+
+
+class Snapshot(NamedTuple):
+    """
+    Data of a single succesful fetch, version grows by one for every published snapshot
+    """
+
+    version: int
+    timestamp: float
+    data: MarketSnapshot
+
+
+class SnapshotBus:
+    """
+    Class for publishing snapshots to subscribers, usable from threads and asyncio event loops
+    """
+
+    def __init__(self):
+        self.latest: Optional[Snapshot] = None
+        self._condition: Condition = Condition()
+        self._callbacks: List[Callable[[Snapshot], None]] = []
+        self._logger = logging.getLogger("ApiAccessor")
+
+    @property
+    def version(self) -> int:
+        """
+        Version of the latest snapshot, 0 if nothing has been published
+        """
+
+        snapshot = self.latest
+        return snapshot.version if snapshot is not None else 0
+
+    def publish(self, timestamp: float, data: MarketSnapshot) -> Snapshot:
+        """
+        Publish new data as the latest snapshot and notify subscribers
+
+        :param timestamp: Unix time of the fetch
+        :param data: Data parsed by 'ApiAccessor', immutable so it is shared between threads without copying
+        :return: Published snapshot
+        """
+
+        with self._condition:
+            snapshot = Snapshot(self.version + 1, timestamp, data)
+            self.latest = snapshot
+            self._condition.notify_all()
+            callbacks = list(self._callbacks)
+
+        for callback in callbacks:
+            try:
+                callback(snapshot)
+
+            except Exception:
+                self._logger.exception("Snapshot subscriber failed")
+
+        return snapshot
+
+    def subscribe(self, callback: Callable[[Snapshot], None]) -> Callable[[Snapshot], None]:
+        """
+        Call the given function with every published snapshot, called on the publishing thread so it must be quick
+
+        :param callback: Function taking a snapshot
+        :return: The callback, used for unsubscribing
+        """
+
+        with self._condition:
+            self._callbacks.append(callback)
+
+        return callback
+
+    def unsubscribe(self, callback: Callable[[Snapshot], None]) -> None:
+        """
+        Stop calling a previously subscribed function
+
+        :param callback: Callback returned by 'subscribe' or 'subscribe_async'
+        """
+
+        with self._condition:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def subscribe_async(self, loop: "asyncio.AbstractEventLoop",
+                        queue: "asyncio.Queue") -> Callable[[Snapshot], None]:
+        """
+        Put every published snapshot to an asyncio queue of the given event loop, only the latest snapshot is kept
+        if the consumer falls behind
+
+        :param loop: Event loop that consumes the queue
+        :param queue: Queue created on the event loop, maxsize of 1 is enough
+        :return: Callback used for unsubscribing
+        """
+
+        def put_latest(snapshot: Snapshot) -> None:
+            if queue.full():
+                queue.get_nowait()
+
+            queue.put_nowait(snapshot)
+
+        return self.subscribe(lambda snapshot: loop.call_soon_threadsafe(put_latest, snapshot))
+
+    def wait_for_newer(self, version: int, timeout: Optional[float] = None) -> Optional[Snapshot]:
+        """
+        Block until a snapshot newer than the given version has been published
+
+        :param version: Version the caller already has
+        :param timeout: Seconds to wait at most, None waits indefinitely
+        :return: Latest snapshot or None if timed out
+        """
+
+        with self._condition:
+            if self._condition.wait_for(lambda: self.version > version, timeout):
+                return self.latest
+
+        return None
@@ -0,0 +1,366 @@
+"""
+Rate sources (exchanges) that are polled for data and merging their rates into a single snapshot
+
+Emil Rekola <emil.rekola@hotmail.com>
+"""
+
+# STD imports
+import math
+import json
+import hashlib
+import logging
+from time import monotonic
+from types import MappingProxyType
+from typing import Dict, List, Optional, Tuple
+
+# Local imports
+from cryptalert.data_fetcher.metrics import FetchMetrics
+from cryptalert.data_fetcher.rates import MarketSnapshot, MarketStatus, Quote, RateSnapshot, to_float
+
+
+class RateSource:
+    """
+    Class for a single rate source, keeps the validators and the latest parsed data of the source. Subclasses
+    implement 'parse' for the response format of the exchange
+    """
+
+    name: str = ""
+
+    def __init__(self, address: str, currencies: List[str], deadline: float, metrics: FetchMetrics):
+        self.address: str = address
+        self.deadline: float = deadline
+        self.metrics: FetchMetrics = metrics
+        self.snapshot: Optional[MarketSnapshot] = None
+
+        # True if the latest response held different data than the previous one
+        self.changed: bool = False
+
+        # Validators and hash of the previous response, used for skipping unchanged data. They are valid only for
+        # the list of currencies the response was parsed for
+        self._etag = None
+        self._last_modified = None
+        self._body_hash = None
+        self._validated_for: Optional[List[str]] = None
+
+        self._logger = logging.getLogger("ApiAccessor")
+        self.set_currencies(currencies)
+
+    def set_currencies(self, currencies: List[str]) -> None:
+        """
+        Change the watched currencies, the next response is parsed even if it has not changed. Can be called while
+        a fetch is running as the list is replaced instead of modified
+
+        :param currencies: Currency codes e.g. 'btc'
+        """
+
+        self.currencies: List[str] = [currency.upper() for currency in currencies]
+
+    @property
+    def _validated(self) -> bool:
+        """
+        True if there is data and the validators of the previous response apply to the current currencies
+        """
+
+        return self.snapshot is not None and self._validated_for is self.currencies
+
+    def request_url(self) -> str:
+        """
+        Get the URL to request the rates of the watched currencies from
+
+        :return: URL
+        """
+
+        return self.address
+
+    def conditional_headers(self) -> Dict:
+        """
+        Create headers for a conditional request based on the validators of the previous response
+
+        :return: Dict holding 'If-None-Match' and/or 'If-Modified-Since' headers, empty if there is no data yet
+        """
+
+        headers = {}
+
+        # Unchanged response is useless if there is nothing to keep
+        if not self._validated:
+            return headers
+
+        if self._etag is not None:
+            headers["If-None-Match"] = self._etag
+
+        if self._last_modified is not None:
+            headers["If-Modified-Since"] = self._last_modified
+
+        return headers
+
+    def process_response(self, status: int, headers, body: bytes) -> bool:
+        """
+        Handle a raw response, decoding and parsing is skipped if the data has not changed since the previous fetch
+
+        :param status: HTTP status code of the response
+        :param headers: Case-insensitive mapping of the response headers
+        :param body: Raw response body
+        :return: True if the response held valid data
+        """
+
+        self.changed = False
+        currencies = self.currencies
+        validated = self._validated
+
+        # Server told that the data has not been modified
+        if status == 304 and validated:
+            self._logger.debug("Data from %s not modified since previous fetch", self.name)
+            self.metrics.success(self.name)
+            return True
+
+        # Server does not support conditional requests or ignored them, compare the content instead
+        body_hash = hashlib.blake2b(body, digest_size=16).digest()
+
+        if body_hash == self._body_hash and validated:
+            self._logger.debug("Response from %s identical to previous fetch", self.name)
+            self._etag = headers.get("ETag")
+            self._last_modified = headers.get("Last-Modified")
+            self.metrics.success(self.name)
+            return True
+
+        started = monotonic()
+
+        try:
+            response = json.loads(body)
+
+        except json.JSONDecodeError:
+            self._logger.error("No suitable response from %s address '%s'", self.name, self.address)
+            self.metrics.error(self.name, "JSONDecodeError")
+            return False
+
+        decoded = monotonic()
+        snapshot = self.parse(response) if isinstance(response, dict) else None
+        self.metrics.stage("decode", decoded - started)
+        self.metrics.stage("parse", monotonic() - decoded)
+
+        if snapshot is None:
+            self._logger.error("%s responded without valid data", self.name)
+            self.metrics.error(self.name, "InvalidData")
+            return False
+
+        # Validators are kept only for accepted data, a 304 must never stand in for a response that was rejected
+        self.snapshot = snapshot
+        self.changed = True
+        self._etag = headers.get("ETag")
+        self._last_modified = headers.get("Last-Modified")
+        self._body_hash = body_hash
+        self._validated_for = currencies
+        self.metrics.success(self.name)
+
+        return True
+
+    def parse(self, response: Dict) -> Optional[MarketSnapshot]:
+        """
+        Parse the decoded response of the source
+
+        :param response: Dict holding the response
+        :return: Parsed data from the response or None if the response was not valid
+        """
+
+        raise NotImplementedError
+
+
+class CoinmotionSource(RateSource):
+    """
+    Class for the coinmotion API, the only source that provides the total market status
+    """
+
+    name = "coinmotion"
+
+    def set_currencies(self, currencies: List[str]) -> None:
+        # Keys are replaced first so that a response parsed for the new currencies never uses the old keys
+        self.currency_keys: List = [f"{currency.lower()}eur" for currency in currencies]
+        super().set_currencies(currencies)
+
+    def parse(self, response: Dict) -> Optional[MarketSnapshot]:
+        """
+        Parse the reponse that is a Dict and return filtered data
+
+        :param response: Dict holding the response
+        :return: Parsed data from the response or None if the response was not valid
+        """
+
+        if not response.get("success"):
+            return None
+
+        rates = {}
+
+        try:
+            filtered_currencies = self._filter_keys(response["payload"].keys())
+
+            for currency in filtered_currencies:
+                currency_data = response["payload"][currency]
+
+                # Buy/Sell must be inverted to get the prespective of the user
+                rates[currency_data["currencyCode"]] = RateSnapshot(
+                    buy=to_float(currency_data["sell"]),
+                    sell=to_float(currency_data["buy"]),
+                    change_percent=to_float(currency_data["fchangep"]),
+                    high=to_float(currency_data["fhigh"])
+                )
+
+            # Total market trend
+            sign = response["payload"]["market"]["changeSign"]
+            market = MarketStatus(
+                change_percent=to_float(response["payload"]["market"]["changeAmount"]),
+                rising=bool(sign) and sign != "-"
+            )
+
+        # If invalid Dict key is somehow used or the payload has an unexpected type -> return None
+        except (KeyError, TypeError, AttributeError):
+            return None
+
+        else:
+            return MarketSnapshot(MappingProxyType(rates), market)
+
+    def _filter_keys(self, keys) -> List:
+        """
+        Filter the the dict keys based on what currencies the user configured to be watched
+
+        :param keys: List of the keys that are to filtered
+        :return: Filtered keys
+        """
+
+        filtered_keys = []
+
+        # Filter out keys that represent currencies that were not configured to be watched
+        for key in keys:
+            if key.lower() in self.currency_keys:
+                filtered_keys.append(key)
+
+        return filtered_keys
+
+
+class KrakenSource(RateSource):
+    """
+    Class for the public ticker API of Kraken, rates are given from the perspective of the market maker
+    """
+
+    name = "kraken"
+
+    # Currency codes that differ from the ones used by Kraken
+    asset_codes: Dict[str, str] = {"BTC": "XBT", "DOGE": "XDG"}
+
+    def request_url(self) -> str:
+        pairs = ",".join(f"{self.asset_codes.get(currency, currency)}EUR" for currency in self.currencies)
+        return f"{self.address}?pair={pairs}"
+
+    def parse(self, response: Dict) -> Optional[MarketSnapshot]:
+        """
+        Parse the ticker response, change percent is calculated from the opening price of the day
+
+        :param response: Dict holding the response
+        :return: Parsed data from the response or None if the response was not valid
+        """
+
+        if response.get("error") or "result" not in response:
+            return None
+
+        result = response["result"]
+        rates = {}
+
+        try:
+            for currency in self.currencies:
+                code = self.asset_codes.get(currency, currency)
+
+                # Older assets are listed with X/Z prefixed codes e.g. 'XXBTZEUR'
+                ticker = result.get(f"{code}EUR") or result.get(f"X{code}ZEUR")
+
+                if ticker is None:
+                    continue
+
+                opening = to_float(ticker["o"])
+                last = to_float(ticker["c"][0])
+
+                # Ask is the price the user buys at and bid the price the user sells at
+                rates[currency] = RateSnapshot(
+                    buy=to_float(ticker["a"][0]),
+                    sell=to_float(ticker["b"][0]),
+                    change_percent=(last - opening) / opening * 100 if opening else math.nan,
+                    high=to_float(ticker["h"][1])
+                )
+
+        # E.g. a missing key or a result that is a list instead of a Dict
+        except (KeyError, IndexError, TypeError, AttributeError):
+            return None
+
+        if not rates:
+            return None
+
+        # Kraken has no total market trend
+        return MarketSnapshot(MappingProxyType(rates), MarketStatus(math.nan, False))
+
+
+# Supported sources by name, order of the configured sources defines their priority when merging
+SOURCES = {source.name: source for source in (CoinmotionSource, KrakenSource)}
+
+
+def merge_snapshots(snapshots: List[Tuple[str, MarketSnapshot]]) -> MarketSnapshot:
+    """
+    Merge the data of several sources into one snapshot holding the lowest buy and the highest sell rate of every
+    currency. Other values and the market status are taken from the first source that has them
+
+    :param snapshots: List of (source name, snapshot) in priority order
+    :return: Merged snapshot
+    """
+
+    if len(snapshots) == 1:
+        name, snapshot = snapshots[0]
+        quotes = {currency: Quote(rate.buy, name, rate.sell, name) for currency, rate in snapshot.rates.items()}
+
+        return snapshot._replace(quotes=MappingProxyType(quotes))
+
+    rates: Dict[str, RateSnapshot] = {}
+    quotes: Dict[str, Quote] = {}
+    market = MarketStatus(math.nan, False)
+
+    for name, snapshot in snapshots:
+        if math.isnan(market.change_percent):
+            market = snapshot.market
+
+        for currency, rate in snapshot.rates.items():
+            if currency not in rates:
+                rates[currency] = rate
+                quotes[currency] = Quote(rate.buy, name, rate.sell, name)
+                continue
+
+            best = quotes[currency]
+
+            # Lowest price to buy at and highest price to sell at, NaN never wins the comparison
+            if rate.buy < best.buy or math.isnan(best.buy):
+                best = best._replace(buy=rate.buy, buy_source=name)
+
+            if rate.sell > best.sell or math.isnan(best.sell):
+                best = best._replace(sell=rate.sell, sell_source=name)
+
+            quotes[currency] = best
+            rates[currency] = rates[currency]._replace(buy=best.buy, sell=best.sell)
+
+    return MarketSnapshot(MappingProxyType(rates), market, MappingProxyType(quotes))
+
+
+def create_sources(args, metrics: FetchMetrics) -> List[RateSource]:
+    """
+    Create the configured rate sources
+
+    :param args: Parsed configuration
+    :param metrics: Metrics the sources record decode and parse timings and results to
+    :return: Sources in priority order
+    """
+
+    addresses = {"coinmotion": args.api_address, "kraken": args.kraken_address}
+
+    # A single deadline is used for every source, otherwise deadlines are given in the order of the sources
+    deadlines = args.source_deadline
+    if len(deadlines) == 1:
+        deadlines = deadlines * len(args.sources)
+
+    return [
+        SOURCES[name](addresses[name], args.currencies, deadline, metrics)
+        for name, deadline in zip(args.sources, deadlines)
+    ]
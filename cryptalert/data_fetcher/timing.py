@@ -0,0 +1,80 @@
+"""
+Transport adapter for requests that measures how long opening connections to the rate sources takes
+
+Emil Rekola <emil.rekola@hotmail.com>
+"""
+
+# STD imports
+from threading import local
+from time import monotonic
+
+# 3rd-party imports
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+# Connections are opened on the thread making the request, so the time is kept per thread
+_timings = local()
+
+
+def reset_connect_time() -> None:
+    """
+    Start measuring the connection time of a new request on the calling thread
+    """
+
+    _timings.connect = 0.0
+
+
+def connect_time() -> float:
+    """
+    Get the time spent opening connections since 'reset_connect_time' on the calling thread
+
+    :return: Seconds spent on name resolution, the TCP handshake and the TLS handshake, 0 if a kept-alive
+        connection was reused
+    """
+
+    return getattr(_timings, "connect", 0.0)
+
+
+def _add_connect_time(seconds: float) -> None:
+    _timings.connect = connect_time() + seconds
+
+
+class _TimedHTTPConnection(HTTPConnection):
+    def connect(self) -> None:
+        started = monotonic()
+
+        try:
+            super().connect()
+
+        finally:
+            _add_connect_time(monotonic() - started)
+
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    def connect(self) -> None:
+        started = monotonic()
+
+        try:
+            super().connect()
+
+        finally:
+            _add_connect_time(monotonic() - started)
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """
+    Class for a HTTP adapter whose connections record the time spent opening them, see 'connect_time'
+    """
+
+    def init_poolmanager(self, *args, **kwargs) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": _TimedHTTPConnectionPool, "https": _TimedHTTPSConnectionPool}
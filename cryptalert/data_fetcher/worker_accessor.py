@@ -0,0 +1,142 @@
+"""
+Data fetcher of a worker process, reads the snapshots of a fetcher process from shared memory instead of fetching
+
+Emil Rekola <emil.rekola@hotmail.com>
+"""
+
+# STD imports
+from argparse import Namespace
+from typing import Iterable, Optional
+
+# Local imports
+from cryptalert.data_fetcher.api_accessor import ApiAccessor
+from cryptalert.data_fetcher.shared_snapshot import SharedSnapshotReader
+
+
+class SharedMemoryAccessor(ApiAccessor):
+    """
+    Class for following the snapshots of a fetcher process. New snapshots are published on the local bus and added
+    to the local history and indicators, so the Discord bot and the TUI run on a worker exactly as they run next to
+    a fetcher. Fetch metrics are kept by the fetcher process only
+    """
+
+    # Seconds between the checks of the shared memory segment
+    poll_interval: float = 0.25
+
+    def __init__(self, args, stop_flag):
+
+        # History file is written only by the fetcher process
+        super().__init__(Namespace(**{**vars(args), "history_file": None}), stop_flag)
+
+        self.segment_name: str = args.shared_memory
+        self._reader: Optional[SharedSnapshotReader] = None
+
+        # Version and succesful fetches of the fetcher process seen by this worker
+        self._shared_version: int = 0
+        self._shared_fetches: int = 0
+
+        # Nothing is fetched over HTTP
+        self._session.close()
+
+    def watch_currencies(self, currencies: Iterable[str]) -> None:
+        """
+        Currencies are fetched by the fetcher process, currencies missing from its snapshots are only reported
+
+        :param currencies: Currency codes e.g. 'BTC'
+        """
+
+        api_data = self.api_data
+        missing = {currency.upper() for currency in currencies} - set(api_data.rates if api_data is not None else ())
+
+        if missing:
+            self._logger.warning("Currencies not fetched by the fetcher process: %s", ", ".join(sorted(missing)))
+
+    def _attach(self) -> bool:
+        """
+        Attach to the segment of the fetcher process, also after the fetcher has been restarted
+
+        :return: True if attached
+        """
+
+        if self._reader is not None and self._reader.attached:
+            return True
+
+        if self._reader is not None:
+            self._logger.warning("Fetcher process closed shared memory segment '%s'", self.segment_name)
+            self._reader.close()
+            self._reader = None
+
+        try:
+            self._reader = SharedSnapshotReader(self.segment_name)
+
+        except FileNotFoundError:
+            return False
+
+        self._logger.info("Attached to shared memory segment '%s'", self.segment_name)
+        self._shared_version = 0
+        self._shared_fetches = 0
+
+        return True
+
+    def fetch_data(self) -> bool:
+        """
+        Take the latest state of the fetcher process from shared memory
+
+        :return: True if the fetcher has data
+        """
+
+        if not self._attach():
+            return False
+
+        result = self._reader.read(self._shared_version)
+
+        if result is None:
+            return self.api_data is not None
+
+        header, data = result
+
+        if data is not None:
+            self.bus.publish(header.timestamp, data)
+            self._shared_version = header.version
+
+        # Samples are added once per succesful fetch seen, fetches done between two polls are not replayed
+        if header.successful_fetches != self._shared_fetches and self.api_data is not None:
+            self._shared_fetches = header.successful_fetches
+            self._mark_fetched()
+
+        self.consecutive_failures = header.consecutive_failures
+        self.failed_fetches = header.failed_fetches
+
+        return self.api_data is not None
+
+    def start(self) -> None:
+        """
+        Poll the shared memory segment until stop flag is set
+        """
+
+        self._logger.info("Following snapshots of shared memory segment '%s'", self.segment_name)
+
+        try:
+            deadline = self._startup_deadline()
+
+            # Worker may be started before the fetcher process
+            while (not self._stop_flag.is_set() and not self.fetch_data()
+                   and not self._startup_deadline_passed(deadline)):
+                self._stop_flag.wait(self.poll_interval)
+
+            self.data_ready.set()
+
+            while not self._stop_flag.is_set():
+                self.fetch_data()
+                self._stop_flag.wait(self.poll_interval)
+
+        finally:
+            self._executor.shutdown(wait=False)
+
+            if self._reader is not None:
+                self._reader.close()
+
+            self.data_ready.set()
+            self.stopped.set()
+
+        self._logger.info("Shared memory polling stopped")
@@ -5,30 +5,42 @@ Emil Rekola <emil.rekola@hotmail.com>
 """
 
 # STD imports
+import asyncio
 import logging
 import datetime
+from typing import List, Optional
 
 # 3rd-party imports
+import discord
 from configargparse import Namespace
 from discord.ext import commands
 from discord.ext.commands import ExtensionNotFound, ExtensionFailed, NoEntryPointError
 
 # Local imports
 from cryptalert.data_fetcher.api_accessor import ApiAccessor
+from cryptalert.discord_bot.delivery import ShardedDelivery
+from cryptalert.discord_bot.job_scheduler import JobScheduler
+from cryptalert.discord_bot.schedule import Schedule
+from cryptalert.exceptions import UndeliverableMessageException
 
 
-class CryptalertBot(commands.Bot):
+class CryptalertBot(commands.AutoShardedBot):
     """
-    Class with functionality and actions of the discord bot
+    Class with functionality and actions of the discord bot. Guilds are split to shards, by default Discord
+    recommends the shard count and every shard runs in this process, a small bot runs on a single shard
     """
 
     extensions = [
         "crypto",
+        "alerts",
         "utils"
     ]
 
+    # Seconds queued messages, e.g. the logout message, are given to be sent when the bot is closed
+    drain_timeout: float = 2.0
+
     def __init__(self, args: Namespace, api_accessor: ApiAccessor):
-        super().__init__(command_prefix=args.prefix)
+        super().__init__(command_prefix=args.prefix, shard_count=args.shard_count, shard_ids=args.shard_ids)
 
         self._main_channel_id: int = args.info_channel_id
         self.main_channel = None
@@ -37,11 +49,31 @@ class CryptalertBot(commands.Bot):
         self.logger = logging.getLogger("discord.bot")
         self.startup_time: datetime = datetime.datetime.now()
 
+        # Messages are sent through the queue of their shard so that fan-out to many channels stays within the rate
+        # limits and every shard sends only to its own guilds
+        self.delivery: ShardedDelivery = ShardedDelivery(
+            self._send_delivery, args.channel_send_rate, args.global_send_rate, args.send_attempts
+        )
+        self._delivery_task: Optional[asyncio.Task] = None
+
+        # Periodic updates of every channel are run by one scheduler task
+        self.jobs: JobScheduler = JobScheduler()
+        self.update_schedule: Schedule = Schedule(args.update_interval, args.quiet_hours, args.timezone)
+        self._jobs_task: Optional[asyncio.Task] = None
+
     async def on_ready(self):
         """
         Executed when the bot has been initialized and connection has been made to discord
         """
 
+        # Event is received again after reconnecting, the queue, the scheduler and the extensions are started only once
+        if self._delivery_task is not None:
+            self.logger.info("%s reconnected", self.bot_name)
+            return
+
+        self._delivery_task = self.loop.create_task(self.delivery.run())
+        self._jobs_task = self.loop.create_task(self.jobs.run())
+
         # Try to load extension, exit it there is a problem
         try:
             self.load_extensions()
@@ -59,8 +91,49 @@ class CryptalertBot(commands.Bot):
             # If info channel was defined
             if self._main_channel_id is not None:
                 self.main_channel = self.get_channel(self._main_channel_id)
-                self.logger.debug("Sending login message")
-                await self.main_channel.send(f"{self.bot_name} is online!")
+
+                # Guild of the info channel might be on a shard run by another process
+                if self.main_channel is None:
+                    self.logger.warning("Info channel %s is not visible to shards %s", self._main_channel_id,
+                                        sorted(self.shards))
+
+                else:
+                    self.logger.debug("Sending login message")
+                    self.delivery.enqueue(self.main_channel, f"{self.bot_name} is online!")
+
+    async def on_shard_ready(self, shard_id: int):
+        """
+        Executed when a shard has connected to discord
+
+        :param shard_id: ID of the shard
+        """
+
+        guilds = sum(1 for guild in self.guilds if guild.shard_id == shard_id)
+        self.logger.info("Shard %d/%d is ready with %d guilds", shard_id, self.shard_count, guilds)
+
+    async def _send_delivery(self, channel, payloads: List) -> None:
+        """
+        Send the payloads of a delivery, called by the delivery queue
+
+        :param channel: Channel to send to
+        :param payloads: Messages or embeds, more than one payload are alerts that are combined into one embed
+        """
+
+        try:
+            if len(payloads) > 1:
+                await channel.send(embed=discord.Embed(
+                    title="Alerts", description="\n".join(payloads), color=discord.Color.magenta()
+                ))
+
+            elif isinstance(payloads[0], discord.Embed):
+                await channel.send(embed=payloads[0])
+
+            else:
+                await channel.send(payloads[0])
+
+        # Retrying does not help if the bot can't see or send to the channel
+        except (discord.Forbidden, discord.NotFound) as error:
+            raise UndeliverableMessageException(f"Can't send to the channel: {error}") from error
 
     def load_extensions(self) -> None:
         """
@@ -82,9 +155,18 @@ class CryptalertBot(commands.Bot):
 
             self.logger.info("Shutting down")
 
-            if self._main_channel_id is not None:
+            if self.main_channel is not None:
                 self.logger.info("Sending logout message")
-                await self.main_channel.send(f"{self.bot_name} is going offline!")
+                self.delivery.enqueue(self.main_channel, f"{self.bot_name} is going offline!")
+
+        if self._jobs_task is not None:
+            self._jobs_task.cancel()
+
+        if self._delivery_task is not None:
+            if not await self.delivery.drain(self.drain_timeout):
+                self.logger.error("%d queued messages were not sent before closing", self.delivery.depth)
+
+            self._delivery_task.cancel()
 
         # Execute the original "close" function
         await super().close()
@@ -0,0 +1,152 @@
+"""
+Alert related bot functionality
+
+Emil Rekola <emil.rekola@hotmail.com>
+"""
+
+# STD imports
+import asyncio
+
+# 3rd-party imports
+from discord.ext import commands, tasks
+
+# Local imports
+from cryptalert.alerts.rule_engine import AlertEngine, RULE_FIELDS
+from cryptalert.config import SUPPORTED_CURRENCIES
+from cryptalert.discord_bot.cogs.bot_mixin import BotMixin
+
+
+class Alerts(BotMixin, commands.Cog):
+    """
+    Bot actions
+    """
+
+    def __init__(self, bot):
+        super().__init__(bot)
+
+        self.engine: AlertEngine = AlertEngine(bot.api_accessor.history)
+
+        # Rules are evaluated once for every published snapshot
+        self._snapshots: asyncio.Queue = asyncio.Queue(maxsize=1)
+        self._subscription = bot.api_accessor.bus.subscribe_async(bot.loop, self._snapshots)
+
+        self.check_alerts.start()
+
+    def cog_unload(self):
+        self.bot.api_accessor.bus.unsubscribe(self._subscription)
+        self.check_alerts.cancel()
+
+    @staticmethod
+    def _parse_currency(currency: str) -> str:
+        """
+        Check that alerts can be given for the currency
+
+        :param currency: Currency code given by the user
+        :return: Upper case currency code
+        """
+
+        if currency.lower() not in SUPPORTED_CURRENCIES:
+            raise commands.BadArgument(f"Unknown currency '{currency}', use one of: {', '.join(SUPPORTED_CURRENCIES)}")
+
+        return currency.upper()
+
+    @staticmethod
+    def _parse_field(field: str) -> str:
+        """
+        Match the given field name case-insensitively to a field that rules can watch
+
+        :param field: Field name given by the user
+        :return: Field name used in the data
+        """
+
+        for rule_field in RULE_FIELDS:
+            if rule_field.lower() == field.lower():
+                return rule_field
+
+        raise commands.BadArgument(f"Unknown field '{field}', use one of: {', '.join(RULE_FIELDS)}")
+
+    @commands.command()
+    async def alert(self, ctx, currency: str, field: str, operator: str, threshold: float):
+        """
+        Alert when a value crosses a threshold e.g. '!alert btc buy < 30000'
+        """
+
+        if operator not in ("<", ">"):
+            raise commands.BadArgument("Operator must be '<' or '>'")
+
+        rule = self.engine.add_threshold_rule(
+            ctx.channel.id, self._parse_currency(currency), self._parse_field(field), operator == ">", threshold
+        )
+
+        self.reply(ctx, f"Added alert {rule.describe()}")
+
+    @commands.command()
+    async def moveAlert(self, ctx, currency: str, field: str, percent: float, minutes: float):
+        """
+        Alert when a value moves more than given percents in given minutes e.g. '!moveAlert eth changePercent 5 30'
+        """
+
+        rule = self.engine.add_change_rule(
+            ctx.channel.id, self._parse_currency(currency), self._parse_field(field), abs(percent), minutes
+        )
+
+        self.reply(ctx, f"Added alert {rule.describe()}")
+
+    @commands.command()
+    async def alerts(self, ctx):
+        """
+        List alerts of this channel
+        """
+
+        rules = self.engine.rules_for_channel(ctx.channel.id)
+
+        if not rules:
+            self.reply(ctx, "No alerts on this channel")
+
+        else:
+            self.reply(ctx, "Alerts on this channel:\n" + "\n".join(rule.describe() for rule in rules))
+
+    @commands.command()
+    async def removeAlert(self, ctx, rule_id: int):
+        """
+        Remove an alert of this channel by its ID
+        """
+
+        rule = self.engine.remove_rule(rule_id, ctx.channel.id)
+
+        if rule is None:
+            self.reply(ctx, f"No alert with ID {rule_id} on this channel")
+
+        else:
+            self.reply(ctx, f"Removed alert {rule.describe()}")
+
+    @tasks.loop(seconds=0)
+    async def check_alerts(self):
+        """
+        Wait for a new snapshot, evaluate alert rules against it and send the triggered alerts
+        """
+
+        snapshot = await self._snapshots.get()
+
+        # Delivery queue combines the alerts waiting for the same channel into one message
+        for alert in self.engine.evaluate(snapshot.timestamp, snapshot.data):
+            channel = self.bot.get_channel(alert.rule.channel_id)
+
+            if channel is not None:
+                self.bot.delivery.enqueue(channel, alert.message(), coalesce=True)
+
+    @check_alerts.before_loop
+    async def before_check_alerts(self):
+        """
+        Wait until bot is ready to start the looping task
+        """
+
+        await self.bot.wait_until_ready()
+
+
+def setup(bot):
+    """
+    Entry point for the 'commands.Bot.load_extension' function for loading extensions
+    """
+
+    bot.add_cog(Alerts(bot))
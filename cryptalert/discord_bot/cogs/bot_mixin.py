@@ -15,3 +15,13 @@ class BotMixin:
 
     def __init__(self, bot: CryptalertBot):
         self.bot = bot
+
+    def reply(self, ctx, payload) -> None:
+        """
+        Queue a message or an embed to be sent to the channel the command was invoked on
+
+        :param ctx: Context of the command
+        :param payload: Message or 'discord.Embed'
+        """
+
+        self.bot.delivery.enqueue(ctx.channel, payload)
@@ -6,30 +6,65 @@ Emil Rekola <emil.rekola@hotmail.com>
 
 # STD imports
 import json
-import datetime
-from asyncio import sleep
+from argparse import ArgumentTypeError
+from time import monotonic, time
+from typing import Any, Callable, FrozenSet, Hashable, Iterable, Optional, Set
+from asyncio import Queue
 
 # 3rd-party imports
 import discord
 from discord.ext import commands, tasks
 
 # Local imports
+from cryptalert.config import SUPPORTED_CURRENCIES
+from cryptalert.data_fetcher.rates import MarketSnapshot
 from cryptalert.discord_bot.cogs.bot_mixin import BotMixin
+from cryptalert.discord_bot.render_cache import RenderCache
+from cryptalert.discord_bot.schedule import Schedule
+from cryptalert.discord_bot.subscriptions import Subscription, SubscriptionStore
+from cryptalert.quiet_hours import parse_quiet_hours, parse_timezone
 
 
 class Crypto(BotMixin, commands.Cog):
     """
     Bot actions
     """
-    
+
+    # Seconds back in the rate history to compare against when checking if market is going up or down
+    trend_window: float = 600.0
+
+    # Minutes between the watchlist updates of a channel by default and at least
+    default_interval: float = 10.0
+    min_interval: float = 1.0
+
     def __init__(self, bot):
         super().__init__(bot)
 
-        # Used for checking if market is going up or down
-        self.prev_total_change = None
+        # Identical commands between two fetches are answered with the same render
+        self.renders: RenderCache = RenderCache()
+
+        # Watchlists of the channels, updates are fanned out once for every published snapshot
+        self.subscriptions: SubscriptionStore = SubscriptionStore()
+        self._previous: Optional[MarketSnapshot] = None
+        self._snapshots: Queue = Queue(maxsize=1)
+        self._subscription = bot.api_accessor.bus.subscribe_async(bot.loop, self._snapshots)
+
+        # Channels that have their own update schedule
+        self._scheduled_channels: Set[int] = set()
+
+        # Status updates of the info channel, the channel is resolved when the bot is ready
+        self.bot.jobs.schedule("info", self.bot.update_schedule, self._post_info_update)
 
         # Start task on init
-        self.periodic_update.start()
+        self.fan_out.start()
+
+    def cog_unload(self):
+        self.bot.api_accessor.bus.unsubscribe(self._subscription)
+        self.bot.jobs.cancel("info")
+        self.fan_out.cancel()
+
+        for channel_id in self._scheduled_channels:
+            self.bot.jobs.cancel(("channel", channel_id))
 
     @commands.command()
     async def rates(self, ctx):
@@ -37,7 +72,7 @@ class Crypto(BotMixin, commands.Cog):
         Get current rates for configured crypto currencies
         """
 
-        await ctx.send(f"Current rates:\n{json.dumps(self.bot.api_accessor.api_data, indent=4, ensure_ascii=False)}")
+        self.reply(ctx, self._render("rates", self.get_rates_message))
 
     @commands.command(aliases=["marketStatus", "status"])
     async def market(self, ctx):
@@ -45,7 +80,24 @@ class Crypto(BotMixin, commands.Cog):
         Get current market status
         """
 
-        await ctx.send(self.get_market_status())
+        self.reply(ctx, self._render("market", self.get_market_status))
+
+    @commands.command(aliases=["rateAt"])
+    async def ago(self, ctx, currency: str, hours: float = 24.0):
+        """
+        Get the buy and sell rates of a currency from given hours ago e.g. '!ago btc 24'
+        """
+
+        currency = currency.upper()
+        timestamp = time() - hours * 3600
+        buy = self.bot.api_accessor.rate_at(currency, "buy", timestamp)
+        sell = self.bot.api_accessor.rate_at(currency, "sell", timestamp)
+
+        if buy is None:
+            self.reply(ctx, f"No history of {currency} from {hours} hours ago")
+
+        else:
+            self.reply(ctx, f"{currency} {hours} hours ago:\nBuy: {buy}  Sell: {sell}")
 
     @commands.command(aliases=["statusUpdate"])
     async def update(self, ctx):
@@ -53,35 +105,260 @@ class Crypto(BotMixin, commands.Cog):
         Get brief update on crypto market and rates
         """
 
-        await ctx.send(embed=self.get_update_embed("Current market status!"))
+        self.reply(ctx, self._render("update", lambda: self.get_update_embed("Current market status!")))
+
+    @staticmethod
+    def _parse_currencies(currencies: Iterable[str]) -> FrozenSet[str]:
+        """
+        Check that the given currencies can be watched
+
+        :param currencies: Currency codes given by the user
+        :return: Upper case currency codes
+        """
+
+        parsed = frozenset(currency.upper() for currency in currencies)
+        unknown = sorted(currency for currency in parsed if currency.lower() not in SUPPORTED_CURRENCIES)
+
+        if not parsed:
+            raise commands.BadArgument("Give atleast one currency")
+
+        if unknown:
+            raise commands.BadArgument(f"Unknown currencies {', '.join(unknown)}, use any of: "
+                                       f"{', '.join(SUPPORTED_CURRENCIES)}")
+
+        return parsed
+
+    def _subscribe(self, ctx, currencies: FrozenSet[str], interval: Optional[float] = None) -> Optional[Subscription]:
+        """
+        Replace the watchlist and optionally the interval of the channel of the command, the fetched currencies are
+        updated to the union of all watchlists
+
+        :param ctx: Context of the command
+        :param currencies: New watchlist, the subscription is removed if empty
+        :param interval: Minutes between updates, kept as is if not given
+        :return: New subscription or None if it was removed
+        """
+
+        previous = self.subscriptions.get(ctx.channel.id)
+
+        if interval is None:
+            interval = previous.interval if previous is not None else self.default_interval
+
+        guild_id = ctx.guild.id if ctx.guild is not None else None
+        subscription = Subscription(ctx.channel.id, guild_id, currencies, interval)
+        self.subscriptions.set(subscription)
+        self.bot.api_accessor.watch_currencies(self.subscriptions.currencies())
+
+        return self.subscriptions.get(ctx.channel.id)
+
+    @commands.command()
+    async def watch(self, ctx, *currencies: str):
+        """
+        Add currencies to the watchlist of this channel, updates are posted when they change e.g. '!watch btc eth'
+        """
+
+        previous = self.subscriptions.get(ctx.channel.id)
+        watched = previous.currencies if previous is not None else frozenset()
+        subscription = self._subscribe(ctx, watched | self._parse_currencies(currencies))
+
+        self.reply(ctx, f"Watching {subscription.describe()}")
 
-    @tasks.loop(minutes=10.0)
-    async def periodic_update(self):
+    @commands.command()
+    async def unwatch(self, ctx, *currencies: str):
         """
-        Run task every 10min during daytime (7-23) that gives updates on the crypto currencies
+        Remove currencies from the watchlist of this channel, all of them if none are given e.g. '!unwatch eth'
         """
 
-        # Get current time
-        now = datetime.datetime.now()
+        previous = self.subscriptions.get(ctx.channel.id)
+
+        if previous is None:
+            self.reply(ctx, "This channel is not watching any currencies")
+            return
 
-        # If time is between 23-07 -> mute periodic updates
-        if 7 <= now.hour < 23:
-            await self.bot.main_channel.send(embed=self.get_update_embed())
+        removed = self._parse_currencies(currencies) if currencies else previous.currencies
+        subscription = self._subscribe(ctx, previous.currencies - removed)
+
+        if subscription is None:
+            self.reply(ctx, "Stopped watching currencies on this channel")
 
-        # Sleep longer when it is hush hush times
         else:
+            self.reply(ctx, f"Watching {subscription.describe()}")
+
+    @commands.command()
+    async def cadence(self, ctx, minutes: float):
+        """
+        Set the minimum minutes between the watchlist updates of this channel e.g. '!cadence 30'
+        """
+
+        previous = self.subscriptions.get(ctx.channel.id)
+
+        if previous is None:
+            self.reply(ctx, "This channel is not watching any currencies, add some with 'watch'")
+            return
+
+        subscription = self._subscribe(ctx, previous.currencies, max(self.min_interval, minutes))
+        self.reply(ctx, f"Watching {subscription.describe()}")
 
-            # Sleep for 1 hour
-            await sleep(3600)
+    @commands.command()
+    async def watchlist(self, ctx):
+        """
+        Show the watchlist of this channel
+        """
+
+        subscription = self.subscriptions.get(ctx.channel.id)
+
+        if subscription is None:
+            self.reply(ctx, "This channel is not watching any currencies")
+
+        else:
+            self.reply(ctx, f"Watching {subscription.describe()}")
+
+    @commands.command()
+    @commands.guild_only()
+    async def watchlists(self, ctx):
+        """
+        Show the watchlists of every channel of this server
+        """
+
+        subscriptions = self.subscriptions.for_guild(ctx.guild.id)
+
+        if not subscriptions:
+            self.reply(ctx, "No channel on this server is watching currencies")
+
+        else:
+            self.reply(ctx, "Watchlists:\n" + "\n".join(subscription.describe() for subscription in subscriptions))
 
-    @periodic_update.before_loop
-    async def before_periodic_update(self):
+    @tasks.loop(seconds=0)
+    async def fan_out(self):
+        """
+        Wait for a new snapshot and post an update to the channels watching the currencies that changed
+        """
+
+        snapshot = await self._snapshots.get()
+        data, previous = snapshot.data, self._previous
+        self._previous = data
+
+        changed = [
+            currency for currency, rate in data.rates.items()
+            if previous is None or previous.rates.get(currency) != rate
+        ]
+
+        for subscription in self.subscriptions.due(changed, monotonic()):
+            channel = self.bot.get_channel(subscription.channel_id)
+
+            if channel is not None:
+                embed = self._render(("watchlist", subscription.currencies),
+                                     lambda: self.get_update_embed("Watchlist update!", subscription.currencies))
+                self.bot.delivery.enqueue(channel, embed)
+
+    @fan_out.before_loop
+    async def before_fan_out(self):
         """
         Wait until bot is ready to start the looping task
         """
-        self.bot.logger.info("Waiting for bot to be ready before starting task")
+
         await self.bot.wait_until_ready()
-        self.bot.logger.info("Bot ready -> starting task")
+
+    @commands.command()
+    async def schedule(self, ctx, minutes: float = None, quiet_hours: str = "none", timezone: str = None):
+        """
+        Post status updates to this channel every given minutes, optionally outside quiet hours in a time zone
+        e.g. '!schedule 30 23-7 Europe/Helsinki'. Shows the schedule of this channel if no minutes are given
+        """
+
+        if minutes is None:
+            scheduled = self.bot.jobs.get(("channel", ctx.channel.id))
+
+            if scheduled is None:
+                self.reply(ctx, "No status updates are scheduled on this channel")
+
+            else:
+                schedule, due = scheduled
+                self.reply(ctx, f"Status updates {schedule.describe()}, next at {schedule.format_time(due)}")
+
+            return
+
+        try:
+            schedule = Schedule(
+                max(self.min_interval, minutes),
+                parse_quiet_hours(quiet_hours),
+                parse_timezone(timezone) if timezone is not None else self.bot.update_schedule.timezone
+            )
+
+        except ArgumentTypeError as error:
+            raise commands.BadArgument(str(error))
+
+        channel = ctx.channel
+        due = self.bot.jobs.schedule(("channel", channel.id), schedule, lambda: self._post_update(channel))
+        self._scheduled_channels.add(channel.id)
+
+        self.reply(ctx, f"Status updates {schedule.describe()}, first at {schedule.format_time(due)}")
+
+    @commands.command()
+    async def unschedule(self, ctx):
+        """
+        Stop posting scheduled status updates to this channel
+        """
+
+        self._scheduled_channels.discard(ctx.channel.id)
+
+        if self.bot.jobs.cancel(("channel", ctx.channel.id)) is None:
+            self.reply(ctx, "No status updates are scheduled on this channel")
+
+        else:
+            self.reply(ctx, "Stopped status updates on this channel")
+
+    def _post_info_update(self) -> None:
+        """
+        Post a status update to the info channel, run by the scheduler
+        """
+
+        if self.bot.main_channel is not None:
+            self._post_update(self.bot.main_channel)
+
+    def _post_update(self, channel) -> None:
+        """
+        Post a status update to a channel once the first batch of data has been fetched
+
+        :param channel: Channel to post to
+        """
+
+        if self.bot.api_accessor.data_ready.is_set():
+            self.bot.delivery.enqueue(channel, self._render("periodic_update", self.get_update_embed))
+
+    def _render(self, name: Hashable, render: Callable[[], Any]) -> Any:
+        """
+        Get a message or an embed rendered from the current data, rendered again only after the data has changed
+
+        :param name: Name of the render
+        :param render: Function creating the render
+        :return: Message or embed, the same object is returned until the data changes
+        """
+
+        api_accessor = self.bot.api_accessor
+
+        # Messages shown without data tell the number of failed fetches
+        return self.renders.get((api_accessor.data_key, api_accessor.consecutive_failures), name, render)
+
+    def get_rates_message(self) -> str:
+        """
+        Create a message holding the current rates and the market status as JSON
+
+        :return: Rates message
+        """
+
+        api_data = self.bot.api_accessor.api_data
+        rates = {}
+
+        # Snapshot types are converted to plain dicts, currencies fetched only for watchlists are left out
+        if api_data is not None:
+            rates = {
+                currency: rate._asdict() for currency, rate in api_data.rates.items()
+                if currency in self.bot.api_accessor.currencies
+            }
+            rates["market"] = api_data.market._asdict()
+
+        return f"Current rates:\n{json.dumps(rates, indent=4, ensure_ascii=False)}"
 
     def get_market_status(self) -> str:
         """
@@ -90,26 +367,41 @@ class Crypto(BotMixin, commands.Cog):
         :return: Market status as string
         """
 
-        status = self.bot.api_accessor.api_data["market"]
-        change = round(status['changePercent'], 3)
+        api_data = self.bot.api_accessor.api_data
+
+        # Startup deadline passed without any data being fetched
+        if not api_data:
+            return f"No market data available, {self.bot.api_accessor.consecutive_failures} failed fetches in a row!"
+
+        status = api_data.market
+        change = round(status.change_percent, 3)
+
+        # Signed market change from the rate history, from now and from the start of the trend window
+        history = self.bot.api_accessor.history.get("market")
+        current_change = prev_change = None
+
+        # Snapshot is published before its sample is added to the history, e.g. during the first fetch
+        if history is not None:
+            current_change = history.latest("changePercent")
+            prev_change = history.value_at("changePercent", time() - self.trend_window)
 
         msg_start = "Current market is"
         msg_end = "Current change is"
 
         # Market in total is positive
-        if status["sign"]:
+        if status.rising:
             same_or_no_prev_data = f"{msg_start} positive!\n{msg_end} {change}%!"
 
             # No previous rates recorded
-            if self.prev_total_change is None:
+            if prev_change is None:
                 msg = same_or_no_prev_data
 
             # Rates are going down
-            elif change < self.prev_total_change:
+            elif current_change < prev_change:
                 msg = f"{msg_start} positive, but dropping!\n{msg_end} {change}%!"
 
             # Rates are going up
-            elif change > self.prev_total_change:
+            elif current_change > prev_change:
                 msg = f"{msg_start} positive and rising!\n{msg_end} {change}%!"
 
             # Rates are the same as previously so practically no change
@@ -121,45 +413,56 @@ class Crypto(BotMixin, commands.Cog):
             same_or_no_prev_data = f"{msg_start} negative!\n{msg_end} {change}%!"
 
             # No previous rates recorded
-            if self.prev_total_change is None:
+            if prev_change is None:
                 msg = same_or_no_prev_data
 
             # Rates are going down
-            elif change < self.prev_total_change:
+            elif current_change < prev_change:
                 msg = f"{msg_start} negative and dropping!\n{msg_end} {change}%!"
 
             # Rates are going up
-            elif change > self.prev_total_change:
+            elif current_change > prev_change:
                 msg = f"{msg_start} negative, but rising!\n{msg_end} {change}%!"
 
             # Rates are the same as previously so practically no change
             else:
                 msg = same_or_no_prev_data
 
-        self.prev_total_change = change
-
         return msg
 
-    def get_update_embed(self, title="Status update!") -> discord.Embed:
+    def get_update_embed(self, title="Status update!", currencies: Iterable[str] = None) -> discord.Embed:
         """
         Create a Discord Embed message and return it with added content
 
         :param title: Title of the Embed message, default: 'Status update!'
+        :param currencies: Currencies to add fields for, default: the configured currencies
         :return: Discord Embed message
         """
 
+        currencies = self.bot.api_accessor.currencies if currencies is None else currencies
+
         embed_msg = discord.Embed(
             title=title,
             description=self.get_market_status(),
             color=discord.Color.magenta()
         )
 
-        currencies = [curr for curr in self.bot.api_accessor.api_data if curr != "market"]
+        # Same snapshot is used for every field even if new data is published meanwhile
+        api_data = self.bot.api_accessor.api_data
+        rates = api_data.rates if api_data is not None else {}
 
         # Add buy, sell and change percent fields to the Embed message
-        for currency in currencies:
-            data = self.bot.api_accessor.api_data[currency]
-            vals = f"Buy: {data['buy']}  Sell: {data['sell']}  %: {data['changePercent']}"
+        for currency, rate in rates.items():
+            if currency not in currencies:
+                continue
+
+            vals = f"Buy: {rate.buy}  Sell: {rate.sell}  %: {rate.change_percent}"
+
+            # Rolling indicators of the buy price for every configured window
+            for window, ind in self.bot.api_accessor.indicators.get(currency).items():
+                vals += (f"\n{window} samples: SMA {ind.sma:.2f}  EMA {ind.ema:.2f}  σ {ind.std:.2f}  "
+                         f"Min {ind.minimum:.2f}  Max {ind.maximum:.2f}")
+
             embed_msg.add_field(
                 name=currency,
                 value=vals,
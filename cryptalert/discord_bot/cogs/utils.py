@@ -6,6 +6,7 @@ Emil Rekola <emil.rekola@hotmail.com>
 
 # STD imports
 import datetime
+from collections import Counter
 
 # 3rd-party imports
 from discord.ext import commands
@@ -26,7 +27,7 @@ class Utilities(BotMixin, commands.Cog):
         Ping Pong!!!
         """
 
-        await ctx.send("Pong!")
+        self.reply(ctx, "Pong!")
 
     @commands.command()
     async def version(self, ctx):
@@ -34,7 +35,7 @@ class Utilities(BotMixin, commands.Cog):
         Display bot version
         """
 
-        await ctx.send(f"Bot version: {VERSION}")
+        self.reply(ctx, f"Bot version: {VERSION}")
 
     @commands.command()
     async def uptime(self, ctx):
@@ -51,15 +52,49 @@ class Utilities(BotMixin, commands.Cog):
         secs = int(time_delta.seconds % 60)
 
         uptime = f"Bot uptime: {time_delta.days} days {hours} hours {mins} minutes {secs} seconds"
-        await ctx.send(uptime)
+        self.reply(ctx, uptime)
 
     @commands.command()
     async def lastFetch(self, ctx):
         """
-        Display last time the ApiAccessor fetched data
+        Display last time the ApiAccessor fetched data, the poll rate, fetch latencies and the delivery queue
         """
 
-        await ctx.send(f"Last succesful fetch: {self.bot.api_accessor.last_succcesful_fetch}")
+        api_accessor = self.bot.api_accessor
+        poll = api_accessor.scheduler.metrics()
+        msg = (f"Last succesful fetch: {api_accessor.last_succcesful_fetch}\n"
+               f"Poll interval: {poll.interval:.1f}s  Polls per hour: {poll.polls_per_hour:.0f}  "
+               f"Shortened: {poll.shortened}  Lengthened: {poll.lengthened}  Throttled: {poll.throttled}")
+
+        if api_accessor.degraded:
+            msg += f"\nData fetching degraded: {api_accessor.consecutive_failures} failed fetches in a row"
+
+        metrics = api_accessor.metrics.describe()
+        if metrics:
+            msg += f"\n{metrics}"
+
+        msg += f"\n{self.bot.delivery.metrics().describe()}"
+
+        self.reply(ctx, msg)
+
+    @commands.command()
+    async def shards(self, ctx):
+        """
+        Display the gateway latency, guilds and delivery queue of every shard run by this bot
+        """
+
+        latencies = dict(self.bot.latencies)
+        guilds = Counter(guild.shard_id for guild in self.bot.guilds)
+        queues = self.bot.delivery.shard_metrics()
+
+        lines = [f"Shards: {len(latencies)}/{self.bot.shard_count}"]
+        for shard_id in sorted(latencies):
+            lines.append(f"Shard {shard_id}: latency {latencies[shard_id] * 1000:.0f} ms  Guilds: {guilds[shard_id]}")
+
+            if shard_id in queues:
+                lines.append(f"  {queues[shard_id].describe()}")
+
+        self.reply(ctx, "\n".join(lines))
 
 
 def setup(bot):
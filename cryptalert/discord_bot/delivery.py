@@ -0,0 +1,475 @@
+"""
+Outbound message queues of the Discord bot, one per shard. Limit the send rate per channel and globally, combine
+queued alerts of a channel into one message and retry failed sends
+
+Emil Rekola <emil.rekola@hotmail.com>
+"""
+
+# STD imports
+import asyncio
+import logging
+from collections import deque
+from time import monotonic
+from typing import Any, Awaitable, Callable, Deque, Dict, List, NamedTuple, Optional, Tuple
+
+# Local imports
+from cryptalert.data_fetcher.backoff import Backoff
+from cryptalert.data_fetcher.metrics import HdrHistogram
+from cryptalert.exceptions import UndeliverableMessageException
+
+# Coroutine that sends the payloads of a delivery to a channel, raising makes the delivery to be retried unless the
+# exception is 'UndeliverableMessageException'
+SendFunction = Callable[[Any, List[Any]], Awaitable[None]]
+
+
+class TokenBucket:
+    """
+    Class for a token bucket that allows bursts up to its capacity and refills at a constant rate
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate: float = rate
+        self.capacity: float = capacity
+        self._tokens: float = capacity
+        self._refilled: float = monotonic()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+
+    def wait_time(self, now: float) -> float:
+        """
+        Get the time until a token is available
+
+        :param now: Monotonic time
+        :return: Seconds to wait, 0 if a token is available now
+        """
+
+        self._refill(now)
+        return max(0.0, (1 - self._tokens) / self.rate)
+
+    def take(self, now: float) -> None:
+        """
+        Use a token, 'wait_time' must be checked first
+
+        :param now: Monotonic time
+        """
+
+        self._refill(now)
+        self._tokens -= 1
+
+    def full(self, now: float) -> bool:
+        """
+        Check if the bucket has refilled to its capacity, a full bucket behaves like a new one
+
+        :param now: Monotonic time
+        :return: True if the bucket is full
+        """
+
+        self._refill(now)
+        return self._tokens >= self.capacity
+
+
+class DeliveryMetrics(NamedTuple):
+    """
+    Statistics of the delivery queue, latencies are from queueing the first payload until it was sent
+    """
+
+    depth: int
+    sent: int
+    coalesced: int
+    retried: int
+    dropped: int
+    p50: float
+    p99: float
+
+    def describe(self) -> str:
+        return (f"Delivery queue: {self.depth} waiting  Sent: {self.sent}  Coalesced: {self.coalesced}  "
+                f"Retried: {self.retried}  Dropped: {self.dropped}  "
+                f"Latency p50 {self.p50 * 1000:.0f} ms  p99 {self.p99 * 1000:.0f} ms")
+
+
+class _Delivery:
+    """
+    Payloads waiting to be sent to a channel in one message
+    """
+
+    __slots__ = ("channel", "payloads", "coalesce", "queued", "attempts", "not_before", "backoff")
+
+    def __init__(self, channel, payload, coalesce: bool):
+        self.channel = channel
+        self.payloads: List = [payload]
+        self.coalesce: bool = coalesce
+        self.queued: float = monotonic()
+        self.attempts: int = 0
+        self.not_before: float = 0.0
+        self.backoff: Optional[Backoff] = None
+
+
+class DeliveryQueue:
+    """
+    Class for queueing outbound messages and sending them on a task at the rate Discord allows. Channels take turns so
+    a channel with many messages does not delay the others. The queue does not depend on discord.py, sending is done by
+    the given coroutine so it can be replaced with a fake one
+    """
+
+    # Discord allows 5 messages per 5 seconds on a channel
+    channel_burst: int = 5
+
+    # Payloads combined into one message at most
+    coalesce_limit: int = 10
+
+    # Delays between retries of a failed send
+    retry_base_delay: float = 1.0
+    retry_max_delay: float = 30.0
+
+    # Channel buckets kept before idle ones are evicted, the limit doubles with the buckets still in use
+    bucket_evict_threshold: int = 64
+
+    def __init__(self, send: SendFunction, channel_rate: float, global_rate: float, max_attempts: int,
+                 global_bucket: Optional[TokenBucket] = None):
+        self.channel_rate: float = channel_rate
+        self.max_attempts: int = max_attempts
+        self.sent: int = 0
+        self.coalesced: int = 0
+        self.retried: int = 0
+        self.dropped: int = 0
+        self.latency: HdrHistogram = HdrHistogram()
+        self._send: SendFunction = send
+
+        # Queues of different shards share the global limit of the bot
+        self._global: TokenBucket = global_bucket or TokenBucket(global_rate, max(1.0, global_rate))
+
+        # Waiting deliveries by channel ID in the order the channels get their turns
+        self._channels: Dict[int, Deque[_Delivery]] = {}
+        self._buckets: Dict[int, TokenBucket] = {}
+        self._evict_at: int = self.bucket_evict_threshold
+        self._in_flight: int = 0
+
+        # Events are created on the event loop when the queue is first used
+        self._wakeup: Optional[asyncio.Event] = None
+        self._idle: Optional[asyncio.Event] = None
+        self._logger = logging.getLogger("discord.bot")
+
+    def _events(self) -> Tuple[asyncio.Event, asyncio.Event]:
+        """
+        Get the events for waking up the sending task and for waiting until the queue is empty
+        """
+
+        if self._wakeup is None:
+            self._wakeup, self._idle = asyncio.Event(), asyncio.Event()
+
+        return self._wakeup, self._idle
+
+    @property
+    def depth(self) -> int:
+        """
+        Payloads waiting to be sent
+        """
+
+        return sum(len(delivery.payloads) for deliveries in self._channels.values() for delivery in deliveries)
+
+    def enqueue(self, channel, payload, coalesce: bool = False) -> None:
+        """
+        Queue a payload to be sent to a channel
+
+        :param channel: Channel to send to, any object with an 'id' attribute
+        :param payload: Message or embed passed to the send coroutine
+        :param coalesce: True if the payload can be combined with other waiting payloads of the channel, e.g. alerts
+        """
+
+        deliveries = self._channels.setdefault(channel.id, deque())
+        last = deliveries[-1] if deliveries else None
+
+        if coalesce and last is not None and last.coalesce and len(last.payloads) < self.coalesce_limit:
+            last.payloads.append(payload)
+            self.coalesced += 1
+
+        else:
+            deliveries.append(_Delivery(channel, payload, coalesce))
+
+        wakeup, idle = self._events()
+        idle.clear()
+        wakeup.set()
+
+    def metrics(self) -> DeliveryMetrics:
+        """
+        Get statistics of the queue
+
+        :return: Queue depth, counters and send latencies
+        """
+
+        return DeliveryMetrics(self.depth, self.sent, self.coalesced, self.retried, self.dropped,
+                               self.latency.quantile(0.5), self.latency.quantile(0.99))
+
+    def _next(self, now: float) -> Tuple[Optional[_Delivery], Optional[float]]:
+        """
+        Take the next delivery that the rate limits allow to be sent
+
+        :param now: Monotonic time
+        :return: Delivery and None, or None and the seconds until a delivery can be sent (None if nothing is waiting)
+        """
+
+        wait = None
+        global_wait = self._global.wait_time(now)
+
+        for channel_id, deliveries in self._channels.items():
+            if not deliveries:
+                continue
+
+            bucket = self._buckets.get(channel_id)
+            if bucket is None:
+                bucket = self._buckets[channel_id] = TokenBucket(self.channel_rate, self.channel_burst)
+
+            ready_in = max(deliveries[0].not_before - now, bucket.wait_time(now), global_wait)
+
+            if ready_in <= 0:
+                self._global.take(now)
+                bucket.take(now)
+                delivery = deliveries.popleft()
+
+                # Channel gets its next turn after the other channels
+                del self._channels[channel_id]
+                if deliveries:
+                    self._channels[channel_id] = deliveries
+
+                elif len(self._buckets) >= self._evict_at:
+                    self._evict_buckets(now)
+
+                return delivery, None
+
+            wait = ready_in if wait is None else min(wait, ready_in)
+
+        return None, wait
+
+    def _evict_buckets(self, now: float) -> None:
+        """
+        Forget the buckets of channels that have nothing waiting and have refilled to full, a channel posted to again
+        gets a new full bucket so the limits are unchanged. Called when a channel drains and the buckets have grown
+        past the limit, the limit is set to twice the buckets left so the sweeps take amortized constant time per send
+
+        :param now: Monotonic time
+        """
+
+        idle = [channel_id for channel_id, bucket in self._buckets.items()
+                if channel_id not in self._channels and bucket.full(now)]
+
+        for channel_id in idle:
+            del self._buckets[channel_id]
+
+        self._evict_at = max(self.bucket_evict_threshold, 2 * len(self._buckets))
+
+    async def run(self) -> None:
+        """
+        Send queued deliveries until cancelled
+        """
+
+        wakeup, idle = self._events()
+
+        while True:
+            delivery, wait = self._next(monotonic())
+
+            if delivery is None:
+                if wait is None and self._in_flight == 0:
+                    idle.set()
+
+                wakeup.clear()
+
+                try:
+                    await asyncio.wait_for(wakeup.wait(), wait)
+
+                except asyncio.TimeoutError:
+                    pass
+
+                continue
+
+            self._in_flight += 1
+
+            try:
+                await self._deliver(delivery)
+
+            finally:
+                self._in_flight -= 1
+
+    async def _deliver(self, delivery: _Delivery) -> None:
+        """
+        Send a delivery, a failed delivery is queued again at the head of its channel after a delay
+
+        :param delivery: Delivery to send
+        """
+
+        delivery.attempts += 1
+
+        try:
+            await self._send(delivery.channel, delivery.payloads)
+
+        except asyncio.CancelledError:
+            raise
+
+        except UndeliverableMessageException as error:
+            self._logger.error("Dropping message to channel %s: %s", delivery.channel.id, error)
+            self.dropped += len(delivery.payloads)
+
+        except Exception:
+            if delivery.attempts >= self.max_attempts:
+                self._logger.exception("Dropping message to channel %s after %d attempts",
+                                       delivery.channel.id, delivery.attempts)
+                self.dropped += len(delivery.payloads)
+                return
+
+            if delivery.backoff is None:
+                delivery.backoff = Backoff(self.retry_base_delay, self.retry_max_delay)
+
+            delay = delivery.backoff.next_delay()
+            self._logger.warning("Sending to channel %s failed, retrying in %.1f seconds", delivery.channel.id, delay)
+            self.retried += 1
+
+            delivery.not_before = monotonic() + delay
+            self._channels.setdefault(delivery.channel.id, deque()).appendleft(delivery)
+
+        else:
+            self.sent += len(delivery.payloads)
+            self.latency.observe(monotonic() - delivery.queued)
+
+    async def drain(self, timeout: float) -> bool:
+        """
+        Wait until every queued delivery has been sent or dropped
+
+        :param timeout: Seconds to wait at most
+        :return: True if the queue was emptied in time
+        """
+
+        _, idle = self._events()
+
+        if not self.depth and self._in_flight == 0:
+            return True
+
+        try:
+            await asyncio.wait_for(idle.wait(), timeout)
+
+        except asyncio.TimeoutError:
+            return False
+
+        return True
+
+
+class ShardedDelivery:
+    """
+    Class for a delivery queue per shard. Messages are queued on the shard of the guild of their channel, so every
+    shard sends only to its own guilds on its own task and a busy shard does not delay the others. The queues share
+    the global rate limit, which Discord applies to the whole bot
+    """
+
+    def __init__(self, send: SendFunction, channel_rate: float, global_rate: float, max_attempts: int):
+        self.channel_rate: float = channel_rate
+        self.max_attempts: int = max_attempts
+        self.queues: Dict[int, DeliveryQueue] = {}
+        self._send: SendFunction = send
+        self._global: TokenBucket = TokenBucket(global_rate, max(1.0, global_rate))
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._running: bool = False
+
+    @staticmethod
+    def shard_of(channel) -> int:
+        """
+        Get the shard a channel belongs to
+
+        :param channel: Discord channel or any object with an 'id' attribute
+        :return: Shard ID of the guild of the channel, direct messages are received on shard 0
+        """
+
+        guild = getattr(channel, "guild", None)
+        return guild.shard_id if guild is not None else 0
+
+    def queue(self, shard_id: int) -> DeliveryQueue:
+        """
+        Get the queue of a shard, created on first use and started if the deliveries are running
+
+        :param shard_id: Shard ID
+        :return: Delivery queue of the shard
+        """
+
+        queue = self.queues.get(shard_id)
+
+        if queue is None:
+            queue = self.queues[shard_id] = DeliveryQueue(
+                self._send, self.channel_rate, 0.0, self.max_attempts, global_bucket=self._global
+            )
+
+            if self._running:
+                self._tasks[shard_id] = asyncio.ensure_future(queue.run())
+
+        return queue
+
+    @property
+    def depth(self) -> int:
+        """
+        Payloads waiting to be sent on every shard
+        """
+
+        return sum(queue.depth for queue in self.queues.values())
+
+    def enqueue(self, channel, payload, coalesce: bool = False) -> None:
+        """
+        Queue a payload on the shard of the channel, see 'DeliveryQueue.enqueue'
+        """
+
+        self.queue(self.shard_of(channel)).enqueue(channel, payload, coalesce)
+
+    def shard_metrics(self) -> Dict[int, DeliveryMetrics]:
+        """
+        Get statistics of the queue of every shard
+
+        :return: Metrics by shard ID
+        """
+
+        return {shard_id: self.queues[shard_id].metrics() for shard_id in sorted(self.queues)}
+
+    def metrics(self) -> DeliveryMetrics:
+        """
+        Get statistics over all shards
+
+        :return: Total queue depth and counters, and the send latencies of every shard combined
+        """
+
+        latency = HdrHistogram()
+        for queue in self.queues.values():
+            latency.merge(queue.latency)
+
+        queues = self.queues.values()
+        return DeliveryMetrics(self.depth, sum(queue.sent for queue in queues),
+                               sum(queue.coalesced for queue in queues), sum(queue.retried for queue in queues),
+                               sum(queue.dropped for queue in queues), latency.quantile(0.5), latency.quantile(0.99))
+
+    async def run(self) -> None:
+        """
+        Run the queue of every shard on its own task until cancelled
+        """
+
+        self._running = True
+
+        for shard_id, queue in self.queues.items():
+            self._tasks[shard_id] = asyncio.ensure_future(queue.run())
+
+        try:
+            # Queues of shards seen later are started by 'queue'
+            await asyncio.Event().wait()
+
+        finally:
+            self._running = False
+
+            for task in self._tasks.values():
+                task.cancel()
+
+            self._tasks.clear()
+
+    async def drain(self, timeout: float) -> bool:
+        """
+        Wait until the queue of every shard has been emptied
+
+        :param timeout: Seconds to wait at most
+        :return: True if every queue was emptied in time
+        """
+
+        results = await asyncio.gather(*(queue.drain(timeout) for queue in list(self.queues.values())))
+        return all(results)
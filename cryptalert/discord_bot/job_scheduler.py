@@ -0,0 +1,144 @@
+"""
+Timer heap running the scheduled jobs of the Discord bot on a single task
+
+Emil Rekola <emil.rekola@hotmail.com>
+"""
+
+# STD imports
+import asyncio
+import heapq
+import logging
+from itertools import count
+from time import time
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+# Local imports
+from cryptalert.discord_bot.schedule import Schedule
+
+
+class _Job:
+    """
+    Scheduled job, a job that is replaced or cancelled is left in the heap and skipped when it is due
+    """
+
+    __slots__ = ("key", "schedule", "callback", "due", "cancelled")
+
+    def __init__(self, key: Hashable, schedule: Schedule, callback: Callable[[], None], due: float):
+        self.key: Hashable = key
+        self.schedule: Schedule = schedule
+        self.callback: Callable[[], None] = callback
+        self.due: float = due
+        self.cancelled: bool = False
+
+
+class JobScheduler:
+    """
+    Class for running jobs on their schedules, all jobs share one heap ordered by the time they are due and one task
+    that sleeps until the earliest of them. Jobs missed while the event loop was busy are not run late, the schedule
+    continues from the next tick
+    """
+
+    def __init__(self):
+        self._heap: List[Tuple[float, int, _Job]] = []
+        self._jobs: Dict[Hashable, _Job] = {}
+
+        # Breaks ties between jobs due at the same time, jobs are never compared
+        self._counter = count()
+
+        # Event is created on the event loop when the scheduler is first used
+        self._wakeup: Optional[asyncio.Event] = None
+        self._logger = logging.getLogger("discord.bot")
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    def _event(self) -> asyncio.Event:
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+
+        return self._wakeup
+
+    def schedule(self, key: Hashable, schedule: Schedule, callback: Callable[[], None]) -> float:
+        """
+        Add a job or replace the job with the same key
+
+        :param key: Identifies the job e.g. a channel ID
+        :param schedule: When the job is run
+        :param callback: Function run on the event loop when the job is due, must not block
+        :return: Unix time of the first run
+        """
+
+        self.cancel(key)
+
+        job = _Job(key, schedule, callback, schedule.next_run(time()))
+        self._jobs[key] = job
+        heapq.heappush(self._heap, (job.due, next(self._counter), job))
+
+        # Sleeping task must wake up if the new job is due before the job it is waiting for
+        self._event().set()
+
+        return job.due
+
+    def cancel(self, key: Hashable) -> Optional[Schedule]:
+        """
+        Remove a job
+
+        :param key: Key the job was scheduled with
+        :return: Schedule of the removed job or None if there was no such job
+        """
+
+        job = self._jobs.pop(key, None)
+
+        if job is None:
+            return None
+
+        job.cancelled = True
+        return job.schedule
+
+    def get(self, key: Hashable) -> Optional[Tuple[Schedule, float]]:
+        """
+        Get the schedule of a job and the time it is next run
+
+        :param key: Key the job was scheduled with
+        :return: Schedule and Unix time of the next run or None if there is no such job
+        """
+
+        job = self._jobs.get(key)
+        return (job.schedule, job.due) if job is not None else None
+
+    async def run(self) -> None:
+        """
+        Run the jobs when they are due until cancelled
+        """
+
+        wakeup = self._event()
+
+        while True:
+            # Replaced and cancelled jobs are dropped once they reach the top of the heap
+            while self._heap and self._heap[0][2].cancelled:
+                heapq.heappop(self._heap)
+
+            now = time()
+
+            if self._heap and self._heap[0][0] <= now:
+                _, _, job = heapq.heappop(self._heap)
+
+                try:
+                    job.callback()
+
+                except Exception:
+                    self._logger.exception("Scheduled job %s failed", job.key)
+
+                if not job.cancelled:
+                    job.due = job.schedule.next_run(max(now, job.due))
+                    heapq.heappush(self._heap, (job.due, next(self._counter), job))
+
+                continue
+
+            wakeup.clear()
+
+            try:
+                await asyncio.wait_for(wakeup.wait(), self._heap[0][0] - now if self._heap else None)
+
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,44 @@
+"""
+Cache for messages and embeds rendered from the latest fetched data
+
+Emil Rekola <emil.rekola@hotmail.com>
+"""
+
+# STD imports
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class RenderCache:
+    """
+    Class for memoizing rendered messages until the data they were rendered from changes. Every render is stored under
+    the key of the data it was rendered from and all renders are dropped when the key changes
+    """
+
+    def __init__(self):
+        self.hits: int = 0
+        self.misses: int = 0
+        self._key: Optional[Hashable] = None
+        self._renders: Dict[Hashable, Any] = {}
+
+    def get(self, key: Hashable, name: Hashable, render: Callable[[], Any]) -> Any:
+        """
+        Get a render of the data, rendering it only if it has not been rendered from the same data before
+
+        :param key: Identifies the data e.g. the snapshot version
+        :param name: Identifies the render e.g. the command and its arguments
+        :param render: Function creating the render
+        :return: Cached or new render
+        """
+
+        if key != self._key:
+            self._key = key
+            self._renders.clear()
+
+        if name in self._renders:
+            self.hits += 1
+            return self._renders[name]
+
+        self.misses += 1
+        result = self._renders[name] = render()
+
+        return result
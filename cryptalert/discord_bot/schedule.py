@@ -0,0 +1,84 @@
+"""
+Schedules of the periodic updates posted by the Discord bot, ticks are aligned to the clock and skip quiet hours
+
+Emil Rekola <emil.rekola@hotmail.com>
+"""
+
+# STD imports
+import math
+from datetime import datetime, timedelta, tzinfo
+from typing import NamedTuple, Optional
+
+# Local imports
+from cryptalert.quiet_hours import QuietHours
+
+# Seconds searched for a tick outside the quiet hours, e.g. a 2 hour interval never ticks outside quiet hours 8-7
+MAX_SEARCH = 31 * 86400
+
+
+class Schedule(NamedTuple):
+    """
+    Interval of the updates in minutes, quiet hours and the time zone they are in, None is the local time zone
+    """
+
+    interval: float
+    quiet_hours: Optional[QuietHours]
+    timezone: Optional[tzinfo]
+
+    def _local(self, timestamp: float) -> datetime:
+        if self.timezone is None:
+            return datetime.fromtimestamp(timestamp).astimezone()
+
+        return datetime.fromtimestamp(timestamp, self.timezone)
+
+    def next_run(self, after: float) -> float:
+        """
+        Get the time of the next tick, ticks are aligned to multiples of the interval on the clock of the time zone,
+        e.g. a 10 minute interval ticks at :00, :10, :20 and so on. Ticks during the quiet hours are skipped
+
+        :param after: Unix time the tick must be after
+        :return: Unix time of the tick
+        """
+
+        step = self.interval * 60
+        tick = after
+        first = None
+
+        # Aligned tick after the quiet hours can be within them again e.g. when the interval is longer than the hours
+        # outside them, skip to the end of the quiet hours until a tick is outside them
+        while tick - after < MAX_SEARCH:
+            offset = self._local(tick).utcoffset().total_seconds()
+            tick = (math.floor((tick + offset) / step) + 1) * step - offset
+            local = self._local(tick)
+
+            if first is None:
+                first = tick
+
+            if self.quiet_hours is None or not self.quiet_hours.contains(local):
+                return tick
+
+            quiet_end = local.replace(hour=self.quiet_hours.end, minute=0, second=0, microsecond=0)
+            if quiet_end <= local:
+                quiet_end += timedelta(days=1)
+
+            # Tick right at the end of the quiet hours is allowed
+            tick = quiet_end.timestamp() - 1e-3
+
+        # Every tick is within the quiet hours, they are ignored rather than never posting
+        return first
+
+    def format_time(self, timestamp: float) -> str:
+        """
+        Format a time in the time zone of the schedule
+
+        :param timestamp: Unix time
+        :return: Date and time with the name of the time zone
+        """
+
+        return f"{self._local(timestamp):%Y-%m-%d %H:%M %Z}"
+
+    def describe(self) -> str:
+        quiet = f", quiet {self.quiet_hours.describe()}" if self.quiet_hours is not None else ""
+        zone = str(self.timezone) if self.timezone is not None else "local time"
+
+        return f"every {self.interval:g} min{quiet} ({zone})"
@@ -0,0 +1,158 @@
+"""
+Watchlists of the channels subscribed to rate updates, indexed by currency and guild
+
+Emil Rekola <emil.rekola@hotmail.com>
+"""
+
+# STD imports
+from threading import Lock
+from typing import Dict, FrozenSet, Iterable, List, NamedTuple, Optional, Set
+
+
+class Subscription(NamedTuple):
+    """
+    Watchlist of a channel and the minimum minutes between the updates posted to it
+    """
+
+    channel_id: int
+    guild_id: Optional[int]
+    currencies: FrozenSet[str]
+    interval: float
+
+    def describe(self) -> str:
+        return f"<#{self.channel_id}>: {', '.join(sorted(self.currencies))} every {self.interval:g} min"
+
+
+class SubscriptionStore:
+    """
+    Class holding the subscriptions of every channel. Subscriptions are indexed by currency so that finding the
+    channels watching the changed currencies costs as much as there are matching channels
+    """
+
+    def __init__(self):
+        self._subscriptions: Dict[int, Subscription] = {}
+        self._by_currency: Dict[str, Set[int]] = {}
+        self._by_guild: Dict[int, Set[int]] = {}
+
+        # Monotonic time of the latest update posted to a channel
+        self._last_sent: Dict[int, float] = {}
+
+        # Commands modify the subscriptions while updates are fanned out
+        self._lock: Lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._subscriptions)
+
+    def get(self, channel_id: int) -> Optional[Subscription]:
+        """
+        Get the subscription of a channel
+
+        :param channel_id: Discord channel ID
+        :return: Subscription or None if the channel has not subscribed
+        """
+
+        return self._subscriptions.get(channel_id)
+
+    def set(self, subscription: Subscription) -> None:
+        """
+        Add the subscription of a channel or replace its previous subscription, a subscription without currencies
+        is removed
+
+        :param subscription: New subscription
+        """
+
+        with self._lock:
+            self._remove(subscription.channel_id)
+
+            if not subscription.currencies:
+                return
+
+            self._subscriptions[subscription.channel_id] = subscription
+
+            for currency in subscription.currencies:
+                self._by_currency.setdefault(currency, set()).add(subscription.channel_id)
+
+            if subscription.guild_id is not None:
+                self._by_guild.setdefault(subscription.guild_id, set()).add(subscription.channel_id)
+
+    def remove(self, channel_id: int) -> Optional[Subscription]:
+        """
+        Remove the subscription of a channel
+
+        :param channel_id: Discord channel ID
+        :return: Removed subscription or None if the channel had not subscribed
+        """
+
+        with self._lock:
+            self._last_sent.pop(channel_id, None)
+            return self._remove(channel_id)
+
+    def _remove(self, channel_id: int) -> Optional[Subscription]:
+        subscription = self._subscriptions.pop(channel_id, None)
+
+        if subscription is None:
+            return None
+
+        # Empty index entries are removed so that the keys of the currency index are the watched currencies
+        for currency in subscription.currencies:
+            channels = self._by_currency[currency]
+            channels.discard(channel_id)
+
+            if not channels:
+                del self._by_currency[currency]
+
+        if subscription.guild_id is not None:
+            channels = self._by_guild[subscription.guild_id]
+            channels.discard(channel_id)
+
+            if not channels:
+                del self._by_guild[subscription.guild_id]
+
+        return subscription
+
+    def currencies(self) -> Set[str]:
+        """
+        Get the union of the watchlists
+
+        :return: Currency codes watched by atleast one channel
+        """
+
+        with self._lock:
+            return set(self._by_currency)
+
+    def for_guild(self, guild_id: int) -> List[Subscription]:
+        """
+        Get the subscriptions of the channels of a guild
+
+        :param guild_id: Discord guild ID
+        :return: Subscriptions ordered by channel ID
+        """
+
+        with self._lock:
+            return [self._subscriptions[channel_id] for channel_id in sorted(self._by_guild.get(guild_id, ()))]
+
+    def due(self, currencies: Iterable[str], now: float) -> List[Subscription]:
+        """
+        Get the subscriptions watching any of the given currencies whose interval has passed since their previous
+        update, they are marked as sent
+
+        :param currencies: Currency codes that have changed
+        :param now: Monotonic time
+        :return: Subscriptions to post an update to
+        """
+
+        with self._lock:
+            matching = set()
+            for currency in currencies:
+                matching.update(self._by_currency.get(currency, ()))
+
+            due = []
+            for channel_id in matching:
+                subscription = self._subscriptions[channel_id]
+                last_sent = self._last_sent.get(channel_id)
+
+                if last_sent is None or now - last_sent >= subscription.interval * 60:
+                    self._last_sent[channel_id] = now
+                    due.append(subscription)
+
+            return due
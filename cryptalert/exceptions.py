@@ -5,12 +5,6 @@ Emil Rekola <emil.rekola@hotmail.com>
 """
 
 
-class DataLengthException(Exception):
-    """
-    Custom exception when given data size is zero
-    """
-
-
 class ApiAddressException(Exception):
     """
     Custom exception when API address is none or the given address was invalid
@@ -21,3 +15,9 @@ class UnsupportedOperationModeException(Exception):
     """
     Custom exception when both discord bot and TUI are disabled
     """
+
+
+class UndeliverableMessageException(Exception):
+    """
+    Custom exception when the bot can't send to a channel and retrying would not help
+    """
@@ -0,0 +1,312 @@
+"""
+Local HTTP endpoint serving the latest snapshot and fetcher metrics as JSON and in the Prometheus text format
+
+Emil Rekola <emil.rekola@hotmail.com>
+"""
+
+# STD imports
+import json
+import math
+import logging
+from time import time
+from threading import Thread
+from typing import Dict, List, Optional, Tuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local imports
+from cryptalert.data_fetcher.api_accessor import ApiAccessor
+from cryptalert.data_fetcher.metrics import HdrHistogram
+from cryptalert.data_fetcher.rates import RATE_FIELDS
+from cryptalert.data_fetcher.snapshot_bus import Snapshot
+
+
+def _number(value: float) -> Optional[float]:
+    """
+    NaN is not valid JSON, missing values are given as null
+    """
+
+    return None if math.isnan(value) else value
+
+
+def snapshot_json(snapshot: Optional[Snapshot]) -> Dict:
+    """
+    Convert a snapshot to a Dict that can be serialized to JSON
+
+    :param snapshot: Latest snapshot or None if nothing has been fetched
+    :return: Dict holding the version, fetch time, rates, best quotes and market status
+    """
+
+    if snapshot is None:
+        return {"version": 0, "timestamp": None, "rates": {}, "quotes": {}, "market": None}
+
+    data = snapshot.data
+
+    return {
+        "version": snapshot.version,
+        "timestamp": snapshot.timestamp,
+        "rates": {
+            currency: {field: _number(value) for field, value in zip(RATE_FIELDS, rate)}
+            for currency, rate in data.rates.items()
+        },
+        "quotes": {
+            currency: {"buy": _number(quote.buy), "buySource": quote.buy_source,
+                       "sell": _number(quote.sell), "sellSource": quote.sell_source}
+            for currency, quote in data.quotes.items()
+        },
+        "market": {"changePercent": _number(data.market.change_percent), "rising": data.market.rising}
+    }
+
+
+def _histogram_json(histogram: HdrHistogram) -> Dict:
+    """
+    Convert a histogram to its cumulative buckets and quantiles
+    """
+
+    return {
+        "buckets": [[bound if bound != math.inf else "+Inf", count] for bound, count in histogram.cumulative()],
+        "sum": histogram.total,
+        "count": histogram.count,
+        "p50": histogram.quantile(0.5),
+        "p90": histogram.quantile(0.9),
+        "p99": histogram.quantile(0.99),
+        "max": histogram.max
+    }
+
+
+def metrics_json(api_accessor: ApiAccessor) -> Dict:
+    """
+    Collect the fetcher metrics to a Dict that can be serialized to JSON
+
+    :param api_accessor: Data fetcher
+    :return: Dict holding latency and stage histograms, success and error counts, failure counters and the poll rate
+    """
+
+    poll = api_accessor.scheduler.metrics()
+
+    return {
+        "latency": {
+            source: _histogram_json(histogram) for source, histogram in api_accessor.metrics.histograms().items()
+        },
+        "stages": {
+            stage: _histogram_json(histogram) for stage, histogram in api_accessor.metrics.stage_histograms().items()
+        },
+        "successes": api_accessor.metrics.success_counts(),
+        "errors": [
+            {"source": source, "kind": kind, "count": count}
+            for (source, kind), count in api_accessor.metrics.error_counts().items()
+        ],
+        "failedFetches": api_accessor.failed_fetches,
+        "consecutiveFailures": api_accessor.consecutive_failures,
+        "degraded": api_accessor.degraded,
+        "poll": poll._asdict()
+    }
+
+
+def _labels(**labels: str) -> str:
+    """
+    Format Prometheus labels, quotes, backslashes and newlines in values are escaped
+    """
+
+    escaped = {
+        name: value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        for name, value in labels.items()
+    }
+
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped.items()) + "}"
+
+
+def _value(value: float) -> str:
+    """
+    Format a sample value, Prometheus spells non-finite values differently from Python
+    """
+
+    if math.isnan(value):
+        return "NaN"
+
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+
+    return repr(value)
+
+
+def prometheus_text(api_accessor: ApiAccessor) -> str:
+    """
+    Create the Prometheus text exposition of the latest snapshot and the fetcher metrics
+
+    :param api_accessor: Data fetcher
+    :return: Metrics in the Prometheus text format
+    """
+
+    lines: List[str] = []
+
+    def metric(name: str, kind: str, description: str, samples: List[Tuple[str, float]]) -> None:
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(f"{name}{labels} {_value(value)}" for labels, value in samples)
+
+    snapshot = api_accessor.bus.latest
+
+    if snapshot is not None:
+        data = snapshot.data
+        metric("cryptalert_rate", "gauge", "Latest rates of the watched currencies", [
+            (_labels(currency=currency, field=field), float(value))
+            for currency, rate in data.rates.items()
+            for field, value in zip(RATE_FIELDS, rate)
+        ])
+        metric("cryptalert_market_change_percent", "gauge", "Signed change percent of the total market",
+               [("", float(data.market.signed_change))])
+        metric("cryptalert_snapshot_age_seconds", "gauge", "Seconds since the latest snapshot was published",
+               [("", time() - snapshot.timestamp)])
+
+    metric("cryptalert_snapshot_version", "gauge", "Version of the latest snapshot",
+           [("", float(api_accessor.bus.version))])
+
+    def histogram(name: str, description: str, label: str, histograms: Dict[str, HdrHistogram]) -> None:
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} histogram")
+
+        for value, histogram in histograms.items():
+            for bound, count in histogram.cumulative():
+                le = "+Inf" if bound == math.inf else repr(bound)
+                lines.append(f"{name}_bucket{_labels(**{label: value, 'le': le})} {count}")
+
+            lines.append(f"{name}_sum{_labels(**{label: value})} {histogram.total!r}")
+            lines.append(f"{name}_count{_labels(**{label: value})} {histogram.count}")
+
+    histogram("cryptalert_fetch_duration_seconds", "Latency of requests to rate sources and of whole fetches",
+              "source", api_accessor.metrics.histograms())
+    histogram("cryptalert_fetch_stage_duration_seconds", "Time spent in each stage of fetching and publishing data",
+              "stage", api_accessor.metrics.stage_histograms())
+
+    metric("cryptalert_fetch_successes_total", "counter", "Requests that returned valid data by rate source", [
+        (_labels(source=source), float(count)) for source, count in api_accessor.metrics.success_counts().items()
+    ])
+    metric("cryptalert_fetch_errors_total", "counter", "Failed requests by rate source and exception type", [
+        (_labels(source=source, kind=kind), float(count))
+        for (source, kind), count in api_accessor.metrics.error_counts().items()
+    ])
+
+    poll = api_accessor.scheduler.metrics()
+    metric("cryptalert_failed_fetches_total", "counter", "Fetches where no source responded with valid data",
+           [("", float(api_accessor.failed_fetches))])
+    metric("cryptalert_consecutive_failures", "gauge", "Failed fetches in a row",
+           [("", float(api_accessor.consecutive_failures))])
+    metric("cryptalert_poll_interval_seconds", "gauge", "Current adaptive poll interval", [("", float(poll.interval))])
+    metric("cryptalert_polls_per_hour", "gauge", "Effective poll rate during the last hour",
+           [("", float(poll.polls_per_hour))])
+
+    return "\n".join(lines) + "\n"
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    """
+    Class for handling requests to the endpoint, 'server' is the owning 'SnapshotHTTPServer'
+    """
+
+    server: "SnapshotHTTPServer"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args) -> None:
+        self.server.logger.debug("%s %s", self.address_string(), format % args)
+
+    def do_GET(self) -> None:
+        path = self.path.split("?", 1)[0]
+        api_accessor = self.server.api_accessor
+
+        if path == "/snapshot":
+            version, body = self.server.snapshot_body()
+            etag = f'"{version}"'
+
+            # Clients polling the endpoint get an empty response until a new snapshot is published
+            if self.headers.get("If-None-Match") == etag:
+                self._send(304, b"", "application/json", etag)
+
+            else:
+                self._send(200, body, "application/json", etag)
+
+        elif path == "/metrics":
+            self._send(200, prometheus_text(api_accessor).encode(), "text/plain; version=0.0.4; charset=utf-8")
+
+        elif path == "/metrics.json":
+            self._send(200, json.dumps(metrics_json(api_accessor)).encode(), "application/json")
+
+        elif path == "/health":
+            degraded = api_accessor.degraded
+            body = json.dumps({"status": "degraded" if degraded else "ok"}).encode()
+            self._send(503 if degraded else 200, body, "application/json")
+
+        else:
+            self._send(404, b"Not found\n", "text/plain; charset=utf-8")
+
+    def _send(self, status: int, body: bytes, content_type: str, etag: str = None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+
+        if etag is not None:
+            self.send_header("ETag", etag)
+
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class SnapshotHTTPServer(ThreadingHTTPServer):
+    """
+    Class for serving the latest snapshot and the fetcher metrics on a background thread
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address: str, port: int, api_accessor: ApiAccessor):
+        super().__init__((address, port), _RequestHandler)
+        self.api_accessor: ApiAccessor = api_accessor
+        self.logger = logging.getLogger("HTTP")
+        self._thread: Optional[Thread] = None
+
+        # Serialized snapshot is shared by all clients until a new snapshot is published
+        self._snapshot_cache: Tuple[int, bytes] = (-1, b"")
+
+    def snapshot_body(self) -> Tuple[int, bytes]:
+        """
+        Get the latest snapshot serialized to JSON
+
+        :return: Version and JSON of the snapshot
+        """
+
+        snapshot = self.api_accessor.bus.latest
+        version = snapshot.version if snapshot is not None else 0
+        cached = self._snapshot_cache
+
+        if cached[0] != version:
+            cached = (version, json.dumps(snapshot_json(snapshot)).encode())
+            self._snapshot_cache = cached
+
+        return cached
+
+    def start(self) -> None:
+        """
+        Start serving requests on a background thread
+        """
+
+        self.logger.info("Serving snapshots and metrics on http://%s:%d", *self.server_address[:2])
+        self._thread = Thread(target=self.serve_forever, kwargs={"poll_interval": 0.1}, name="HTTP", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float) -> bool:
+        """
+        Stop serving requests and close the listening socket
+
+        :param timeout: Seconds to wait for the serving thread to stop
+        :return: True if the server stopped in time
+        """
+
+        if self._thread is None:
+            self.server_close()
+            return True
+
+        # 'shutdown' blocks until the serving loop notices the request, at most one poll interval
+        self.shutdown()
+        self.server_close()
+        self._thread.join(timeout)
+
+        return not self._thread.is_alive()
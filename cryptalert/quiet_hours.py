@@ -0,0 +1,75 @@
+"""
+Quiet hours and time zones of scheduled updates, parsed from the configuration and bot commands
+
+Emil Rekola <emil.rekola@hotmail.com>
+"""
+
+# STD imports
+from argparse import ArgumentTypeError
+from datetime import datetime, tzinfo
+from typing import NamedTuple, Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+
+class QuietHours(NamedTuple):
+    """
+    Hours of the day when no updates are posted, the range wraps over midnight if start is after end e.g. 23-7
+    """
+
+    start: int
+    end: int
+
+    def contains(self, moment: datetime) -> bool:
+        """
+        Check if a moment is within the quiet hours
+
+        :param moment: Moment in the time zone of the schedule
+        :return: True if no updates should be posted at the moment
+        """
+
+        if self.start <= self.end:
+            return self.start <= moment.hour < self.end
+
+        return moment.hour >= self.start or moment.hour < self.end
+
+    def describe(self) -> str:
+        return f"{self.start:02d}-{self.end:02d}"
+
+
+def parse_quiet_hours(text: str) -> Optional[QuietHours]:
+    """
+    Parse quiet hours given as 'start-end' in whole hours, e.g. '23-7', or 'none'
+
+    :param text: Quiet hours given by the user
+    :return: Quiet hours or None if there are none
+    """
+
+    if text.lower() == "none":
+        return None
+
+    try:
+        start, end = (int(hour) for hour in text.split("-"))
+
+    except ValueError:
+        raise ArgumentTypeError(f"Quiet hours must be given as 'start-end' e.g. '23-7', not '{text}'") from None
+
+    if not (0 <= start <= 23 and 0 <= end <= 23):
+        raise ArgumentTypeError(f"Hours of the quiet hours must be between 0 and 23, not '{text}'")
+
+    # Empty range would silence nothing
+    return QuietHours(start, end) if start != end else None
+
+
+def parse_timezone(name: str) -> tzinfo:
+    """
+    Get a time zone from the IANA database by its name
+
+    :param name: Name of the time zone e.g. 'Europe/Helsinki'
+    :return: Time zone
+    """
+
+    try:
+        return ZoneInfo(name)
+
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ArgumentTypeError(f"Unknown time zone '{name}'") from None
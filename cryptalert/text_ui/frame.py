@@ -0,0 +1,78 @@
+"""
+Differential drawing of curses windows, only the fields that changed since the previous frame are written
+
+Emil Rekola <emil.rekola@hotmail.com>
+"""
+
+# STD imports
+import curses
+from typing import Dict, Tuple
+
+
+class Frame:
+    """
+    Class for drawing the text fields of a window as frames. Fields of the next frame are collected with 'add' and
+    'commit' compares them to the fields of the previous frame, unchanged fields are not touched at all so curses has
+    nothing to send to the terminal for them. Fields that became shorter or disappeared are blanked
+    """
+
+    def __init__(self, window):
+        self.window = window
+
+        # Text and attributes of the fields by their position
+        self._drawn: Dict[Tuple[int, int], Tuple[str, int]] = {}
+        self._next: Dict[Tuple[int, int], Tuple[str, int]] = {}
+
+    def add(self, row: int, col: int, text: str, attr: int = 0) -> None:
+        """
+        Add a field to the next frame
+
+        :param row: Row of the field in the window
+        :param col: Column the field starts from
+        :param text: Text of the field
+        :param attr: Curses attributes of the text e.g. a color pair
+        """
+
+        self._next[(row, col)] = (text, attr)
+
+    def commit(self) -> int:
+        """
+        Write the changes of the next frame to the window, refreshing is left to the caller
+
+        :return: Number of fields written
+        """
+
+        written = 0
+
+        for position, (text, attr) in self._drawn.items():
+            if position not in self._next:
+                self._write(position, " " * len(text), attr)
+                written += 1
+
+        for position, field in self._next.items():
+            previous = self._drawn.get(position)
+
+            if previous == field:
+                continue
+
+            text, attr = field
+
+            # Leftovers of a longer previous text are overwritten with spaces
+            if previous is not None and len(previous[0]) > len(text):
+                text = text.ljust(len(previous[0]))
+
+            self._write(position, text, attr)
+            written += 1
+
+        self._drawn = self._next
+        self._next = {}
+
+        return written
+
+    def _write(self, position: Tuple[int, int], text: str, attr: int) -> None:
+        try:
+            self.window.addstr(position[0], position[1], text, attr)
+
+        # Writing the last cell of a window moves the cursor outside it, the text is still written
+        except curses.error:
+            pass
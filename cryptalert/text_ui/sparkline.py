@@ -0,0 +1,221 @@
+"""
+Sparklines of the rate history, samples are downsampled to time buckets as they arrive so drawing never rescans the
+history
+
+Emil Rekola <emil.rekola@hotmail.com>
+"""
+
+# STD imports
+import math
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+# Local imports
+from cryptalert.data_fetcher.history import HistoryStore
+from cryptalert.data_fetcher.rates import MarketSnapshot
+
+# Levels from the lowest to the highest value, the ASCII levels are used on terminals without Unicode
+BLOCK_LEVELS: str = "▁▂▃▄▅▆▇█"
+ASCII_LEVELS: str = "_.,-~=*#"
+
+
+class MinMaxBuckets:
+    """
+    Class for the minimum, maximum and latest value of a fixed number of time buckets covering a span, e.g. 240
+    buckets of 15 seconds for an hour. Adding a sample updates only its bucket and buckets older than the span are
+    reused, so both adding and drawing are independent of the number of samples
+    """
+
+    __slots__ = ("count", "bucket_width", "revision", "_min", "_max", "_last", "_newest", "_rendered")
+
+    def __init__(self, span: float, count: int):
+        self.count: int = count
+        self.bucket_width: float = span / count
+
+        # Changes whenever a bucket changes, drawn sparklines are reused until then
+        self.revision: int = 0
+
+        self._min: array = array("d", [math.nan] * count)
+        self._max: array = array("d", [math.nan] * count)
+        self._last: array = array("d", [math.nan] * count)
+
+        # Number of the newest bucket counted from the epoch, None before the first sample
+        self._newest: Optional[int] = None
+        self._rendered: Tuple[Tuple[int, int, str], str] = ((-1, 0, ""), "")
+
+    def add(self, timestamp: float, value: float) -> None:
+        """
+        Add a sample to its bucket, samples older than the span are ignored
+
+        :param timestamp: Unix time of the sample
+        :param value: Sampled value, NaN values are ignored
+        """
+
+        if math.isnan(value):
+            return
+
+        bucket = int(timestamp // self.bucket_width)
+
+        if self._newest is None or bucket > self._newest:
+            # Buckets between the previous and the new newest bucket are emptied, at most the whole ring
+            first = bucket - self.count + 1 if self._newest is None else max(self._newest + 1, bucket - self.count + 1)
+            for skipped in range(first, bucket + 1):
+                index = skipped % self.count
+                self._min[index] = self._max[index] = self._last[index] = math.nan
+
+            self._newest = bucket
+
+        elif bucket <= self._newest - self.count:
+            return
+
+        index = bucket % self.count
+
+        if math.isnan(self._min[index]):
+            self._min[index] = self._max[index] = value
+
+        else:
+            self._min[index] = min(self._min[index], value)
+            self._max[index] = max(self._max[index], value)
+
+        self._last[index] = value
+        self.revision += 1
+
+    def render(self, width: int, levels: str = BLOCK_LEVELS) -> str:
+        """
+        Draw the buckets as a sparkline, adjacent buckets are merged when the width is smaller than the number of
+        buckets. Each character shows the extreme of its buckets that is further from the previous character so that
+        spikes are not averaged away, empty buckets repeat the latest value before them
+
+        :param width: Characters at most, the sparkline is never wider than the number of buckets
+        :param levels: Characters from the lowest to the highest value
+        :return: Sparkline, leading spaces where there is no data yet
+        """
+
+        width = min(width, self.count)
+        key = (self.revision, width, levels)
+
+        if self._rendered[0] == key:
+            return self._rendered[1]
+
+        values = self._column_values(width)
+        known = [value for value in values if value is not None]
+
+        if not known:
+            line = " " * width
+
+        else:
+            low, high = min(known), max(known)
+            scale = (len(levels) - 1) / (high - low) if high > low else 0.0
+            flat = levels[(len(levels) - 1) // 2]
+
+            line = "".join(
+                " " if value is None else levels[round((value - low) * scale)] if scale else flat
+                for value in values
+            )
+
+        self._rendered = (key, line)
+        return line
+
+    def _column_values(self, width: int) -> List[Optional[float]]:
+        """
+        Merge the buckets to columns from the oldest to the newest
+
+        :param width: Number of columns, at most the number of buckets
+        :return: Value shown by each column, None for columns before the first sample
+        """
+
+        if self._newest is None or width <= 0:
+            return [None] * width
+
+        oldest = self._newest - self.count + 1
+        values: List[Optional[float]] = []
+        carry = math.nan
+        previous = math.nan
+
+        for column in range(width):
+            low, high = math.inf, -math.inf
+
+            for bucket in range(oldest + column * self.count // width, oldest + (column + 1) * self.count // width):
+                index = bucket % self.count
+
+                if not math.isnan(self._min[index]):
+                    low = min(low, self._min[index])
+                    high = max(high, self._max[index])
+                    carry = self._last[index]
+
+            if low > high:
+                if math.isnan(carry):
+                    values.append(None)
+                    continue
+
+                low = high = carry
+
+            if math.isnan(previous):
+                previous = low
+
+            previous = high if abs(high - previous) >= abs(low - previous) else low
+            values.append(previous)
+
+        return values
+
+
+class SparklineStore:
+    """
+    Class for the sparklines of every currency, updated with every published snapshot
+    """
+
+    def __init__(self, span: float, buckets: int, field: str = "buy"):
+        self.span: float = span
+        self.buckets: int = buckets
+        self.field: str = field
+        self._sparklines: Dict[str, MinMaxBuckets] = {}
+
+    def _get(self, currency: str) -> MinMaxBuckets:
+        if currency not in self._sparklines:
+            self._sparklines[currency] = MinMaxBuckets(self.span, self.buckets)
+
+        return self._sparklines[currency]
+
+    def update(self, timestamp: float, snapshot: MarketSnapshot) -> None:
+        """
+        Add the rates of a snapshot to the sparklines
+
+        :param timestamp: Unix time of the snapshot
+        :param snapshot: Published data
+        """
+
+        for currency, rate in snapshot.rates.items():
+            self._get(currency).add(timestamp, rate.get(self.field))
+
+    def warm(self, history: HistoryStore, since: float) -> None:
+        """
+        Fill the sparklines from the rate history, e.g. when the TUI is started after the data fetcher
+
+        :param history: Rate history to read the samples from
+        :param since: Unix time of the oldest sample to read
+        """
+
+        for currency in history.currencies():
+            rate_history = history.get(currency)
+            sparkline = self._get(currency)
+
+            # Both fields are sliced from one position so they stay aligned while the fetcher appends samples
+            timestamp_segments, value_segments = rate_history.windows(("timestamp", self.field))
+
+            for timestamps, values in zip(timestamp_segments, value_segments):
+                for timestamp, value in zip(timestamps, values):
+                    if timestamp >= since:
+                        sparkline.add(timestamp, value)
+
+    def render(self, currency: str, width: int, levels: str = BLOCK_LEVELS) -> str:
+        """
+        Draw the sparkline of a currency
+
+        :param currency: Currency code
+        :param width: Characters at most
+        :param levels: Characters from the lowest to the highest value
+        :return: Sparkline, empty if the currency has no samples
+        """
+
+        sparkline = self._sparklines.get(currency)
+        return sparkline.render(width, levels) if sparkline is not None else ""
@@ -0,0 +1,205 @@
+"""
+Sortable one row per currency table of the TUI, only the rows that fit the window are formatted
+
+Emil Rekola <emil.rekola@hotmail.com>
+"""
+
+# STD imports
+import math
+from typing import List, NamedTuple, Optional, Tuple
+
+# Local imports
+from cryptalert.data_fetcher.indicators import IndicatorEngine
+from cryptalert.data_fetcher.rates import MarketSnapshot
+
+
+class Column(NamedTuple):
+    """
+    Column of the table, values are formatted with the format spec and aligned to the width
+    """
+
+    title: str
+    width: int
+    spec: str
+
+
+# Currency code is the first value of a row and the rest are numbers in the same order as the columns
+COLUMNS: Tuple[Column, ...] = (
+    Column("Currency", 10, ""),
+    Column("Buy", 14, ".2f"),
+    Column("Sell", 14, ".2f"),
+    Column("Change %", 10, "+.2f"),
+    Column("High", 14, ".2f"),
+    Column("Spread %", 10, ".2f"),
+    Column("Volatility", 12, ".2f"),
+)
+
+# Row of the table, e.g. ('BTC', 45000.0, 44500.0, 1.2, 46000.0, 1.11, 120.5)
+Row = Tuple
+
+
+def _sort_key(column: int):
+    # Missing values (NaN) are sorted last in both directions by 'RateTable'
+    if column == 0:
+        return lambda row: row[0]
+
+    return lambda row: (math.isnan(row[column]), row[column])
+
+
+class RateTable:
+    """
+    Class for the rate table. Rows are built and sorted once per snapshot or sort change, drawing a frame formats only
+    the visible rows so its cost does not depend on the number of currencies. The selected row follows its currency
+    when the order changes
+    """
+
+    def __init__(self):
+        self.sort_column: int = 0
+        self.descending: bool = False
+        self.selected: int = 0
+        self.offset: int = 0
+        self._rows: List[Row] = []
+        self._version: Optional[int] = None
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    @property
+    def selected_currency(self) -> Optional[str]:
+        """
+        Currency code of the selected row, None if the table is empty
+        """
+
+        return self._rows[self.selected][0] if self._rows else None
+
+    def update(self, version: int, data: Optional[MarketSnapshot], indicators: IndicatorEngine) -> None:
+        """
+        Rebuild the rows from a snapshot, nothing is done if the snapshot was already used
+
+        :param version: Version of the snapshot
+        :param data: Data of the snapshot
+        :param indicators: Rolling indicators, volatility is the standard deviation of the longest window
+        """
+
+        if version == self._version:
+            return
+
+        self._version = version
+        rows = []
+
+        for currency, rate in (data.rates.items() if data is not None else ()):
+            currency_indicators = indicators.get(currency)
+            volatility = currency_indicators[max(currency_indicators)].std if currency_indicators else math.nan
+            spread = (rate.buy - rate.sell) / rate.buy * 100 if rate.buy else math.nan
+
+            rows.append((currency, rate.buy, rate.sell, rate.change_percent, rate.high, spread, volatility))
+
+        self._set_rows(rows)
+
+    def sort_by(self, column: int) -> None:
+        """
+        Sort the rows by a column, sorting again by the same column reverses the order
+
+        :param column: Index of the column in 'COLUMNS'
+        """
+
+        if column == self.sort_column:
+            self.descending = not self.descending
+
+        else:
+            self.sort_column = column
+            self.descending = False
+
+        self._set_rows(self._rows)
+
+    def _set_rows(self, rows: List[Row]) -> None:
+        selected_currency = self.selected_currency
+
+        key = _sort_key(self.sort_column)
+        rows = sorted(rows, key=key, reverse=self.descending)
+
+        # Missing values stay last when the order is reversed
+        if self.descending and self.sort_column:
+            missing = [row for row in rows if math.isnan(row[self.sort_column])]
+            rows = rows[len(missing):] + missing
+
+        self._rows = rows
+        self.selected = next((index for index, row in enumerate(rows) if row[0] == selected_currency), 0)
+
+    def move(self, step: int) -> None:
+        """
+        Move the selection, the view scrolls when the selection is drawn next time
+
+        :param step: Rows to move, negative moves up
+        """
+
+        self.selected = max(0, min(len(self._rows) - 1, self.selected + step))
+
+    def visible(self, height: int) -> List[Tuple[Row, bool]]:
+        """
+        Get the rows that fit the given height, the view is scrolled to keep the selected row visible
+
+        :param height: Number of rows that fit the window
+        :return: Rows and whether each of them is selected
+        """
+
+        if height <= 0:
+            return []
+
+        if self.selected < self.offset:
+            self.offset = self.selected
+
+        elif self.selected >= self.offset + height:
+            self.offset = self.selected - height + 1
+
+        # Shrinking table or growing window must not leave empty rows at the bottom
+        self.offset = max(0, min(self.offset, len(self._rows) - height))
+
+        return [
+            (row, self.offset + index == self.selected)
+            for index, row in enumerate(self._rows[self.offset:self.offset + height])
+        ]
+
+    def header(self, width: int) -> str:
+        """
+        Format the header, the sorted column is marked with the direction of the order
+
+        :param width: Available width, columns that do not fit are left out
+        :return: Header row
+        """
+
+        titles = []
+        for index, column in enumerate(COLUMNS):
+            title = column.title
+            if index == self.sort_column:
+                title += " v" if self.descending else " ^"
+
+            titles.append(title.ljust(column.width) if index == 0 else title.rjust(column.width))
+
+        return self._fit(titles, width)
+
+    def format_row(self, row: Row, width: int) -> str:
+        """
+        Format a row of the table
+
+        :param row: Row from 'visible'
+        :param width: Available width, columns that do not fit are left out
+        :return: Formatted row
+        """
+
+        cells = [row[0].ljust(COLUMNS[0].width)]
+        for column, value in zip(COLUMNS[1:], row[1:]):
+            cells.append(("-" if math.isnan(value) else format(value, column.spec)).rjust(column.width))
+
+        return self._fit(cells, width)
+
+    @staticmethod
+    def _fit(cells: List[str], width: int) -> str:
+        text = ""
+        for cell in cells:
+            if len(text) + len(cell) > width:
+                break
+
+            text += cell + " "
+
+        return text.rstrip()
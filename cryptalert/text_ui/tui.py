@@ -5,24 +5,51 @@ Emil Rekola <emil.rekola@hotmail.com>
 """
 
 # STD imports
+import os
+import sys
 import curses
+import select
+import signal
 import logging
-from multiprocessing import Event
-from typing import Dict, Tuple, List
+from collections import deque
+from threading import Event
+from time import time
+from typing import Deque, Dict, Tuple, Optional
 
 # Local imports
 from cryptalert.data_fetcher.api_accessor import ApiAccessor
-from cryptalert.exceptions import DataLengthException
+from cryptalert.data_fetcher.rates import MarketSnapshot
+from cryptalert.data_fetcher.snapshot_bus import Snapshot
+from cryptalert.text_ui.frame import Frame
+from cryptalert.text_ui.sparkline import ASCII_LEVELS, BLOCK_LEVELS, SparklineStore
+from cryptalert.text_ui.table import COLUMNS, RateTable
 
 
 class TUI:
     """
-    Class for displaying a simple text UI
+    Class for displaying a simple text UI. The screen is redrawn when a snapshot is published or a key is pressed and
+    only the fields that changed are written to the terminal
     """
 
-    def __init__(self, exit_flag, api_accessor):
+    # Seconds between redraws without new snapshots, shows failed fetches and their metrics
+    idle_redraw_interval: float = 5.0
+
+    # Milliseconds 'getch' waits for a key where the input can not be waited with 'select', i.e. on Windows
+    poll_interval_ms: int = 250
+
+    # Smallest terminal the windows fit in, the data window needs room for the header, a row and the indicators
+    min_height: int = 14
+    min_width: int = 40
+
+    # Time buckets per sparkline, the widest sparkline drawn has one character per bucket
+    sparkline_buckets: int = 240
+
+    # Sparklines narrower than this are not drawn
+    min_sparkline_width: int = 8
+
+    def __init__(self, exit_flag, api_accessor, sparkline_span: float = 3600.0):
         self.api_accessor_proc: ApiAccessor = api_accessor
-        self.api_data: Dict = {}
+        self.api_data: Optional[MarketSnapshot] = None
         self.has_colors: bool = False
         self.colors: Dict = {}
         self.color_pairs: Dict = {}
@@ -30,11 +57,22 @@ class TUI:
         self.main_win = None
         self.status_win = None
         self.data_win = None
+        self.main_frame: Optional[Frame] = None
+        self.data_frame: Optional[Frame] = None
         self.width: int = 0
         self.height: int = 0
-        self.data_keys: List = []
-        self.top_data_index: int = 0
+        self.too_small: bool = False
+        self.table: RateTable = RateTable()
+        self.sparklines: SparklineStore = SparklineStore(sparkline_span, self.sparkline_buckets)
+        self.sparkline_levels: str = BLOCK_LEVELS
         self.exit_flag: Event = exit_flag
+
+        # Pipe written to when a snapshot is published or the terminal is resized, wakes up the UI waiting for a key
+        self._wakeup_pipe: Optional[Tuple[int, int]] = None
+        self._resize_pending: bool = False
+
+        # Snapshots published since the previous frame, added to the sparklines on the UI thread
+        self._pending: Deque[Snapshot] = deque()
         self._logger = logging.getLogger("TUI")
 
     def start(self) -> None:
@@ -54,29 +92,203 @@ class TUI:
         """
 
         self.stdscr = stdscr
-        self.init_tui()
 
-        self.main_win.attron(curses.color_pair(self.color_pairs["BlueOnBlack"]))
+        # Snapshots published while the sparklines are filled from the history are not missed
+        callback = self.api_accessor_proc.bus.subscribe(self._on_snapshot)
+        self.init_tui()
 
         key_pressed = -1
 
-        # Loop until user quits by pressing "q"
-        while key_pressed != ord('q'):
-            key_pressed = self.main_win.getch()
+        try:
+            # Loop until user quits by pressing "q"
+            while key_pressed != ord('q'):
+                key_pressed = self._next_key()
+                self.handle_key(key_pressed)
 
-            if key_pressed == curses.KEY_UP:
-                self.change_data("UP")
+                # Unchanged frames are not written at all, nothing is sent to the terminal while the data is idle
+                if self.display_data():
+                    self.refresh()
 
-            elif key_pressed == curses.KEY_DOWN:
-                self.change_data("DOWN")
+        finally:
+            self.api_accessor_proc.bus.unsubscribe(callback)
+            self._close_wakeup_pipe()
 
-            # Update data and refresh window
-            self.display_data()
-            self.main_win.refresh()
-
-        self.main_win.attroff(curses.color_pair(self.color_pairs["BlueOnBlack"]))
         curses.endwin()
 
+    def handle_key(self, key_pressed: int) -> None:
+        """
+        Move the selection, sort the table or resize the windows
+
+        :param key_pressed: Code of the pressed key, -1 if none
+        """
+
+        page = max(1, self._table_height())
+
+        if key_pressed == curses.KEY_RESIZE:
+            self.resize()
+
+        elif key_pressed == curses.KEY_UP:
+            self.table.move(-1)
+
+        elif key_pressed == curses.KEY_DOWN:
+            self.table.move(1)
+
+        elif key_pressed == curses.KEY_PPAGE:
+            self.table.move(-page)
+
+        elif key_pressed == curses.KEY_NPAGE:
+            self.table.move(page)
+
+        elif key_pressed == curses.KEY_HOME:
+            self.table.move(-len(self.table))
+
+        elif key_pressed == curses.KEY_END:
+            self.table.move(len(self.table))
+
+        # Number keys sort by the column with the same number, e.g. 4 sorts by change percent
+        elif ord("1") <= key_pressed < ord("1") + len(COLUMNS):
+            self.table.sort_by(key_pressed - ord("1"))
+
+    def resize(self) -> None:
+        """
+        Recreate the windows for the new size of the terminal
+        """
+
+        if os.name == "nt":
+            curses.resize_term(0, 0)
+
+        else:
+            lines, columns = os.get_terminal_size(sys.stdin.fileno())[::-1]
+
+            # Resizing queues another KEY_RESIZE, the size is then already up to date
+            if curses.is_term_resized(lines, columns):
+                curses.resizeterm(lines, columns)
+
+        if self.stdscr.getmaxyx() == (self.height, self.width):
+            return
+
+        self.height, self.width = self.stdscr.getmaxyx()
+        self._logger.info("Terminal resized to %dx%d", self.width, self.height)
+
+        # Contents of the terminal are unknown after a resize, everything is redrawn
+        self.stdscr.clear()
+        self.stdscr.noutrefresh()
+        self.init_windows()
+
+    def refresh(self) -> None:
+        """
+        Write the changed cells of every window to the terminal with a single update
+        """
+
+        if self.too_small:
+            return
+
+        self.main_win.noutrefresh()
+        self.status_win.noutrefresh()
+        self.data_win.noutrefresh()
+        curses.doupdate()
+
+    def _on_snapshot(self, snapshot: Snapshot) -> None:
+        """
+        Wake up the UI to draw the snapshot, called on the thread publishing it
+        """
+
+        self._pending.append(snapshot)
+        self._wake()
+
+    def _wake(self) -> None:
+        """
+        Wake up the UI waiting for a key
+        """
+
+        if self._wakeup_pipe is None:
+            return
+
+        try:
+            os.write(self._wakeup_pipe[1], b"\0")
+
+        # Pipe is full when the UI has not woken up yet, the pending wakeup is enough
+        except (BlockingIOError, OSError):
+            pass
+
+    def _next_key(self) -> int:
+        """
+        Wait until a key is pressed, a snapshot is published or the idle redraw interval passes
+
+        :return: Code of the pressed key or -1 if no key was pressed
+        """
+
+        if self._wakeup_pipe is None:
+            return self.main_win.getch()
+
+        if self._resize_pending:
+            self._resize_pending = False
+            return curses.KEY_RESIZE
+
+        # Keys already read from the terminal by curses are not seen by 'select'
+        key_pressed = self.main_win.getch()
+        if key_pressed != -1:
+            return key_pressed
+
+        wakeup_fd = self._wakeup_pipe[0]
+        ready, _, _ = select.select([sys.stdin.fileno(), wakeup_fd], [], [], self.idle_redraw_interval)
+
+        if wakeup_fd in ready:
+            try:
+                os.read(wakeup_fd, 4096)
+
+            except BlockingIOError:
+                pass
+
+        if self._resize_pending:
+            self._resize_pending = False
+            return curses.KEY_RESIZE
+
+        return self.main_win.getch()
+
+    def _on_resize_signal(self, signum, frame) -> None:
+        """
+        Wake up the UI when the terminal is resized, curses would notice the resize only on the next key press
+        """
+
+        self._resize_pending = True
+        self._wake()
+
+    def _open_wakeup_pipe(self) -> None:
+        """
+        Create the pipe snapshots and resizes wake up the UI with, without it the UI polls for keys and data
+        """
+
+        # Console input on Windows can not be waited with 'select'
+        if os.name == "nt":
+            return
+
+        read_fd, write_fd = os.pipe()
+        os.set_blocking(read_fd, False)
+        os.set_blocking(write_fd, False)
+        self._wakeup_pipe = (read_fd, write_fd)
+
+        # Signal handlers can only be set on the main thread, resizes are then noticed on the next wakeup
+        try:
+            signal.signal(signal.SIGWINCH, self._on_resize_signal)
+
+        except ValueError:
+            self._logger.warning("TUI is not running on the main thread, terminal resizes are noticed late")
+
+    def _close_wakeup_pipe(self) -> None:
+        if self._wakeup_pipe is None:
+            return
+
+        try:
+            signal.signal(signal.SIGWINCH, signal.SIG_DFL)
+
+        except ValueError:
+            pass
+
+        pipe, self._wakeup_pipe = self._wakeup_pipe, None
+        for fd in pipe:
+            os.close(fd)
+
     def init_tui(self):
         """
         Initialize the text ui
@@ -87,6 +299,12 @@ class TUI:
         self.has_colors = curses.has_colors()
         self.height, self.width = self.stdscr.getmaxyx()
 
+        # Block characters can only be drawn on terminals using Unicode
+        if self.stdscr.encoding.lower().replace("-", "") != "utf8":
+            self.sparkline_levels = ASCII_LEVELS
+
+        self.sparklines.warm(self.api_accessor_proc.history, time() - self.sparklines.span)
+
         # Remove cursor
         curses.curs_set(0)
 
@@ -95,6 +313,26 @@ class TUI:
 
         # Init screens
         self.init_colors()
+        self._open_wakeup_pipe()
+        self.init_windows()
+
+    def init_windows(self):
+        """
+        Create the windows for the current size of the terminal
+        """
+
+        self.too_small = self.height < self.min_height or self.width < self.min_width
+
+        if self.too_small:
+            msg = "Terminal is too small"
+            self.stdscr.addstr(self.height // 2, max(0, (self.width - len(msg)) // 2), msg[:self.width - 1])
+            self.stdscr.refresh()
+
+            # Keys are still read from the main window
+            self.main_win = self.stdscr
+            self._set_input_mode()
+            return
+
         self.init_main_win()
         self.init_statusbar()
         self.init_data_win()
@@ -159,16 +397,29 @@ class TUI:
         # Turn on wanted colors
         self.main_win.attron(curses.color_pair(self.color_pairs["BlueOnBlack"]))
 
-        self.main_win.keypad(True)
-
-        # Set input timeout to 250ms
-        self.main_win.timeout(250)
+        self._set_input_mode()
 
         self.main_win.border()
 
         # Turn off the set colors
         self.main_win.attroff(curses.color_pair(self.color_pairs["BlueOnBlack"]))
 
+        self.main_frame = Frame(self.main_win)
+
+    def _set_input_mode(self) -> None:
+        """
+        Read keys from the main window, 'getch' only reads the keys that are already available when keys are waited
+        with 'select'
+        """
+
+        self.main_win.keypad(True)
+
+        if self._wakeup_pipe is not None:
+            self.main_win.nodelay(True)
+
+        else:
+            self.main_win.timeout(self.poll_interval_ms)
+
     def init_statusbar(self):
         """
         Initialize a statusbar window inside the main window, holds navigation and quit commands etc
@@ -185,11 +436,11 @@ class TUI:
 
         prog = "Cryptalert V0.0.0 ALPHA"
         creator = "Emil Rekola <emil.rekola@hotmail.com>"
-        commands = "Q to quit | UP/DOWN to change data"
-        status_str = f"{prog} | {creator} | {commands}"
+        commands = f"Q to quit | UP/DOWN/PGUP/PGDN to scroll | 1-{len(COLUMNS)} to sort"
+        status_str = f"{prog} | {creator} | {commands}"[:self.width - 4]
 
         # Calculate center position for the string
-        center = round(self.width / 2) - round(len(status_str) / 2)
+        center = max(1, round(self.width / 2) - round(len(status_str) / 2))
         self.status_win.addstr(1, center, status_str)
 
         # Turn off the set colors
@@ -202,101 +453,120 @@ class TUI:
 
         self._logger.info("Initializing data window")
 
-        self.data_keys = list(self.api_accessor_proc.api_data.keys())
+        # Data window fills the rest of the main window, the table shows as many rows as fit in it
+        self.data_win = self.main_win.subwin(self.height - 9, self.width - 2, 8, 1)
 
-        # No data to display
-        if len(self.data_keys) == 0:
-            raise DataLengthException("No data to display")
-
-        # Set window size based on watched currencies
-        if len(self.data_keys) == 1:
-            self.data_win = self.main_win.subwin(7, self.width - 2, 8, 1)
-
-        elif len(self.data_keys) == 2:
-            self.data_win = self.main_win.subwin(13, self.width - 2, 8, 1)
-
-        else:
-            self.data_win = self.main_win.subwin(19, self.width - 2, 8, 1)
+        self.data_win.bkgd(curses.color_pair(self.color_pairs["BlueOnGray"]))
+        self.data_win.border()
+        self.data_frame = Frame(self.data_win)
 
         self.display_data()
+        self.refresh()
 
-        self.data_win.bkgd(curses.color_pair(1))
-
-    def display_data(self):
+    def display_data(self) -> int:
         """
         Display the given data on the TUI
+
+        :return: Number of fields that changed since the previous frame
         """
 
-        # Get data every time display data is called
+        # Get the latest snapshot once so that every field is drawn from the same data
         self.api_data = self.api_accessor_proc.api_data
 
-        self.main_win.attron(curses.color_pair(self.color_pairs["BlueOnBlack"]))
+        while self._pending:
+            snapshot = self._pending.popleft()
+            self.sparklines.update(snapshot.timestamp, snapshot.data)
 
-        if self.api_data["market"]["sign"]:
-            msg = f"Current market is rising! Current change is +{self.api_data['market']['changePercent']}%!"
+        if self.too_small:
+            return 0
+
+        main_attr = curses.color_pair(self.color_pairs["BlueOnBlack"])
+
+        if not self.api_data:
+            msg = "No data available, waiting for the API to respond..."
+
+        elif self.api_data.market.rising:
+            msg = f"Current market is rising! Current change is +{self.api_data.market.change_percent}%!"
 
         else:
-            msg = f"Current market is dropping! Current change is -{self.api_data['market']['changePercent']}%!"
+            msg = f"Current market is dropping! Current change is -{self.api_data.market.change_percent}%!"
 
-        self.main_win.addstr(5, 2, msg)
+        self.main_frame.add(5, 2, msg[:self.width - 4], main_attr)
 
-        self.main_win.attroff(curses.color_pair(self.color_pairs["BlueOnBlack"]))
+        # Notify about stale data when fetches keep failing
+        if self.api_accessor_proc.degraded:
+            failures = self.api_accessor_proc.consecutive_failures
+            self.main_frame.add(6, 2, f"Data fetching degraded, {failures} failed fetches in a row!", main_attr)
 
-        self.data_win.clear()
-        self.data_win.border()
+        # Latency of the fetches and the slowest stages of them, cut to fit the window
+        self.main_frame.add(7, 2, self.api_accessor_proc.metrics.status_line()[:self.width - 4], main_attr)
 
-        # Turn on wanted colors
-        self.data_win.attron(curses.color_pair(self.color_pairs["BlueOnGray"]))
+        changed = self.main_frame.commit()
 
-        if len(self.data_keys) == 1:
-            data_row = 1
-            self.data_win.addstr(data_row, 1, self.data_keys[0])
-            for key, val in self.api_data[self.data_keys[0]].items():
-                data_row += 1
-                self.data_win.addstr(data_row, 12, f"{key}: {val}")
+        if self.api_data:
+            self._add_table(curses.color_pair(self.color_pairs["BlueOnGray"]))
 
-        # Display the fetched data on the created data window
-        else:
-            end_index = 3
+        return changed + self.data_frame.commit()
 
-            if len(self.data_keys) == 2:
-                end_index = 2
+    def _table_height(self) -> int:
+        # Rows left for the currencies inside the border, below the header and above the indicator summary
+        return self.height - 13
 
-            separator = "-" * (self.width - 4)
+    def _add_table(self, attr: int) -> None:
+        """
+        Add the header, the visible rows of the table and the indicators of the selected currency to the next frame
+        of the data window, nothing is formatted for the rows that do not fit
 
-            data_row = 1
-            row_multiplier = 1
+        :param attr: Curses attributes of the table
+        """
 
-            for index in range(self.top_data_index, self.top_data_index + end_index):
-                self.data_win.addstr(data_row, 1, self.data_keys[index])
+        width = self.width - 4
 
-                for key, val in self.api_data[self.data_keys[index]].items():
-                    self.data_win.addstr(data_row + 1, 12, f"{key}: {val}")
-                    data_row += 1
+        self.table.update(self.api_accessor_proc.bus.version, self.api_data, self.api_accessor_proc.indicators)
+        header = self.table.header(width)
 
-                if index < self.top_data_index + end_index - 1:
-                    self.data_win.addstr(data_row + 1, 1, separator)
+        # Sparklines fill the width left over from the columns
+        sparkline_col = len(header) + 2
+        sparkline_width = width - sparkline_col
+        if sparkline_width >= self.min_sparkline_width:
+            header = f"{header.ljust(sparkline_col)}Last {self.sparklines.span / 60:g} min"
 
-                data_row = row_multiplier * 6 + 1
-                row_multiplier += 1
+        self.data_frame.add(1, 1, header[:width].ljust(width), attr | curses.A_BOLD)
 
-        # Turn off the set colors
-        self.data_win.attroff(curses.color_pair(self.color_pairs["BlueOnGray"]))
+        for index, (row, selected) in enumerate(self.table.visible(self._table_height())):
+            text = self.table.format_row(row, width)
+
+            # Sparkline is drawn from its cached buckets, unchanged sparklines are not drawn again
+            if sparkline_width >= self.min_sparkline_width:
+                sparkline = self.sparklines.render(row[0], sparkline_width, self.sparkline_levels)
+                text = text.ljust(sparkline_col) + sparkline.rjust(min(sparkline_width, self.sparkline_buckets))
+
+            row_attr = attr | curses.A_REVERSE if selected else attr
+            self.data_frame.add(index + 2, 1, text.ljust(width), row_attr)
 
-    def change_data(self, direction: str):
+        currency = self.table.selected_currency
+        if currency is not None:
+            self.data_frame.add(self.height - 11, 1, f"{currency:<10} {self._indicator_summary(currency)}", attr)
+
+    def _indicator_summary(self, currency: str) -> str:
         """
-        Move data in the data window up or down
+        Create a one line summary of the rolling indicators of the longest window
 
-        :param direction: Tell if data should be moved up or down
+        :param currency: Currency code
+        :return: Summary that fits the data window, empty if there are no indicators
         """
 
-        if direction == "UP" and self.top_data_index >= 1:
-            self.top_data_index -= 1
-            self.display_data()
+        indicators = self.api_accessor_proc.indicators.get(currency)
+
+        if not indicators:
+            return ""
+
+        window = max(indicators)
+        ind = indicators[window]
+        summary = (f"{window} samples: SMA {ind.sma:.2f}  EMA {ind.ema:.2f}  "
+                   f"Std {ind.std:.2f}  Min {ind.minimum:.2f}  Max {ind.maximum:.2f}")
 
-        elif direction == "DOWN" and self.top_data_index + 3 < len(self.data_keys):
-            self.top_data_index += 1
-            self.display_data()
+        return summary[:self.width - 15]
 
     @staticmethod
     def _rgb_2_curses_color(r, g, b) -> Tuple[int, int, int]:
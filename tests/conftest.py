@@ -0,0 +1,29 @@
+"""
+Shared fixtures of the tests
+
+Emil Rekola <emil.rekola@hotmail.com>
+"""
+
+# STD imports
+import sys
+from typing import Callable
+
+# 3rd-party imports
+import pytest
+from configargparse import Namespace
+
+# Local imports
+from cryptalert.config import Config
+
+
+@pytest.fixture
+def make_args(monkeypatch) -> Callable[..., Namespace]:
+    """
+    Parse the configuration from the given command line arguments on top of the defaults of config.ini
+    """
+
+    def make(*argv: str) -> Namespace:
+        monkeypatch.setattr(sys, "argv", ["cryptalert", "--headless", *argv])
+        return Config().get_args()
+
+    return make
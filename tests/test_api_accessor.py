@@ -0,0 +1,205 @@
+"""
+Tests for fetching and merging the rate sources against a local stub server
+
+Emil Rekola <emil.rekola@hotmail.com>
+"""
+
+# STD imports
+import json
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Event, Thread
+from time import monotonic, sleep
+from concurrent.futures import Future
+
+# 3rd-party imports
+import pytest
+
+# Local imports
+from cryptalert.data_fetcher.api_accessor import ApiAccessor
+
+COINMOTION = json.dumps({
+    "success": True,
+    "payload": {
+        "btcEur": {"currencyCode": "BTC", "buy": "100.0", "sell": "110.0", "fchangep": "1.0", "fhigh": "120.0"},
+        "ethEur": {"currencyCode": "ETH", "buy": "10.0", "sell": "11.0", "fchangep": "2.0", "fhigh": "12.0"},
+        "market": {"changeAmount": 1.5, "changeSign": "+"}
+    }
+}).encode()
+
+KRAKEN = json.dumps({
+    "error": [],
+    "result": {
+        "XXBTZEUR": {"a": ["109.0"], "b": ["101.0"], "o": "100.0", "c": ["105.0"], "h": ["110.0", "115.0"]},
+        "ETHEUR": {"a": ["12.0"], "b": ["9.0"], "o": "10.0", "c": ["10.0"], "h": ["12.0", "13.0"]}
+    }
+}).encode()
+
+# Seconds the slow endpoint waits before responding, longer than the deadline used in the tests
+SLOW = 1.0
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Serve the sources by path, '/slow/...' responds late and '/loop' redirects to itself
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+
+        if path == "/loop":
+            self.send_response(302)
+            self.send_header("Location", "/loop")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        if path.startswith("/slow"):
+            sleep(SLOW)
+            path = path[len("/slow"):]
+
+        body = COINMOTION if path == "/coinmotion" else KRAKEN
+
+        # Client has given up on a slow response by the time it is written
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def stub():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, daemon=True).start()
+
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def make_accessor(make_args):
+    accessors = []
+
+    def make(coinmotion: str, kraken: str, *argv: str) -> ApiAccessor:
+        args = make_args("-x", "btc", "eth", "--sources", "coinmotion", "kraken", "--api-address", coinmotion,
+                         "--kraken-address", kraken, *argv)
+        accessors.append(ApiAccessor(args, Event()))
+        return accessors[-1]
+
+    yield make
+
+    for accessor in accessors:
+        accessor._executor.shutdown(wait=False)
+        accessor._session.close()
+
+
+def test_sources_are_merged_to_the_best_rates(stub, make_accessor):
+    accessor = make_accessor(f"{stub}/coinmotion", f"{stub}/kraken")
+
+    assert accessor.fetch_data()
+
+    # Coinmotion quotes from its own perspective, its buy is the sell of the user
+    data = accessor.api_data
+    assert data.quotes["BTC"] == (109.0, "kraken", 101.0, "kraken")
+    assert data.quotes["ETH"] == (11.0, "coinmotion", 10.0, "coinmotion")
+    assert data.market.change_percent == 1.5
+
+
+def test_source_missing_its_deadline_is_left_out(stub, make_accessor):
+    accessor = make_accessor(f"{stub}/coinmotion", f"{stub}/slow/kraken", "--source-deadline", "5", "0.2")
+
+    started = monotonic()
+    assert accessor.fetch_data()
+    assert monotonic() - started < SLOW
+
+    assert {quote.sell_source for quote in accessor.api_data.quotes.values()} == {"coinmotion"}
+    assert accessor.metrics.error_counts()[("kraken", "DeadlineExceeded")] == 1
+
+
+def test_source_skipped_while_its_previous_fetch_runs_is_not_charged(stub, make_accessor, monkeypatch):
+    accessor = make_accessor(f"{stub}/coinmotion", f"{stub}/kraken")
+    charged = []
+    monkeypatch.setattr(accessor.scheduler, "record_poll", charged.append)
+
+    accessor.fetch_data()
+
+    # Previous fetch of kraken has not finished
+    accessor._pending["kraken"] = Future()
+    accessor.fetch_data()
+
+    assert charged == [2, 1]
+
+
+def test_request_error_of_a_source_does_not_stop_the_fetcher(stub, make_accessor):
+    accessor = make_accessor(f"{stub}/coinmotion", f"{stub}/loop")
+
+    assert accessor.fetch_data()
+    assert accessor.metrics.error_counts()[("kraken", "TooManyRedirects")] == 1
+
+    # Failing source on the calling thread
+    accessor.sources = accessor.sources[1:]
+    assert not accessor.fetch_data()
+    assert accessor.consecutive_failures == 1
+
+
+def test_unexpected_parse_error_of_a_source_does_not_stop_the_fetcher(stub, make_accessor, monkeypatch):
+    accessor = make_accessor(f"{stub}/coinmotion", f"{stub}/kraken")
+
+    def broken_parse(response):
+        raise ValueError("unexpected response")
+
+    monkeypatch.setattr(accessor.sources[1], "parse", broken_parse)
+
+    assert accessor.fetch_data()
+    assert {quote.sell_source for quote in accessor.api_data.quotes.values()} == {"coinmotion"}
+    assert accessor.metrics.error_counts()[("kraken", "ValueError")] == 1
+
+
+def test_async_fetcher_writes_the_history_file_off_the_event_loop(stub, make_args, tmp_path):
+    from cryptalert.data_fetcher.async_api_accessor import AsyncApiAccessor
+
+    args = make_args("-x", "btc", "--sources", "coinmotion", "--api-address", f"{stub}/coinmotion",
+                     "--history-file", str(tmp_path / "history.bin"), "--min-interval", "0.05",
+                     "--max-interval", "0.05")
+    stop_flag = Event()
+    accessor = AsyncApiAccessor(args, stop_flag)
+    accessor.history_file.batch_size = 2
+    assert accessor._executor is None
+
+    flush_threads = []
+    flush = accessor.history_file.flush
+
+    def record_flush():
+        flush_threads.append(threading.current_thread())
+        flush()
+
+    accessor.history_file.flush = record_flush
+
+    async def scenario():
+        task = asyncio.ensure_future(accessor.start())
+
+        while accessor.successful_fetches < 3:
+            await asyncio.sleep(0.01)
+
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(scenario())
+
+    assert accessor.stopped.is_set()
+    assert flush_threads and threading.main_thread() not in flush_threads
+    assert len(accessor.history_file) >= accessor.successful_fetches * 2
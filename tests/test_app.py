@@ -0,0 +1,39 @@
+"""
+Tests for checking the configuration of the application
+
+Emil Rekola <emil.rekola@hotmail.com>
+"""
+
+# STD imports
+import sys
+
+# 3rd-party imports
+import pytest
+
+# Local imports
+from cryptalert.app import Application
+from cryptalert.exceptions import UnsupportedOperationModeException
+
+
+def make_application(monkeypatch, *argv: str) -> Application:
+    monkeypatch.setattr(sys, "argv", ["cryptalert", "--headless", *argv])
+    return Application()
+
+
+@pytest.mark.parametrize("argv", [("--channel-send-rate", "0"), ("--global-send-rate", "-1")])
+def test_send_rates_must_be_above_zero(monkeypatch, argv):
+    with pytest.raises(UnsupportedOperationModeException):
+        make_application(monkeypatch, *argv).check_config()
+
+
+@pytest.mark.parametrize("interval", ["0", "-10"])
+def test_update_interval_must_be_above_zero(monkeypatch, interval):
+    with pytest.raises(UnsupportedOperationModeException):
+        make_application(monkeypatch, "--update-interval", interval).check_config()
+
+
+def test_check_config_does_not_create_the_data_fetcher(monkeypatch):
+    app = make_application(monkeypatch)
+    app.check_config()
+
+    assert app.api_accessor is None
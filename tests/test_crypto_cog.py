@@ -0,0 +1,30 @@
+"""
+Tests for the messages of the crypto cog
+
+Emil Rekola <emil.rekola@hotmail.com>
+"""
+
+# STD imports
+from types import MappingProxyType, SimpleNamespace
+
+# Local imports
+from cryptalert.data_fetcher.history import HistoryStore
+from cryptalert.data_fetcher.rates import MarketSnapshot, MarketStatus, RateSnapshot
+from cryptalert.discord_bot.cogs.crypto import Crypto
+
+
+def make_cog(history: HistoryStore, snapshot: MarketSnapshot) -> Crypto:
+    cog = Crypto.__new__(Crypto)
+    cog.bot = SimpleNamespace(api_accessor=SimpleNamespace(api_data=snapshot, history=history, consecutive_failures=0))
+    return cog
+
+
+def test_market_status_before_the_first_sample_is_in_the_history():
+    snapshot = MarketSnapshot(MappingProxyType({"BTC": RateSnapshot(100.0, 99.0, 1.0, 101.0)}), MarketStatus(2.5, True))
+    history = HistoryStore(10)
+    cog = make_cog(history, snapshot)
+
+    assert cog.get_market_status() == "Current market is positive!\nCurrent change is 2.5%!"
+
+    history.append(1.0, snapshot)
+    assert cog.get_market_status().startswith("Current market is positive")
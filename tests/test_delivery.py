@@ -0,0 +1,77 @@
+"""
+Tests for the outbound message queues of the Discord bot
+
+Emil Rekola <emil.rekola@hotmail.com>
+"""
+
+# STD imports
+import asyncio
+from time import monotonic
+from types import SimpleNamespace
+
+# Local imports
+from cryptalert.discord_bot.delivery import DeliveryQueue
+
+
+async def ignore(channel, payloads):
+    pass
+
+
+def test_idle_channel_buckets_are_evicted():
+    queue = DeliveryQueue(ignore, 1.0, 1000.0, 3)
+    queue.bucket_evict_threshold = queue._evict_at = 4
+    now = monotonic()
+
+    for channel_id in range(10):
+        queue.enqueue(SimpleNamespace(id=channel_id), "message")
+
+    while queue._next(now)[0] is not None:
+        pass
+
+    # Buckets that just sent are not full yet so none were evicted, the limit has doubled with the buckets in use
+    assert len(queue._buckets) == 10
+    assert queue._evict_at == 16
+
+    # Once refilled, the channel that drains when the limit is reached evicts the idle buckets
+    later = now + queue.channel_burst / queue.channel_rate
+
+    for channel_id in range(10, 16):
+        queue.enqueue(SimpleNamespace(id=channel_id), "message")
+
+    while queue._next(later)[0] is not None:
+        pass
+
+    assert sorted(queue._buckets) == list(range(10, 16))
+    assert queue._evict_at == 12
+
+
+def test_buckets_of_waiting_channels_are_kept():
+    queue = DeliveryQueue(ignore, 1.0, 1000.0, 3)
+    queue.bucket_evict_threshold = queue._evict_at = 2
+    now = monotonic()
+
+    for channel_id in range(3):
+        queue.enqueue(SimpleNamespace(id=channel_id), "first")
+        queue.enqueue(SimpleNamespace(id=channel_id), "second")
+
+    sent = [queue._next(now)[0].channel.id for _ in range(4)]
+
+    assert sent == [0, 1, 2, 0]
+    assert set(queue._buckets) == {0, 1, 2}
+
+
+def test_message_to_a_channel_the_bot_cannot_send_to_is_dropped_without_retrying():
+    import discord
+    from cryptalert.discord_bot.bot import CryptalertBot
+
+    async def forbidden(*args, **kwargs):
+        raise discord.Forbidden(SimpleNamespace(status=403, reason="Forbidden"), "Missing Access")
+
+    async def send(channel, payloads):
+        await CryptalertBot._send_delivery(None, channel, payloads)
+
+    queue = DeliveryQueue(send, 1.0, 1000.0, 3)
+    queue.enqueue(SimpleNamespace(id=1, send=forbidden), "message")
+    asyncio.run(queue._deliver(queue._next(monotonic())[0]))
+
+    assert (queue.sent, queue.retried, queue.dropped, queue.depth) == (0, 0, 1, 0)
@@ -0,0 +1,31 @@
+"""
+Tests for the history file
+
+Emil Rekola <emil.rekola@hotmail.com>
+"""
+
+# Local imports
+from cryptalert.data_fetcher.history_file import HistoryFile
+from cryptalert.data_fetcher.rates import MarketSnapshot, MarketStatus, RateSnapshot
+
+
+def test_value_at_finds_a_currency_missing_from_the_latest_fetches(tmp_path):
+    history_file = HistoryFile(tmp_path / "history.bin")
+    currencies = [f"C{num}" for num in range(10)]
+
+    for fetch in range(500):
+        rates = {currency: RateSnapshot(float(fetch), float(fetch), 0.0, float(fetch)) for currency in currencies}
+
+        # BTC was only fetched at the start, thousands of records before the looked up time
+        if fetch < 3:
+            rates["BTC"] = RateSnapshot(100.0 + fetch, 0.0, 0.0, 0.0)
+
+        history_file.append(float(fetch), MarketSnapshot(rates, MarketStatus(0.0, True)))
+
+    history_file.flush()
+
+    assert history_file.value_at("BTC", "buy", 450.0) == 102.0
+    assert history_file.value_at("BTC", "buy", 1.5) == 101.0
+    assert history_file.value_at("C3", "buy", 450.0) == 450.0
+    assert history_file.value_at("ETH", "buy", 450.0) is None
+    history_file.close()
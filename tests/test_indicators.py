@@ -0,0 +1,121 @@
+"""
+Tests for the rolling indicators
+
+Emil Rekola <emil.rekola@hotmail.com>
+"""
+
+# STD imports
+import math
+import random
+from threading import Thread
+
+# 3rd-party imports
+import pytest
+
+# Local imports
+from cryptalert.data_fetcher import indicators
+from cryptalert.data_fetcher.history import HistoryStore
+from cryptalert.data_fetcher.indicators import IndicatorEngine, RollingWindow
+from cryptalert.data_fetcher.rates import MarketSnapshot
+
+WINDOWS = [1, 6, 20, 200]
+
+
+def make_history(samples: int, capacity: int, nan_every: int = 0) -> HistoryStore:
+    history = HistoryStore(capacity)
+    rng = random.Random(samples)
+
+    for sample in range(samples):
+        for currency in ("BTC", "ETH"):
+            buy = math.nan if nan_every and sample % nan_every == 0 else rng.uniform(100, 200)
+            history.append_sample(currency, float(sample), buy, buy, 0.0, buy)
+
+    return history
+
+
+def assert_same(engine: IndicatorEngine, expected: IndicatorEngine, currencies) -> None:
+    for currency in currencies:
+        result, reference = engine.get(currency), expected.get(currency)
+        assert result.keys() == reference.keys()
+
+        for window in reference:
+            assert result[window] == pytest.approx(reference[window], rel=1e-9, abs=1e-9)
+
+
+@pytest.mark.parametrize("samples, capacity, nan_every", [(150, 100, 0), (150, 1000, 0), (5, 1000, 0), (150, 100, 7)])
+def test_batch_warm_matches_adding_samples(monkeypatch, samples, capacity, nan_every):
+    pytest.importorskip("numpy")
+    history = make_history(samples, capacity, nan_every)
+    currencies = ["BTC", "ETH", "XRP"]
+
+    batch = IndicatorEngine(WINDOWS)
+    batch.warm(history, currencies)
+
+    monkeypatch.setattr(indicators, "_numpy", lambda: None)
+    one_by_one = IndicatorEngine(WINDOWS)
+    one_by_one.warm(history, currencies)
+
+    assert_same(batch, one_by_one, currencies)
+    assert batch.get("XRP") == {}
+
+    # Windows keep updating exactly as if the samples had been added one by one
+    for value in (150.0, 90.0, 250.0, 150.0):
+        for engine in (batch, one_by_one):
+            engine._update_currency("BTC", value)
+
+    assert_same(batch, one_by_one, ["BTC"])
+
+
+def test_warm_matches_a_live_engine_when_the_history_holds_the_longest_window():
+    history = make_history(300, 1000)
+    live = IndicatorEngine([6, 20, 60])
+
+    for currency in ("BTC", "ETH"):
+        for segment in history.get(currency).window("buy"):
+            for value in segment:
+                live._update_currency(currency, value)
+
+    warmed = IndicatorEngine([6, 20, 60])
+    warmed.warm(history, ["BTC", "ETH"])
+
+    for currency in ("BTC", "ETH"):
+        for window, result in warmed.get(currency).items():
+            reference = live.get(currency)[window]
+            assert (result.sma, result.std, result.minimum, result.maximum) == pytest.approx(
+                (reference.sma, reference.std, reference.minimum, reference.maximum), rel=1e-9
+            )
+
+
+def test_rolling_window_min_max_slide_out():
+    window = RollingWindow(3)
+
+    for value in (5.0, 1.0, 4.0, 3.0, 2.0):
+        window.update(value)
+
+    result = window.indicators()
+    assert (result.minimum, result.maximum, result.sma) == (2.0, 4.0, 3.0)
+
+
+def test_indicators_stay_consistent_while_the_fetch_thread_updates():
+    engine = IndicatorEngine([3, 50])
+    rng = random.Random(0)
+    snapshots = [MarketSnapshot({"BTC": {"buy": rng.uniform(100, 200)}}, None) for _ in range(20000)]
+    errors = []
+
+    def fetch():
+        for snapshot in snapshots:
+            engine.update(snapshot)
+
+    thread = Thread(target=fetch)
+    thread.start()
+
+    while thread.is_alive():
+        try:
+            for result in engine.get("BTC").values():
+                assert result.minimum <= result.maximum
+
+        except (AssertionError, IndexError) as error:
+            errors.append(error)
+
+    thread.join()
+    assert not errors
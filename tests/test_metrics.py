@@ -0,0 +1,25 @@
+"""
+Tests for the fetch latency histogram
+
+Emil Rekola <emil.rekola@hotmail.com>
+"""
+
+# 3rd-party imports
+import pytest
+
+# Local imports
+from cryptalert.data_fetcher.metrics import HdrHistogram
+
+
+def test_values_over_the_range_are_counted_to_the_last_bucket():
+    histogram = HdrHistogram()
+    largest = (1 << histogram.max_bits) - 1
+
+    assert histogram._index(largest) == len(histogram.counts) - 1
+
+    histogram.observe(0.5)
+    histogram.observe(7200.0)
+
+    assert histogram.counts[-1] == 1
+    assert histogram.quantile(0.5) == pytest.approx(0.5, rel=1 / 16)
+    assert histogram.quantile(1.0) == 7200.0
@@ -0,0 +1,35 @@
+"""
+Tests for the cache of rendered messages
+
+Emil Rekola <emil.rekola@hotmail.com>
+"""
+
+# Local imports
+from cryptalert.discord_bot.render_cache import RenderCache
+
+
+def test_renders_are_reused_until_the_key_changes():
+    cache = RenderCache()
+    renders = []
+
+    def render(text):
+        def create():
+            renders.append(text)
+            return f"rendered {text}"
+
+        return create
+
+    assert cache.get(1, "info", render("info")) == "rendered info"
+    assert cache.get(1, "info", render("not rendered")) == "rendered info"
+    assert cache.get(1, ("alerts", "btc"), render("alerts")) == "rendered alerts"
+    assert (cache.hits, cache.misses) == (1, 2)
+
+    # New data drops every render of the previous data
+    assert cache.get(2, "info", render("new info")) == "rendered new info"
+    assert cache.get(2, ("alerts", "btc"), render("new alerts")) == "rendered new alerts"
+    assert renders == ["info", "alerts", "new info", "new alerts"]
+    assert (cache.hits, cache.misses) == (1, 4)
+
+    # Going back to an older key renders again, only the renders of one key are kept
+    assert cache.get(1, "info", render("old info")) == "rendered old info"
+    assert cache.misses == 5
@@ -0,0 +1,36 @@
+"""
+Tests for the alert rule engine
+
+Emil Rekola <emil.rekola@hotmail.com>
+"""
+
+# 3rd-party imports
+import pytest
+from discord.ext import commands
+
+# Local imports
+from cryptalert.alerts.rule_engine import AlertEngine
+from cryptalert.data_fetcher.history import HistoryStore
+from cryptalert.discord_bot.cogs.alerts import Alerts
+
+
+def test_rule_is_removed_only_by_its_channel():
+    engine = AlertEngine(HistoryStore(10))
+    rule = engine.add_threshold_rule(1, "BTC", "buy", True, 30000.0)
+    change = engine.add_change_rule(1, "ETH", "buy", 5.0, 30.0)
+
+    assert engine.remove_rule(rule.rule_id, 2) is None
+    assert engine.remove_rule(change.rule_id, 2) is None
+    assert engine.rules_for_channel(1) == [rule, change]
+
+    assert engine.remove_rule(rule.rule_id, 1) == rule
+    assert engine.remove_rule(rule.rule_id, 1) is None
+    assert engine.remove_rule(change.rule_id, 1) == change
+    assert len(engine) == 0
+
+
+def test_unknown_currency_is_rejected():
+    assert Alerts._parse_currency("btc") == "BTC"
+
+    with pytest.raises(commands.BadArgument):
+        Alerts._parse_currency("notacoin")
@@ -0,0 +1,60 @@
+"""
+Tests for the update schedules of the Discord bot
+
+Emil Rekola <emil.rekola@hotmail.com>
+"""
+
+# STD imports
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+# 3rd-party imports
+import pytest
+
+# Local imports
+from cryptalert.discord_bot.schedule import Schedule
+from cryptalert.quiet_hours import QuietHours
+
+UTC = ZoneInfo("UTC")
+HELSINKI = ZoneInfo("Europe/Helsinki")
+
+
+def at(timezone, *fields: int) -> float:
+    return datetime(*fields, tzinfo=timezone).timestamp()
+
+
+@pytest.mark.parametrize("after, expected", [
+    (at(UTC, 2026, 3, 10, 12, 3), at(UTC, 2026, 3, 10, 12, 10)),
+    (at(UTC, 2026, 3, 10, 22, 55), at(UTC, 2026, 3, 11, 7)),
+    (at(UTC, 2026, 3, 11, 3), at(UTC, 2026, 3, 11, 7)),
+])
+def test_ticks_skip_the_quiet_hours(after, expected):
+    assert Schedule(10, QuietHours(23, 7), UTC).next_run(after) == expected
+
+
+@pytest.mark.parametrize("schedule, after, expected", [
+    # Clocks jump from 03:00 to 04:00
+    (Schedule(60, QuietHours(1, 5), HELSINKI), at(HELSINKI, 2026, 3, 29, 0, 30), at(HELSINKI, 2026, 3, 29, 5)),
+    (Schedule(60, None, HELSINKI), at(HELSINKI, 2026, 3, 29, 2, 30), at(HELSINKI, 2026, 3, 29, 4)),
+    # Clocks turn back from 04:00 to 03:00
+    (Schedule(30, QuietHours(23, 7), HELSINKI), at(HELSINKI, 2026, 10, 24, 22, 45), at(HELSINKI, 2026, 10, 25, 7)),
+])
+def test_ticks_follow_daylight_saving_time(schedule, after, expected):
+    assert schedule.next_run(after) == expected
+
+
+def test_tick_after_the_quiet_hours_within_them_again_is_skipped():
+    # 10 hour ticks hit the only hour outside the quiet hours once every five days
+    schedule = Schedule(600, QuietHours(9, 8), UTC)
+    after = at(UTC, 2026, 3, 10)
+    tick = schedule.next_run(after)
+
+    assert datetime.fromtimestamp(tick, UTC).hour == 8
+    assert tick == next(t for t in range(int(after) // 36000 * 36000 + 36000, int(after) + 6 * 86400, 36000)
+                        if t % 86400 == 8 * 3600)
+
+
+def test_quiet_hours_are_ignored_when_no_tick_is_outside_them():
+    # 2 hour ticks are always at even hours and only 07-08 is outside the quiet hours
+    after = at(UTC, 2026, 3, 10, 12, 30)
+    assert Schedule(120, QuietHours(8, 7), UTC).next_run(after) == at(UTC, 2026, 3, 10, 14)
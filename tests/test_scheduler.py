@@ -0,0 +1,28 @@
+"""
+Tests for the adaptive polling interval and the request budget
+
+Emil Rekola <emil.rekola@hotmail.com>
+"""
+
+# 3rd-party imports
+import pytest
+
+# Local imports
+from cryptalert.data_fetcher.scheduler import PollScheduler
+
+
+@pytest.mark.parametrize("sources", [1, 2, 3])
+def test_budget_is_charged_for_every_source(sources):
+    # 360 requests per hour, a burst of 30 requests
+    scheduler = PollScheduler(1.0, 1.0, 1.0, 360)
+
+    polls = 0
+    while (delay := scheduler.next_delay()) == 1.0:
+        scheduler.record_poll(sources)
+        polls += 1
+
+    assert polls == -(-30 // sources)
+
+    # Requests over the burst are paid back before the next poll, one request every 10 seconds
+    assert delay == pytest.approx((1 + polls * sources - 30) * 10, rel=0.01)
+    assert scheduler.throttled == 1
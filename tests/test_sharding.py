@@ -0,0 +1,206 @@
+"""
+Tests for running the Discord bot sharded against a fake gateway, channels and guilds are stand-ins that only carry
+the attributes the bot reads
+
+Emil Rekola <emil.rekola@hotmail.com>
+"""
+
+# STD imports
+import asyncio
+from threading import Event
+from types import SimpleNamespace
+from typing import List, Optional
+
+# 3rd-party imports
+import pytest
+
+# Local imports
+from cryptalert.data_fetcher.api_accessor import ApiAccessor
+from cryptalert.discord_bot.cogs.utils import Utilities
+from cryptalert.discord_bot.delivery import DeliveryMetrics, ShardedDelivery
+
+
+def channel(channel_id: int, shard_id: Optional[int]) -> SimpleNamespace:
+    """
+    Channel of a guild on the given shard, a DM channel without a guild if the shard is None
+    """
+
+    guild = SimpleNamespace(id=channel_id * 10, shard_id=shard_id) if shard_id is not None else None
+    return SimpleNamespace(id=channel_id, guild=guild)
+
+
+class FakeGateway:
+    """
+    Records the sends of the bot, sends to the given channels fail or block until released
+    """
+
+    def __init__(self):
+        self.sent: List = []
+        self.failing: set = set()
+        self.release: Optional[asyncio.Event] = None
+
+    async def send(self, target, payloads: List) -> None:
+        if self.release is not None:
+            await self.release.wait()
+
+        if target.id in self.failing:
+            raise ConnectionError("gateway closed")
+
+        self.sent.append((target.guild.shard_id if target.guild is not None else None, target.id, list(payloads)))
+
+
+async def run_until_drained(delivery: ShardedDelivery, timeout: float = 1.0) -> bool:
+    task = asyncio.ensure_future(delivery.run())
+
+    try:
+        return await delivery.drain(timeout)
+
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+def test_channels_are_routed_to_the_queue_of_their_shard():
+    gateway = FakeGateway()
+    delivery = ShardedDelivery(gateway.send, 100.0, 100.0, 3)
+
+    assert delivery.shard_of(channel(1, 2)) == 2
+    assert delivery.shard_of(channel(2, None)) == 0
+
+    for channel_id, shard_id in enumerate([0, 1, 2, 1, None]):
+        delivery.enqueue(channel(channel_id, shard_id), f"message {channel_id}")
+
+    assert sorted(delivery.queues) == [0, 1, 2]
+    assert {shard_id: queue.depth for shard_id, queue in delivery.queues.items()} == {0: 2, 1: 2, 2: 1}
+
+    assert asyncio.run(run_until_drained(delivery))
+    assert sorted(channel_id for _, channel_id, _ in gateway.sent) == [0, 1, 2, 3, 4]
+
+    # Every shard sent only to its own guilds, DMs went through shard 0
+    assert {shard_id: metrics.sent for shard_id, metrics in delivery.shard_metrics().items()} == {0: 2, 1: 2, 2: 1}
+
+
+def test_queues_are_created_lazily_and_share_the_global_bucket():
+    gateway = FakeGateway()
+
+    # Global burst of two messages, refilled far slower than the test runs
+    delivery = ShardedDelivery(gateway.send, 100.0, 0.01, 3)
+    delivery._global.capacity = delivery._global._tokens = 2
+
+    async def scenario():
+        task = asyncio.ensure_future(delivery.run())
+        delivery.enqueue(channel(1, 0), "first")
+
+        # Shard seen after the queues were started gets its own running queue
+        delivery.enqueue(channel(2, 3), "second")
+        delivery.enqueue(channel(3, 3), "third")
+        await asyncio.sleep(0.1)
+
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(scenario())
+
+    assert sorted(delivery.queues) == [0, 3]
+    assert all(queue._global is delivery._global for queue in delivery.queues.values())
+    assert len(gateway.sent) == 2
+    assert delivery.depth == 1
+
+
+def test_drain_waits_for_every_shard():
+    gateway = FakeGateway()
+    delivery = ShardedDelivery(gateway.send, 100.0, 100.0, 3)
+
+    async def scenario():
+        gateway.release = asyncio.Event()
+        task = asyncio.ensure_future(delivery.run())
+        delivery.enqueue(channel(1, 0), "first")
+        delivery.enqueue(channel(2, 1), "second")
+
+        # Sends of both shards are in flight
+        assert not await delivery.drain(0.05)
+
+        gateway.release.set()
+        drained = await delivery.drain(1.0)
+
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return drained
+
+    assert asyncio.run(scenario())
+    assert len(gateway.sent) == 2
+    assert asyncio.run(delivery.drain(0.0))
+
+
+def test_metrics_per_shard_and_combined():
+    gateway = FakeGateway()
+    gateway.failing = {2}
+    delivery = ShardedDelivery(gateway.send, 100.0, 100.0, 1)
+
+    for channel_id, shard_id in [(1, 0), (1, 0), (2, 1), (3, 1)]:
+        delivery.enqueue(channel(channel_id, shard_id), "alert", coalesce=True)
+
+    assert asyncio.run(run_until_drained(delivery))
+
+    shards = delivery.shard_metrics()
+    assert list(shards) == [0, 1]
+    assert (shards[0].sent, shards[0].coalesced, shards[0].dropped) == (2, 1, 0)
+    assert (shards[1].sent, shards[1].coalesced, shards[1].dropped) == (1, 0, 1)
+
+    total = delivery.metrics()
+    assert isinstance(total, DeliveryMetrics)
+    assert (total.depth, total.sent, total.coalesced, total.dropped) == (0, 3, 1, 1)
+    assert total.p99 >= max(shard.p99 for shard in shards.values()) > 0
+
+
+def test_shards_command_reports_every_shard():
+    gateway = FakeGateway()
+    delivery = ShardedDelivery(gateway.send, 100.0, 100.0, 3)
+    delivery.enqueue(channel(1, 1), "waiting")
+
+    replies = []
+    bot = SimpleNamespace(
+        shard_count=2, latencies=[(0, 0.05), (1, 0.12)], delivery=delivery,
+        guilds=[SimpleNamespace(shard_id=0), SimpleNamespace(shard_id=1), SimpleNamespace(shard_id=1)]
+    )
+    cog = Utilities.__new__(Utilities)
+    cog.bot = bot
+    cog.reply = lambda ctx, payload: replies.append(payload)
+
+    asyncio.run(Utilities.shards.callback(cog, None))
+
+    lines = replies[0].splitlines()
+    assert lines[0] == "Shards: 2/2"
+    assert lines[1] == "Shard 0: latency 50 ms  Guilds: 1"
+    assert lines[2] == "Shard 1: latency 120 ms  Guilds: 2"
+    assert lines[3].strip().startswith("Delivery queue: 1 waiting")
+
+
+def test_bot_loads_extensions_only_on_the_first_ready(make_args):
+    from cryptalert.discord_bot.bot import CryptalertBot
+
+    args = make_args("--shard-count", "2", "--shard-ids", "1", "-b", "token", "--enable-discord-bot")
+    api_accessor = ApiAccessor(args, Event())
+
+    async def scenario():
+        bot = CryptalertBot(args, api_accessor)
+        assert (bot.shard_count, bot.shard_ids) == (2, [1])
+
+        await bot.on_ready()
+        cogs = set(bot.cogs)
+
+        # Reconnect to the gateway fires the event again
+        await bot.on_ready()
+        assert set(bot.cogs) == cogs == {"Crypto", "Alerts", "Utilities"}
+
+        for extension in CryptalertBot.extensions:
+            bot.unload_extension(f"cryptalert.discord_bot.cogs.{extension}")
+
+        await bot.close(True)
+
+    try:
+        asyncio.run(scenario())
+
+    finally:
+        api_accessor._executor.shutdown(wait=False)
+        api_accessor._session.close()
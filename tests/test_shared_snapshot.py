@@ -0,0 +1,119 @@
+"""
+Tests for sharing snapshots between processes through shared memory
+
+Emil Rekola <emil.rekola@hotmail.com>
+"""
+
+# STD imports
+import os
+import subprocess
+import sys
+from types import MappingProxyType, SimpleNamespace
+
+# 3rd-party imports
+import pytest
+
+# Local imports
+from cryptalert.data_fetcher import shared_snapshot
+from cryptalert.data_fetcher.rates import MarketSnapshot, MarketStatus, Quote, RateSnapshot
+from cryptalert.data_fetcher.shared_snapshot import SharedHeader, SharedSnapshotReader, SharedSnapshotWriter
+from cryptalert.exceptions import UnsupportedOperationModeException
+
+SNAPSHOT = MarketSnapshot(
+    MappingProxyType({"BTC": RateSnapshot(100.0, 99.0, 1.5, 110.0), "ETH": RateSnapshot(10.0, 9.0, -0.5, 11.0)}),
+    MarketStatus(2.0, True),
+    MappingProxyType({"BTC": Quote(100.0, "kraken", 99.0, "coinmotion")})
+)
+
+
+@pytest.fixture(autouse=True)
+def shared_resource_tracker(monkeypatch):
+    # Writer and readers share the resource tracker of the test process, a reader attaching to the segment must not
+    # unregister the segment of the writer
+    monkeypatch.setattr(shared_snapshot, "resource_tracker", SimpleNamespace(unregister=lambda name, rtype: None))
+
+
+@pytest.fixture
+def segment_name(request):
+    return f"cryptalert-test-{os.getpid()}-{request.node.name[-20:]}"
+
+
+def test_reader_gets_what_the_writer_wrote(segment_name):
+    writer = SharedSnapshotWriter(segment_name, capacity=4)
+    reader = SharedSnapshotReader(segment_name)
+
+    try:
+        assert reader.read(0) == (SharedHeader(0, 0.0, 0, 0, 0), None)
+
+        writer.write(SharedHeader(1, 1000.0, 5, 1, 0), SNAPSHOT)
+        header, data = reader.read(0)
+
+        assert header == SharedHeader(1, 1000.0, 5, 1, 0)
+        assert data == SNAPSHOT
+
+        # Data is not unpacked again for a known version
+        assert reader.read(1) == (header, None)
+
+    finally:
+        reader.close()
+        writer.close()
+
+
+def test_torn_read_is_retried(segment_name, monkeypatch):
+    writer = SharedSnapshotWriter(segment_name, capacity=4)
+    reader = SharedSnapshotReader(segment_name)
+    unpack = SharedSnapshotReader._unpack
+    updated = SNAPSHOT._replace(market=MarketStatus(3.0, False))
+
+    # Writer writes a new snapshot while the reader is unpacking the previous one
+    def unpack_during_write(buffer, count, market):
+        data = unpack(buffer, count, market)
+        monkeypatch.setattr(reader, "_unpack", unpack)
+        writer.write(SharedHeader(2, 2000.0, 6, 1, 0), updated)
+        return data
+
+    try:
+        writer.write(SharedHeader(1, 1000.0, 5, 1, 0), SNAPSHOT)
+        monkeypatch.setattr(reader, "_unpack", unpack_during_write)
+
+        assert reader.read(0) == (SharedHeader(2, 2000.0, 6, 1, 0), updated)
+
+        # Sequence number left odd, as if the writer never finished
+        shared_snapshot._SEQ.pack_into(writer._shm.buf, shared_snapshot._SEQ_OFFSET, writer._seq + 1)
+        reader.max_attempts = 3
+        assert reader.read(0) is None
+
+    finally:
+        reader.close()
+        writer.close()
+
+
+def test_segment_of_an_exited_fetcher_is_replaced(segment_name):
+    stale = SharedSnapshotWriter(segment_name, capacity=4)
+    exited = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"], capture_output=True, text=True)
+    shared_snapshot._PID.pack_into(stale._shm.buf, shared_snapshot._PID_OFFSET, int(exited.stdout))
+
+    writer = SharedSnapshotWriter(segment_name, capacity=4)
+    stale._shm.close()
+
+    reader = SharedSnapshotReader(segment_name)
+    assert reader.attached
+
+    reader.close()
+    writer.close()
+
+
+def test_segment_of_a_running_fetcher_is_not_removed(segment_name):
+    running = SharedSnapshotWriter(segment_name, capacity=4)
+    running.write(SharedHeader(1, 1000.0, 5, 1, 0), SNAPSHOT)
+
+    try:
+        with pytest.raises(UnsupportedOperationModeException):
+            SharedSnapshotWriter(segment_name, capacity=4)
+
+        reader = SharedSnapshotReader(segment_name)
+        assert reader.read(0) == (SharedHeader(1, 1000.0, 5, 1, 0), SNAPSHOT)
+        reader.close()
+
+    finally:
+        running.close()
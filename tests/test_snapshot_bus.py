@@ -0,0 +1,74 @@
+"""
+Tests for publishing snapshots to the TUI and the Discord bot
+
+Emil Rekola <emil.rekola@hotmail.com>
+"""
+
+# STD imports
+import asyncio
+from threading import Thread
+from types import MappingProxyType
+
+# Local imports
+from cryptalert.data_fetcher.rates import MarketSnapshot, MarketStatus
+from cryptalert.data_fetcher.snapshot_bus import SnapshotBus
+
+DATA = MarketSnapshot(MappingProxyType({}), MarketStatus(0.0, True))
+
+
+def test_subscribers_get_every_snapshot_until_unsubscribed():
+    bus = SnapshotBus()
+    received = []
+
+    def failing(snapshot):
+        raise RuntimeError("subscriber failed")
+
+    bus.subscribe(failing)
+    callback = bus.subscribe(received.append)
+
+    first = bus.publish(1000.0, DATA)
+    bus.unsubscribe(callback)
+    bus.publish(1010.0, DATA)
+
+    # Failing subscriber does not keep the others from getting the snapshot
+    assert received == [first]
+    assert (first.version, first.timestamp, first.data) == (1, 1000.0, DATA)
+    assert bus.version == 2
+
+
+def test_waiting_thread_wakes_up_for_a_newer_snapshot():
+    bus = SnapshotBus()
+    bus.publish(1000.0, DATA)
+    woken = []
+
+    waiter = Thread(target=lambda: woken.append(bus.wait_for_newer(1, timeout=5.0)))
+    waiter.start()
+    published = bus.publish(1010.0, DATA)
+    waiter.join()
+
+    assert woken == [published]
+    assert bus.wait_for_newer(2, timeout=0.01) is None
+
+
+def test_event_loop_gets_only_the_latest_snapshot_when_behind():
+    bus = SnapshotBus()
+
+    async def consume():
+        queue = asyncio.Queue(maxsize=1)
+        callback = bus.subscribe_async(asyncio.get_running_loop(), queue)
+
+        # Published on another thread while the loop is busy
+        publisher = Thread(target=lambda: [bus.publish(float(second), DATA) for second in range(3)])
+        publisher.start()
+        publisher.join()
+
+        snapshot = await asyncio.wait_for(queue.get(), 5.0)
+        await asyncio.sleep(0)
+        bus.unsubscribe(callback)
+
+        return snapshot, queue.empty()
+
+    snapshot, empty = asyncio.run(consume())
+
+    assert snapshot.version == 3
+    assert empty
@@ -0,0 +1,54 @@
+"""
+Tests for the conditional requests of the rate sources
+
+Emil Rekola <emil.rekola@hotmail.com>
+"""
+
+# STD imports
+import json
+
+# Local imports
+from cryptalert.data_fetcher.metrics import FetchMetrics
+from cryptalert.data_fetcher.sources import CoinmotionSource, KrakenSource
+
+
+def coinmotion_body(buy: float) -> bytes:
+    return json.dumps({
+        "success": True,
+        "payload": {
+            "btceur": {"currencyCode": "BTC", "buy": buy, "sell": buy + 10, "fchangep": 1.0, "fhigh": buy + 20},
+            "market": {"changeSign": "+", "changeAmount": 2.0}
+        }
+    }).encode()
+
+
+def test_validators_of_a_rejected_response_are_not_kept():
+    source = CoinmotionSource("http://localhost", ["btc"], 5.0, FetchMetrics())
+
+    assert source.process_response(200, {"ETag": '"good"'}, coinmotion_body(100.0))
+    assert source.conditional_headers()["If-None-Match"] == '"good"'
+
+    assert not source.process_response(200, {"ETag": '"bad"'}, b"not json")
+    assert not source.process_response(200, {"ETag": '"bad"'}, json.dumps({"success": False}).encode())
+    assert source.conditional_headers()["If-None-Match"] == '"good"'
+    assert source.snapshot.rates["BTC"].sell == 100.0
+
+
+def test_not_modified_keeps_the_previous_snapshot():
+    source = CoinmotionSource("http://localhost", ["btc"], 5.0, FetchMetrics())
+    source.process_response(200, {"ETag": '"first"'}, coinmotion_body(100.0))
+    snapshot = source.snapshot
+
+    assert source.process_response(304, {}, b"")
+    assert source.snapshot is snapshot
+    assert not source.changed
+
+
+def test_responses_of_an_unexpected_shape_are_rejected():
+    coinmotion = CoinmotionSource("http://localhost", ["btc"], 5.0, FetchMetrics())
+    kraken = KrakenSource("http://localhost", ["btc"], 5.0, FetchMetrics())
+
+    assert coinmotion.parse({"success": True, "payload": []}) is None
+    assert coinmotion.parse({"success": True, "payload": {"btceur": "BTC"}}) is None
+    assert kraken.parse({"error": [], "result": []}) is None
+    assert kraken.parse({"error": [], "result": {"XXBTZEUR": []}}) is None
@@ -0,0 +1,57 @@
+"""
+Tests for the watchlists of the channels subscribed to rate updates
+
+Emil Rekola <emil.rekola@hotmail.com>
+"""
+
+# Local imports
+from cryptalert.discord_bot.subscriptions import Subscription, SubscriptionStore
+
+
+def subscription(channel_id: int, guild_id: int, *currencies: str, interval: float = 1.0) -> Subscription:
+    return Subscription(channel_id, guild_id, frozenset(currencies), interval)
+
+
+def due_channels(store: SubscriptionStore, currencies, now: float):
+    return sorted(subscription.channel_id for subscription in store.due(currencies, now))
+
+
+def test_changed_currencies_match_only_the_channels_watching_them():
+    store = SubscriptionStore()
+    store.set(subscription(1, 10, "BTC", "ETH"))
+    store.set(subscription(2, 10, "ETH"))
+    store.set(subscription(3, 20, "XRP"))
+
+    assert due_channels(store, ["ETH"], 0.0) == [1, 2]
+    assert due_channels(store, ["BTC", "XRP"], 60.0) == [1, 3]
+    assert due_channels(store, ["LTC"], 120.0) == []
+    assert store.currencies() == {"BTC", "ETH", "XRP"}
+    assert [sub.channel_id for sub in store.for_guild(10)] == [1, 2]
+
+
+def test_channels_are_not_due_again_before_their_interval():
+    store = SubscriptionStore()
+    store.set(subscription(1, 10, "BTC", interval=5.0))
+
+    assert due_channels(store, ["BTC"], 0.0) == [1]
+    assert due_channels(store, ["BTC"], 299.0) == []
+    assert due_channels(store, ["BTC"], 300.0) == [1]
+
+
+def test_replaced_and_removed_watchlists_leave_the_indexes():
+    store = SubscriptionStore()
+    store.set(subscription(1, 10, "BTC", "ETH"))
+    store.set(subscription(2, 20, "ETH"))
+
+    # Replacing drops the currencies that are no longer watched
+    store.set(subscription(1, 10, "XRP"))
+    assert due_channels(store, ["BTC", "ETH"], 0.0) == [2]
+    assert store.currencies() == {"ETH", "XRP"}
+
+    assert store.remove(2).currencies == {"ETH"}
+    store.set(subscription(1, 10))
+
+    assert len(store) == 0
+    assert store.currencies() == set()
+    assert store.for_guild(10) == [] and store.for_guild(20) == []
+    assert store.remove(1) is None